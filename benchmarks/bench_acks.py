@@ -0,0 +1,91 @@
+"""Benchmark: cost of acknowledged delivery.
+
+Starts a broker process on localhost:<port> (holding up to <messages> values
+per consumer, so none is dropped) and, for fire-and-forget and every window
+size, a producer process publishes <messages> values of <payload> bytes to a
+topic that one consumer pulls, <repeat> times, keeping the best. With a
+window the consumer acks in batches of half the window (or when it would
+wait for more), and the broker sends no more than the window ahead of the
+acks.
+
+run `python -m benchmarks.bench_acks`
+"""
+import argparse
+import multiprocessing
+import socket
+import time
+
+from src.broker import Broker
+from src.middleware import JSONQueue, MiddlewareType
+
+
+def _serve(port, max_held):
+    Broker(port=port, max_held=max_held).run()
+
+
+def _connect(port):
+    """Wait for the broker to accept connections."""
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise ConnectionRefusedError
+
+
+def _produce(port, topic, messages, payload):
+    producer = JSONQueue(topic, MiddlewareType.PRODUCER, port=port)
+    value = "x" * payload
+    for start in range(0, messages, 1000):
+        producer.push_many([value] * min(1000, messages - start))
+    time.sleep(1)  # fechar já podia descartar o que ainda está por enviar
+    producer.connection.close()
+
+
+def _consume(port, window, messages, payload):
+    """Returns the values pulled per second by a consumer with window."""
+    topic = f"/bench/acks/{window}/{time.monotonic_ns()}"
+    consumer = JSONQueue(topic, port=port, window=window)
+    producer = multiprocessing.Process(target=_produce, args=(port, topic, messages, payload))
+    producer.start()
+
+    consumer.pull()
+    start = time.perf_counter()
+    for _ in range(messages - 1):
+        consumer.pull()
+    if window:
+        consumer.ack()
+    elapsed = time.perf_counter() - start
+    producer.join()
+    consumer.connection.close()
+    return (messages - 1) / elapsed
+
+
+def run(port, messages, payload, windows, repeat=1):
+    broker = multiprocessing.Process(target=_serve, args=(port, messages), daemon=True)
+    broker.start()
+    _connect(port)
+
+    print(f"{'window':>10} {'values/s':>10} {'vs none':>8}")
+    base = None
+    try:
+        for window in [None] + windows:
+            rate = max(_consume(port, window, messages, payload) for _ in range(repeat))
+            base = base or rate
+            print(f"{window or 'none':>10} {rate:>10,.0f} {rate / base:>7.0%}")
+    finally:
+        broker.terminate()
+        broker.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5103)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--payload", type=int, default=64, help="bytes of each value")
+    parser.add_argument("--windows", nargs="+", type=int, default=[1, 16, 256, 4096])
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each window, best kept")
+    args = parser.parse_args()
+
+    run(args.port, args.messages, args.payload, args.windows, args.repeat)
@@ -0,0 +1,60 @@
+"""Benchmark: Queue.push vs Queue.push_many for bursts of small readings.
+
+Starts a Broker on localhost:5000 and times how long the broker takes to
+store a burst of values sent one frame per value or batched.
+
+run `python -m benchmarks.bench_batch`
+"""
+import argparse
+import threading
+import time
+
+import src.middleware
+from src.broker import Broker
+from src.middleware import MiddlewareType
+
+QUEUES = {
+    "json": src.middleware.JSONQueue,
+    "xml": src.middleware.XMLQueue,
+    "pickle": src.middleware.PickleQueue,
+}
+
+
+def _wait(broker, topic, last):
+    while str(broker.get_topic(topic)) != str(last):
+        time.sleep(0.0005)
+
+
+def run(messages, queue_types):
+    broker = Broker()
+    threading.Thread(target=broker.run, daemon=True).start()
+
+    print(f"{'queue':>8} {'push (msg/s)':>14} {'push_many (msg/s)':>18}")
+    for name in queue_types:
+        values = list(range(messages))
+
+        queue = QUEUES[name](f"/bench/{name}/push", _type=MiddlewareType.PRODUCER)
+        start = time.perf_counter()
+        for value in values:
+            queue.push(value)
+        _wait(broker, queue.topic, values[-1])
+        single = time.perf_counter() - start
+
+        queue = QUEUES[name](f"/bench/{name}/batch", _type=MiddlewareType.PRODUCER)
+        start = time.perf_counter()
+        queue.push_many(values)
+        _wait(broker, queue.topic, values[-1])
+        batch = time.perf_counter() - start
+
+        print(f"{name:>8} {messages / single:>14,.0f} {messages / batch:>18,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument(
+        "--queue_type", nargs="+", choices=list(QUEUES), default=list(QUEUES)
+    )
+    args = parser.parse_args()
+
+    run(args.messages, args.queue_type)
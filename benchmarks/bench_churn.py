@@ -0,0 +1,69 @@
+"""Benchmark: clients connecting, subscribing and disconnecting over a busy broker.
+
+Every round a client subscribes to <per-client> topics and then disconnects,
+while <clients> other clients stay subscribed to the same topics.
+
+run `python -m benchmarks.bench_churn`
+"""
+import argparse
+import time
+
+from src.topics import TopicTree
+
+
+def _topics(client, per_client):
+    return [f"/site{(client + i) % 100}/sensor{i}" for i in range(per_client)]
+
+
+def _linear_disconnect(subscriptions, address):
+    """Disconnect used before the reverse index: test every subscriber of every topic."""
+    for topic in list(subscriptions):
+        for subscriber in list(subscriptions[topic]):
+            if subscriber[0] == address:
+                subscriptions[topic].remove(subscriber)
+        if not subscriptions[topic]:
+            del subscriptions[topic]
+
+
+def run(sizes, per_client, rounds):
+    print(f"{'clients':>8} {'index (conn/s)':>15} {'linear (conn/s)':>16}")
+    for size in sizes:
+        tree = TopicTree()
+        subscriptions = {}
+        for client in range(size):
+            for topic in _topics(client, per_client):
+                tree.add(topic, (client, None))
+                subscriptions.setdefault(topic, []).append((client, None))
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            address = ("churn", i)
+            for topic in _topics(i, per_client):
+                tree.add(topic, (address, None))
+            tree.remove_address(address)
+        index = time.perf_counter() - start
+        assert len(tree.get(_topics(0, per_client)[0])) == len(subscriptions[_topics(0, per_client)[0]])
+
+        linear_rounds = max(1, rounds // 100)
+        start = time.perf_counter()
+        for i in range(linear_rounds):
+            address = ("churn", i)
+            for topic in _topics(i, per_client):
+                subscriptions.setdefault(topic, []).append((address, None))
+            _linear_disconnect(subscriptions, address)
+        linear = time.perf_counter() - start
+
+        print(f"{size:>8} {rounds / index:>15,.0f} {linear_rounds / linear:>16,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", help="clients that stay subscribed", nargs="+", type=int,
+        default=[100, 1000, 10000],
+    )
+    parser.add_argument("--per-client", type=int, default=10, help="topics of each client")
+    parser.add_argument("--rounds", type=int, default=20000, help="clients that churn")
+    args = parser.parse_args()
+
+    run(args.sizes, args.per_client, args.rounds)
@@ -0,0 +1,73 @@
+"""Benchmark: throughput of the multi-process broker by number of workers.
+
+For each worker count it starts a Cluster on localhost:5200 and <clients>
+client processes. Each client subscribes to its own topic on one connection
+and publishes <messages> values to it on another, so most values cross from
+one worker to another.
+
+run `python -m benchmarks.bench_cluster`
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+
+from src.cluster import Cluster
+from src.protocol import CDProto, FrameDecoder
+
+PORT = 5200
+
+
+def _client(index, messages, start, results):
+    topic = f"/bench{index}/value"
+    consumer = socket.create_connection(("localhost", PORT))
+    CDProto.send_msg(consumer, "subscribe", 2, topic)
+    producer = socket.create_connection(("localhost", PORT))
+    frames = CDProto.encode_batch(2, topic, list(range(messages)))
+    decoder = FrameDecoder()
+
+    start.wait()
+    begin = time.perf_counter()
+    for frame in frames:
+        producer.sendall(frame)
+    missing = messages
+    while missing:
+        decoder.feed(consumer.recv(2**16))
+        missing -= len(decoder.frames())
+    results.put(time.perf_counter() - begin)
+
+
+def run(workers, clients, messages):
+    cluster = Cluster(workers=workers, port=PORT)
+    cluster.start()
+
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(clients + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_client, args=(i, messages, start, results))
+        for i in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(0.5)  # subscrições propagadas aos donos dos tópicos
+    start.wait()
+    elapsed = max(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    cluster.stop()
+
+    print(f"{workers:>8} {clients * messages / elapsed:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--clients", type=int, default=os.cpu_count() * 2)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'msg/s':>14}")
+    for workers in args.workers:
+        run(workers, args.clients, args.messages)
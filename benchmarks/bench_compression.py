@@ -0,0 +1,84 @@
+"""Benchmark: bandwidth saved vs CPU spent by compressing frames, by payload size.
+
+Encodes and decodes publish frames of JSON documents of growing size, made
+of the quotes sent by producer.py, with and without zlib, and of random
+bytes (pickle), which do not compress.
+
+run `python -m benchmarks.bench_compression`
+"""
+import argparse
+import os
+import random
+import timeit
+
+from src.protocol import COMPRESSORS, CDProto, FrameDecoder
+
+QUOTES = [  # as citações de producer.py
+    "Ó mar salgado, quanto do teu sal",
+    "São lágrimas de Portugal!",
+    "Por te cruzarmos, quantas mães choraram,",
+    "Quantos filhos em vão rezaram!",
+    "Quantas noivas ficaram por casar",
+    "Para que fosses nosso, ó mar!",
+    "Valeu a pena? Tudo vale a pena",
+    "Se a alma não é pequena.",
+    "Quem quer passar além do Bojador",
+    "Tem que passar além da dor.",
+    "Deus ao mar o perigo e o abismo deu,",
+    "Mas nele é que espelhou o céu.",
+]
+
+
+def _document(size):
+    """A JSON-able document of about size bytes."""
+    rng = random.Random(size)
+    document = []
+    while sum(len(quote) for quote in document) < size:
+        document.append(rng.choice(QUOTES))
+    return document
+
+
+def _cost(frame, compression, number):
+    """Seconds to decode frame on a connection that negotiated compression."""
+    decoder = FrameDecoder()
+    if compression is not None:
+        decoder.decompress = COMPRESSORS[compression][1]
+
+    def decode():
+        decoder.feed(frame)
+        [(header, payload)] = decoder.frames()
+        CDProto.decode_msg(payload, header)
+
+    return timeit.timeit(decode, number=number) / number
+
+
+def run(sizes, compression):
+    print(f"{'payload':>8} {'value':>7} {'raw B':>9} {'wire B':>9} {'saved':>6} "
+          f"{'enc us':>9} {'enc+z us':>9} {'dec us':>9} {'dec+z us':>9}")
+    for size in sizes:
+        for kind, serializer, value in (
+            ("text", 0, _document(size)),
+            ("random", 2, os.urandom(size)),
+        ):
+            number = max(10, 2**20 // size)
+            raw = CDProto.encode_msg("publish", serializer, "/bench", value, True)
+            wire = CDProto.encode_msg("publish", serializer, "/bench", value, True, compression)
+            encode = timeit.timeit(lambda: CDProto.encode_msg(
+                "publish", serializer, "/bench", value, True), number=number) / number
+            encode_z = timeit.timeit(lambda: CDProto.encode_msg(
+                "publish", serializer, "/bench", value, True, compression), number=number) / number
+            print(f"{size:>8} {kind:>7} {len(raw):>9,} {len(wire):>9,} "
+                  f"{1 - len(wire) / len(raw):>6.0%} {encode * 1e6:>9.1f} {encode_z * 1e6:>9.1f} "
+                  f"{_cost(raw, None, number) * 1e6:>9.1f} "
+                  f"{_cost(wire, compression, number) * 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int,
+                        default=[64, 512, 4096, 32768, 262144, 1048576],
+                        help="bytes of each value")
+    parser.add_argument("--compression", choices=list(COMPRESSORS), default="zlib")
+    args = parser.parse_args()
+
+    run(args.sizes, args.compression)
@@ -0,0 +1,82 @@
+"""Benchmark: selectors Broker vs AsyncBroker.
+
+Each engine runs in its own process on localhost:5000. The benchmark opens
+<connections> subscribers to one topic, then publishes <messages> values and
+times until every subscriber got every value.
+
+run `python -m benchmarks.bench_engines`
+"""
+import argparse
+import multiprocessing
+import selectors
+import socket
+import time
+
+from src.aiobroker import AsyncBroker
+from src.broker import Broker
+from src.protocol import CDProto, FrameDecoder
+
+ENGINES = {"selectors": Broker, "asyncio": AsyncBroker}
+
+
+def _serve(engine):
+    ENGINES[engine]().run()
+
+
+def _connect():
+    """Connect to the broker, retrying while it starts."""
+    for _ in range(100):
+        try:
+            return socket.create_connection(("localhost", 5000))
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise ConnectionRefusedError
+
+
+def run(engine, connections, messages):
+    process = multiprocessing.Process(target=_serve, args=(engine,), daemon=True)
+    process.start()
+    _connect().close()
+
+    start = time.perf_counter()
+    sel = selectors.DefaultSelector()
+    for _ in range(connections):
+        sock = _connect()
+        CDProto.send_msg(sock, "subscribe", 2, "/bench")
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ, FrameDecoder())
+    connect = time.perf_counter() - start
+    time.sleep(0.2)  # deixa o broker tratar as subscrições
+
+    producer = _connect()
+    start = time.perf_counter()
+    for frame in CDProto.encode_batch(2, "/bench", list(range(messages))):
+        producer.sendall(frame)
+
+    missing = connections * messages
+    while missing:
+        for key, _ in sel.select():
+            key.data.feed(key.fileobj.recv(2**16))
+            missing -= len(key.data.frames())
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{engine:>10} {connections:>6} conns in {connect:6.3f}s "
+        f"{connections * messages / elapsed:>12,.0f} deliveries/s"
+    )
+    for key in list(sel.get_map().values()):
+        key.fileobj.close()
+    producer.close()
+    process.terminate()
+    process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--messages", type=int, default=1000)
+    args = parser.parse_args()
+
+    for connections in args.connections:
+        for engine in ENGINES:
+            run(engine, connections, args.messages)
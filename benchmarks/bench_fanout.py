@@ -0,0 +1,112 @@
+"""Benchmark: fan-out of published frames to subscribers that are behind.
+
+Every one of <subscribers> socket pairs gets the same <frames> frames of
+<size> bytes queued in its outbox, as the broker does when a subscriber
+has not read the previous ones yet, and then the outboxes are written out
+while the other ends read. The broker's outbox (the shared frames
+themselves, written with sendmsg) is compared with the bytearray outbox it
+used before, which copied every frame into the outbox of every subscriber.
+
+Prints the time to queue and to write, the write syscalls and the peak
+memory allocated while queueing.
+
+run `python -m benchmarks.bench_fanout`
+"""
+import argparse
+import socket
+import time
+import tracemalloc
+
+from src.broker import _Outbox
+
+
+class _CopyingOutbox:
+    """Outbox used before: every frame copied into a bytearray per subscriber."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, frame):
+        self.data += frame
+
+    def write(self, conn):
+        sent = conn.send(self.data)
+        del self.data[:sent]
+        return sent
+
+
+def _pairs(subscribers):
+    pairs = []
+    for _ in range(subscribers):
+        writer, reader = socket.socketpair()
+        writer.setblocking(False)
+        reader.setblocking(False)
+        pairs.append((writer, reader))
+    return pairs
+
+
+def _queue(outbox_type, subscribers, frames):
+    outboxes = [outbox_type() for _ in range(subscribers)]
+    for frame in frames:
+        for outbox in outboxes:
+            outbox.append(frame)
+    return outboxes
+
+
+def _drain(pairs, outboxes):
+    """Writes every outbox out, reading the other ends; returns the write syscalls."""
+    buffer = bytearray(2**16)
+    writes = 0
+    while any(outboxes):
+        for (writer, reader), outbox in zip(pairs, outboxes):
+            if outbox:
+                try:
+                    outbox.write(writer)
+                except BlockingIOError:
+                    pass
+                writes += 1
+            try:
+                while reader.recv_into(buffer):
+                    pass
+            except BlockingIOError:
+                pass
+    return writes
+
+
+def run(subscribers, count, size):
+    # tramas distintas, como as de publicações diferentes
+    frames = [bytes([i % 256]) * size for i in range(count)]
+    print(f"{'outbox':>10} {'queue ms':>9} {'write ms':>9} {'writes':>8} {'peak KiB':>9}")
+    for name, outbox_type in (("bytearray", _CopyingOutbox), ("shared", _Outbox)):
+        pairs = _pairs(subscribers)
+        start = time.perf_counter()
+        outboxes = _queue(outbox_type, subscribers, frames)
+        queued = time.perf_counter() - start
+        start = time.perf_counter()
+        writes = _drain(pairs, outboxes)
+        written = time.perf_counter() - start
+
+        tracemalloc.start()
+        outboxes = _queue(outbox_type, subscribers, frames)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del outboxes
+
+        for writer, reader in pairs:
+            writer.close()
+            reader.close()
+        print(f"{name:>10} {queued * 1000:>9.1f} {written * 1000:>9.1f} {writes:>8} "
+              f"{peak / 1024:>9,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--frames", type=int, default=1000, help="frames queued to each subscriber")
+    parser.add_argument("--size", type=int, default=4096, help="bytes of each frame")
+    args = parser.parse_args()
+
+    run(args.subscribers, args.frames, args.size)
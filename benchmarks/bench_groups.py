@@ -0,0 +1,108 @@
+"""Benchmark: consumer group throughput by number of members.
+
+Starts a broker process on localhost:<port> and, for every group size, runs
+that many consumer processes in one group of a topic, each spending <work>
+milliseconds of CPU (or of waiting, with --io) on every value it pulls. A
+producer publishes <messages> values and the time until the group processed
+all of them gives the throughput; with the values shared between the members
+it should grow linearly with their number, up to the cores of the machine
+(with --io, even past them).
+
+run `python -m benchmarks.bench_groups`
+"""
+import argparse
+import multiprocessing
+import socket
+import time
+
+from src.broker import Broker
+from src.middleware import JSONQueue, MiddlewareType
+from src.protocol import BALANCES, ROUND_ROBIN
+
+
+def _serve(port):
+    Broker(port=port).run()
+
+
+def _connect(port):
+    """Wait for the broker to accept connections."""
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise ConnectionRefusedError
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _member(port, topic, group, balance, work, io, ready, done):
+    queue = JSONQueue(topic, port=port, group=group, balance=balance)
+    ready.put(True)
+    while True:
+        _, value = queue.pull()
+        if value is None:  # fim: cada membro recebe um
+            break
+        (time.sleep if io else _busy)(work)
+        done.put(True)
+    queue.connection.close()
+
+
+def run(port, sizes, messages, work, balance, io=False):
+    broker = multiprocessing.Process(target=_serve, args=(port,), daemon=True)
+    broker.start()
+    _connect(port)
+
+    print(f"{'members':>8} {'values/s':>10} {'speedup':>8}")
+    base = None
+    try:
+        for members in sizes:
+            topic = f"/bench/groups/{members}/{time.monotonic_ns()}"
+            ready = multiprocessing.Queue()
+            done = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=_member, args=(
+                    port, topic, "bench", balance, work / 1000, io, ready, done))
+                for _ in range(members)
+            ]
+            for process in processes:
+                process.start()
+            for _ in processes:
+                ready.get()
+            time.sleep(0.2)  # deixa o broker tratar as subscrições
+
+            producer = JSONQueue(topic, MiddlewareType.PRODUCER, port=port)
+            start = time.perf_counter()
+            producer.push_many(range(messages))
+            for _ in range(messages):
+                done.get()
+            elapsed = time.perf_counter() - start
+            producer.push_many([None] * members)
+            for process in processes:
+                process.join()
+            producer.connection.close()
+
+            rate = messages / elapsed
+            base = base or rate
+            print(f"{members:>8} {rate:>10,.0f} {rate / base:>7.2f}x")
+    finally:
+        broker.terminate()
+        broker.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5102)
+    parser.add_argument("--members", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--work", type=float, default=1.0, help="milliseconds of CPU per value")
+    parser.add_argument("--io", action="store_true", help="wait instead of computing")
+    parser.add_argument("--balance", choices=BALANCES, default=ROUND_ROBIN)
+    args = parser.parse_args()
+
+    run(args.port, args.members, args.messages, args.work, args.balance, args.io)
@@ -0,0 +1,44 @@
+"""Benchmark: small publishes the broker can read and handle per second.
+
+Starts a Broker on localhost:5000 and writes bursts of pre-encoded publish
+frames to it, timing until the broker stored the last one.
+
+run `python -m benchmarks.bench_ingest`
+"""
+import argparse
+import socket
+import threading
+import time
+
+from src.broker import Broker
+from src.protocol import CDProto
+
+
+def run(messages, burst, serializer):
+    broker = Broker()
+    threading.Thread(target=broker.run, daemon=True).start()
+
+    sock = socket.create_connection(("localhost", 5000))
+    frames = [
+        CDProto.encode_msg("publish", serializer, "/bench", i) for i in range(messages)
+    ]
+
+    start = time.perf_counter()
+    for i in range(0, messages, burst):
+        sock.sendall(b"".join(frames[i : i + burst]))
+    while str(broker.get_topic("/bench")) != str(messages - 1):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    print(f"{messages} publishes in {elapsed:.3f}s: {messages / elapsed:,.0f} msg/s")
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--burst", help="frames per send", type=int, default=1000)
+    parser.add_argument("--serializer", type=int, choices=[0, 1, 2], default=0)
+    args = parser.parse_args()
+
+    run(args.messages, args.burst, args.serializer)
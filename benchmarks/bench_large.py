@@ -0,0 +1,54 @@
+"""Benchmark: throughput of large messages relayed through the broker.
+
+Starts a Broker on localhost:5000, pushes values of 1 KiB up to 16 MiB with
+a PickleQueue and times how long a subscribed PickleQueue takes to pull them
+all. Messages of 64 KiB or more travel in extended frames.
+
+run `python -m benchmarks.bench_large`
+"""
+import argparse
+import threading
+import time
+
+from src.broker import Broker
+from src.middleware import MiddlewareType, PickleQueue
+
+SIZES = {"1KiB": 2**10, "64KiB": 2**16, "1MiB": 2**20, "16MiB": 2**24}
+
+
+def run(volume, sizes):
+    broker = Broker()
+    threading.Thread(target=broker.run, daemon=True).start()
+
+    print(f"{'size':>8} {'messages':>9} {'msg/s':>10} {'MiB/s':>8}")
+    for name in sizes:
+        size = SIZES[name]
+        messages = max(4, volume // size)
+        value = bytes(size)
+
+        topic = f"/bench/large/{name}"
+        consumer = PickleQueue(topic)
+        producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+        time.sleep(0.1)
+
+        start = time.perf_counter()
+        thread = threading.Thread(
+            target=lambda: [producer.push(value) for _ in range(messages)], daemon=True
+        )
+        thread.start()
+        for _ in range(messages):
+            consumer.pull()
+        elapsed = time.perf_counter() - start
+        thread.join()
+
+        print(f"{name:>8} {messages:>9} {messages / elapsed:>10,.0f} "
+              f"{messages * size / elapsed / 2**20:>8,.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--volume", type=int, default=2**28, help="bytes sent per size")
+    parser.add_argument("--size", nargs="+", choices=list(SIZES), default=list(SIZES))
+    args = parser.parse_args()
+
+    run(args.volume, args.size)
@@ -0,0 +1,54 @@
+"""Benchmark: append throughput and catch-up replay speed of the topic log.
+
+Appends publish frames to a TopicLog in a temporary directory, reopens it
+(reading the indexes) and replays the whole topic and its last tenth.
+
+run `python -m benchmarks.bench_log`
+"""
+import argparse
+import tempfile
+import time
+
+from src.protocol import CDProto
+from src.storage import TopicLog
+
+
+def run(messages, size):
+    frame = CDProto.encode_msg("publish", 2, "/bench/log", bytes(size), True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = TopicLog(directory)
+        start = time.perf_counter()
+        for _ in range(messages):
+            log.append("/bench/log", frame)
+        append = time.perf_counter() - start
+        log.close()
+
+        start = time.perf_counter()
+        log = TopicLog(directory)
+        reopen = time.perf_counter() - start
+
+        start = time.perf_counter()
+        count = sum(1 for _ in log.read("/bench/log"))
+        replay = time.perf_counter() - start
+        assert count == messages
+
+        start = time.perf_counter()
+        tail = sum(1 for _ in log.read("/bench/log", messages - messages // 10))
+        replay_tail = time.perf_counter() - start
+        log.close()
+
+    mib = messages * len(frame) / 2**20
+    print(f"append:        {messages / append:>12,.0f} msg/s {mib / append:>8,.1f} MiB/s")
+    print(f"reopen:        {reopen * 1000:>12,.1f} ms")
+    print(f"replay all:    {messages / replay:>12,.0f} msg/s {mib / replay:>8,.1f} MiB/s")
+    print(f"replay tail:   {tail / replay_tail:>12,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--size", type=int, default=100, help="bytes of each value")
+    args = parser.parse_args()
+
+    run(args.messages, args.size)
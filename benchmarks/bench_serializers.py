@@ -0,0 +1,43 @@
+"""Benchmark: encode/decode cost and frame size of each serializer.
+
+run `python -m benchmarks.bench_serializers`
+"""
+import argparse
+import timeit
+
+from src.broker import Serializer
+from src.protocol import CDProto
+
+SAMPLES = {
+    "temp": ("/temp", 21),
+    "weather": ("/weather/pressure", 10532),
+    "float": ("/weather2/temperature/fahrenheit", 69.8),
+    "msg": ("/msg", "Valeu a pena? Tudo vale a pena"),
+}
+
+
+def run(number):
+    print(f"{'sample':>8} {'serializer':>10} {'bytes':>6} {'encode (us)':>12} {'decode (us)':>12}")
+    for name, (topic, value) in SAMPLES.items():
+        for serializer in Serializer:
+            frame = CDProto.encode_msg("publish", serializer.value, topic, value)
+            payload = frame[3:]
+            encode = timeit.timeit(
+                lambda: CDProto.encode_msg("publish", serializer.value, topic, value),
+                number=number,
+            )
+            decode = timeit.timeit(
+                lambda: CDProto.decode_msg(payload, serializer.value), number=number
+            )
+            print(
+                f"{name:>8} {serializer.name:>10} {len(frame):>6} "
+                f"{encode / number * 1e6:>12.2f} {decode / number * 1e6:>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    run(args.number)
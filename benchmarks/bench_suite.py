@@ -0,0 +1,264 @@
+"""Benchmark suite: end-to-end throughput and latency of the broker and its clients.
+
+Starts a broker process on localhost:<port> and, for every combination of
+serializer, payload size and fan-out, runs <producers> producer processes
+and <consumers> consumer processes using the middleware Queues. Producers
+publish <messages> values each (at <rate> values/s, or as fast as they
+can) spread over <topics> topics; every topic is subscribed by <fanout>
+consumers. Each value carries the time it was sent, so consumers measure
+the end-to-end latency of every delivery.
+
+Prints messages/s, deliveries/s and p50/p99/p999 latency per scenario and,
+with --output, writes them as JSON to compare between commits.
+
+run `python -m benchmarks.bench_suite --quick` (under a minute)
+run `python -m benchmarks.bench_suite --output results.json`
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import platform
+import socket
+import subprocess
+import time
+
+from src.aiobroker import AsyncBroker
+from src.broker import Broker, Serializer
+from src.middleware import Connection, MiddlewareType, Queue
+
+ENGINES = {"selectors": Broker, "asyncio": AsyncBroker}
+SERIALIZERS = {serializer.name.lower(): serializer.value for serializer in Serializer}
+
+QUICK = {
+    "serializers": ["json", "binary"],
+    "payloads": [64, 4096],
+    "fanouts": [1, 4],
+    "producers": 2,
+    "consumers": 4,
+    "topics": 4,
+    "messages": 2000,
+}
+
+
+def _serve(engine, port):
+    ENGINES[engine](port=port).run()
+
+
+def _connect(port):
+    """Wait for the broker to accept connections."""
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise ConnectionRefusedError
+
+
+def _queue_type(ser_type):
+    return type("BenchQueue", (Queue,), {"ser_type": ser_type})
+
+
+def _topics_of(prefix, consumer, consumers, topics, fanout):
+    """Topics subscribed by consumer: each topic gets <fanout> consumers."""
+    groups = consumers // fanout
+    return [f"{prefix}/{t}" for t in range(topics) if t % groups == consumer % groups]
+
+
+def _expected(topic_names, producers, messages, topics):
+    """Values published to topic_names: producer p sends its k-th value to topic (p + k) % topics."""
+    counts = [0] * topics
+    for p in range(producers):
+        for k in range(messages):
+            counts[(p + k) % topics] += 1
+    return sum(counts[int(name.rsplit("/", 1)[1])] for name in topic_names)
+
+
+def _consume(port, ser_type, topic_names, expected, idle, ready, results):
+    queue_type = _queue_type(ser_type)
+    connection = Connection(ser_type, port=port)
+    queues = [queue_type(topic, port=port, connection=connection) for topic in topic_names]
+    connection.sock.settimeout(idle)
+    ready.put(True)
+
+    latencies = []
+    received = 0
+    last = None
+    try:
+        while received < expected and connection.fill():
+            now = time.monotonic_ns()
+            for queue in queues:
+                while queue.prefetched:
+                    value = queue.prefetched.popleft().message
+                    latencies.append(now - int(value.split(":", 1)[0]))
+                    received += 1
+            last = now
+    except socket.timeout:
+        pass  # o broker descartou valores: fica com os que chegaram
+    connection.close()
+    results.put((received, last, latencies))
+
+
+def _produce(port, ser_type, prefix, producer, topics, messages, payload, rate, start):
+    queue_type = _queue_type(ser_type)
+    connection = Connection(ser_type, port=port)
+    queues = [
+        queue_type(f"{prefix}/{t}", MiddlewareType.PRODUCER, port=port, connection=connection)
+        for t in range(topics)
+    ]
+    padding = "x" * payload
+    start.wait()
+    began = time.monotonic()
+    for k in range(messages):
+        if rate:
+            # ao ritmo pedido a latência não inclui a fila que uma rajada criaria
+            delay = began + k / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        queues[(producer + k) % topics].push(f"{time.monotonic_ns()}:{padding}")
+    time.sleep(1)  # fechar já podia descartar o que ainda está por enviar
+    connection.close()
+
+
+def _percentile(ordered, fraction):
+    return ordered[int(fraction * (len(ordered) - 1))] / 1000 if ordered else None
+
+
+def scenario(port, serializer, producers, consumers, topics, fanout, payload, messages,
+             rate=0, idle=2.0):
+    """Runs one scenario and returns its results."""
+    # tópicos novos em cada cenário: os valores guardados dos anteriores não contam
+    prefix = f"/bench/{serializer}/{payload}/{fanout}/{time.monotonic_ns()}"
+    ser_type = SERIALIZERS[serializer]
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    start = multiprocessing.Event()
+
+    expected = 0
+    processes = []
+    for consumer in range(consumers):
+        topic_names = _topics_of(prefix, consumer, consumers, topics, fanout)
+        count = _expected(topic_names, producers, messages, topics)
+        expected += count
+        processes.append(multiprocessing.Process(
+            target=_consume, args=(port, ser_type, topic_names, count, idle, ready, results)))
+    for producer in range(producers):
+        processes.append(multiprocessing.Process(
+            target=_produce,
+            args=(port, ser_type, prefix, producer, topics, messages, payload, rate, start)))
+    for process in processes:
+        process.start()
+    for _ in range(consumers):
+        ready.get()
+    time.sleep(0.2)  # deixa o broker tratar as subscrições
+
+    began = time.monotonic_ns()
+    start.set()
+    delivered = 0
+    ended = began
+    latencies = []
+    for _ in range(consumers):
+        received, last, consumer_latencies = results.get()
+        delivered += received
+        ended = max(ended, last or began)
+        latencies.extend(consumer_latencies)
+    for process in processes:
+        process.join()
+
+    seconds = (ended - began) / 1e9
+    latencies.sort()
+    return {
+        "serializer": serializer,
+        "producers": producers,
+        "consumers": consumers,
+        "topics": topics,
+        "fanout": fanout,
+        "payload": payload,
+        "rate": rate,
+        "published": producers * messages,
+        "expected": expected,
+        "delivered": delivered,
+        "seconds": round(seconds, 4),
+        "msgs_per_sec": round(producers * messages / seconds) if seconds else None,
+        "deliveries_per_sec": round(delivered / seconds) if seconds else None,
+        "latency_us": {
+            "p50": _percentile(latencies, 0.5),
+            "p99": _percentile(latencies, 0.99),
+            "p999": _percentile(latencies, 0.999),
+            "max": _percentile(latencies, 1),
+        },
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    broker = multiprocessing.Process(target=_serve, args=(args.engine, args.port), daemon=True)
+    broker.start()
+    _connect(args.port)
+
+    print(f"{'serializer':>10} {'payload':>7} {'fanout':>6} {'msg/s':>10} {'deliv/s':>10} "
+          f"{'p50 us':>9} {'p99 us':>9} {'p999 us':>9} {'lost':>6}")
+    results = []
+    try:
+        for serializer, payload, fanout in itertools.product(
+                args.serializers, args.payloads, args.fanouts):
+            result = scenario(args.port, serializer, args.producers, args.consumers,
+                              args.topics, fanout, payload, args.messages, args.rate, args.idle)
+            results.append(result)
+            latency = result["latency_us"]
+            print(f"{serializer:>10} {payload:>7} {fanout:>6} {result['msgs_per_sec'] or 0:>10,} "
+                  f"{result['deliveries_per_sec'] or 0:>10,} {latency['p50'] or 0:>9,.0f} "
+                  f"{latency['p99'] or 0:>9,.0f} {latency['p999'] or 0:>9,.0f} "
+                  f"{result['expected'] - result['delivered']:>6}")
+    finally:
+        broker.terminate()
+        broker.join()
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({
+                "commit": _commit(),
+                "engine": args.engine,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "messages": args.messages,
+                "results": results,
+            }, output, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quick", action="store_true", help="small matrix, under a minute")
+    parser.add_argument("--engine", choices=ENGINES, default="selectors")
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--serializers", nargs="+", choices=SERIALIZERS, default=list(SERIALIZERS))
+    parser.add_argument("--payloads", nargs="+", type=int, default=[64, 1024, 16384],
+                        help="bytes of padding in each value")
+    parser.add_argument("--fanouts", nargs="+", type=int, default=[1, 4, 16],
+                        help="consumers of each topic")
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--consumers", type=int, default=16)
+    parser.add_argument("--topics", type=int, default=16)
+    parser.add_argument("--messages", type=int, default=10000, help="values of each producer")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="values per second of each producer (0: as fast as possible)")
+    parser.add_argument("--idle", type=float, default=2.0,
+                        help="seconds a consumer waits for a value before giving up")
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+    if args.quick:
+        parser.set_defaults(**QUICK)
+        args = parser.parse_args()
+    for fanout in args.fanouts:
+        if fanout > args.consumers or args.consumers % fanout:
+            parser.error(f"--consumers must be a multiple of every fan-out ({fanout})")
+
+    run(args)
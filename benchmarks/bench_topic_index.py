@@ -0,0 +1,57 @@
+"""Micro-benchmark: cost of routing one publish as the number of topics grows.
+
+run `python -m benchmarks.bench_topic_index`
+"""
+import argparse
+import timeit
+
+from src.topics import TopicTree
+
+
+def _topics(count):
+    """Generate <count> distinct three level topics."""
+    return [f"/site{i % 100}/sensor{i}/value" for i in range(count)]
+
+
+def _linear_match(subscriptions, topic):
+    """Routing used before the topic index: test every subscribed topic."""
+    return [
+        subscriber
+        for sub_topic, subscribers in subscriptions.items()
+        if sub_topic == topic or sub_topic in topic
+        for subscriber in subscribers
+    ]
+
+
+def run(sizes, number):
+    print(f"{'topics':>8} {'trie (us)':>10} {'linear (us)':>12}")
+    for size in sizes:
+        tree = TopicTree()
+        subscriptions = {}
+        for i, topic in enumerate(_topics(size)):
+            tree.add(topic, (i, None))
+            subscriptions[topic] = [(i, None)]
+        tree.add("/site7", ("root", None))
+        subscriptions["/site7"] = [("root", None)]
+
+        published = "/site7/sensor7/value"
+        trie = timeit.timeit(lambda: list(tree.match(published)), number=number)
+        linear = timeit.timeit(
+            lambda: _linear_match(subscriptions, published), number=max(1, number // 100)
+        )
+        print(
+            f"{size:>8} {trie / number * 1e6:>10.2f} "
+            f"{linear / max(1, number // 100) * 1e6:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", help="topic counts", nargs="+", type=int,
+        default=[100, 1000, 10000, 100000],
+    )
+    parser.add_argument("--number", help="publishes per size", type=int, default=10000)
+    args = parser.parse_args()
+
+    run(args.sizes, args.number)
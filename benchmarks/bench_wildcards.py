@@ -0,0 +1,62 @@
+"""Benchmark: routing a publish through many wildcard subscriptions.
+
+Subscribes <patterns> patterns mixing exact topics, "+" and "#" wildcards
+and times matching a published topic with the index and by testing every
+pattern in turn.
+
+run `python -m benchmarks.bench_wildcards`
+"""
+import argparse
+import timeit
+
+from src.topics import TopicTree, matches, split_topic
+
+
+def _patterns(count):
+    """Generate <count> distinct patterns over four level topics."""
+    patterns = []
+    for i in range(count):
+        site, sensor = f"site{i % 1000}", f"sensor{i}"
+        kind = i % 4
+        if kind == 0:
+            patterns.append(f"/{site}/{sensor}/value")
+        elif kind == 1:
+            patterns.append(f"/{site}/+/{sensor}")
+        elif kind == 2:
+            patterns.append(f"/+/{sensor}/#")
+        else:
+            patterns.append(f"/{site}/{sensor}/#")
+    return patterns
+
+
+def _linear_match(patterns, topic):
+    """Test every pattern, and each of its ancestors, against topic."""
+    depth = len(split_topic(topic))
+    ancestors = ["/".join(split_topic(topic)[:i]) for i in range(2, depth + 1)]
+    return [pattern for pattern in patterns
+            if any(matches(pattern, ancestor) for ancestor in ancestors)]
+
+
+def run(count, number):
+    patterns = _patterns(count)
+    tree = TopicTree()
+    for i, pattern in enumerate(patterns):
+        tree.add(pattern, (i, None))
+
+    published = "/site7/sensor7/value"
+    index = timeit.timeit(lambda: list(tree.match(published)), number=number)
+    linear = timeit.timeit(lambda: _linear_match(patterns, published), number=1)
+    assert len(dict(tree.match(published))) == len(_linear_match(patterns, published))
+
+    print(f"patterns:     {count:>12,}")
+    print(f"index:        {index / number * 1e6:>12.2f} us/publish")
+    print(f"linear:       {linear * 1e6:>12.2f} us/publish")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patterns", type=int, default=100000)
+    parser.add_argument("--number", help="publishes matched", type=int, default=10000)
+    args = parser.parse_args()
+
+    run(args.patterns, args.number)
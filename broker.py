@@ -1,7 +1,99 @@
 """Call broker."""
+import argparse
 
+from src.aiobroker import AsyncBroker
 from src.broker import Broker
+from src.cluster import Cluster
+from src.history import History
+from src.profiling import LoopProfiler, profiled
+from src.storage import TopicLog
+
+engines = {"selectors": Broker, "asyncio": AsyncBroker}
 
 if __name__ == "__main__":
-    broker = Broker()
-    broker.run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--engine",
+        help="event loop of the broker",
+        choices=list(engines.keys()),
+        default="selectors",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of broker processes sharing the port (selectors engine)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--log-dir",
+        help="directory of the durable topic log (single process only)",
+        default=None,
+    )
+    parser.add_argument(
+        "--history",
+        help="values kept in memory per topic for subscribers asking for the last ones",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--history-bytes",
+        help="memory cap of the history of each topic",
+        type=int,
+        default=2**20,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="port serving the metrics as plain text over HTTP (single process only)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--max-held",
+        help="values held per consumer out of credits before its overflow policy applies",
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "--ack-timeout",
+        help="seconds a consumer with acknowledged delivery has to ack a value before it is resent",
+        type=float,
+        default=10.0,
+    )
+    parser.add_argument(
+        "--max-payload",
+        help="largest payload, in bytes, of a frame received (once decompressed)",
+        type=int,
+        default=2**26,
+    )
+    parser.add_argument(
+        "--loop-stats",
+        help="time every event loop callback and phase, warning about callbacks slower than "
+             "--slow-callback (single process only)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--slow-callback",
+        help="seconds after which a callback is logged as slow",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--profile",
+        help="run the broker under cProfile and dump the stats to this file on shutdown",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        broker = Cluster(args.workers)
+    else:
+        log = TopicLog(args.log_dir) if args.log_dir else None
+        history = History(args.history, args.history_bytes) if args.history else None
+        profiler = LoopProfiler(args.slow_callback) if args.loop_stats else None
+        broker = engines[args.engine](log=log, history=history, metrics_port=args.metrics_port,
+                                      profiler=profiler, max_held=args.max_held,
+                                      ack_timeout=args.ack_timeout, max_payload=args.max_payload)
+    if args.profile:
+        profiled(broker.run, args.profile)
+    else:
+        broker.run()
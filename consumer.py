@@ -19,8 +19,13 @@ if __name__ == "__main__":
         choices=list(q_protocol.keys()),
         default=list(q_protocol.keys())[0],
     )
+    parser.add_argument(
+        "--group",
+        help="consumer group sharing the messages of the topic",
+        default=None,
+    )
     args = parser.parse_args()
 
-    c = Consumer(args.topic, q_protocol[args.queue_type])
+    c = Consumer(args.topic, q_protocol[args.queue_type], args.group)
 
     c.run(int(args.length))
@@ -0,0 +1,67 @@
+"""In-flight windows of the consumers with acknowledged delivery."""
+from collections import OrderedDict
+from typing import List
+
+
+class Window:
+    """Values sent to one connection and not acked yet.
+
+    Values are numbered from 1 in the order they are sent on the connection,
+    which is the order it receives them in, so an ack of number n covers
+    every value sent up to n. A value sent again (after timeout seconds
+    without an ack, or to the connection that resumed the session) gets a
+    new number, which keeps frames ordered by number and by deadline.
+    """
+
+    __slots__ = ("size", "timeout", "session", "sent", "frames", "detached")
+
+    def __init__(self, size: int, timeout: float, session: str = None):
+        """Initialize window."""
+        self.size = size
+        self.timeout = timeout
+        self.session = session
+        self.sent = 0  # number of the last value sent
+        self.frames = OrderedDict()  # number -> (deadline, frame) of the values not acked
+        self.detached = None  # when the connection closed, for a session waiting to resume
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def full(self) -> bool:
+        """Tells if size values are waiting for an ack."""
+        return len(self.frames) >= self.size
+
+    def add(self, frame: bytes, now: float) -> int:
+        """Keeps frame, sent now, until it is acked; returns its number."""
+        self.sent += 1
+        self.frames[self.sent] = (now + self.timeout, frame)
+        return self.sent
+
+    def ack(self, seq: int) -> int:
+        """Forgets every value numbered up to seq; returns how many there were."""
+        frames = self.frames
+        acked = 0
+        while frames and next(iter(frames)) <= seq:
+            frames.popitem(last=False)
+            acked += 1
+        return acked
+
+    def expired(self, now: float) -> List[bytes]:
+        """Removes and returns the frames whose ack is overdue, to be sent again."""
+        frames = self.frames
+        overdue = []
+        while frames:
+            seq, (deadline, frame) = next(iter(frames.items()))
+            if deadline > now:
+                break
+            del frames[seq]
+            overdue.append(frame)
+        return overdue
+
+    def resume(self) -> List[bytes]:
+        """Removes and returns every frame, to be sent on a new connection numbered from 1."""
+        overdue = [frame for _, frame in self.frames.values()]
+        self.frames.clear()
+        self.sent = 0
+        self.detached = None
+        return overdue
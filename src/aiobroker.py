@@ -0,0 +1,132 @@
+"""Message Broker running on asyncio (or uvloop, when installed)."""
+import asyncio
+from typing import Dict
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from .broker import BaseBroker
+from .log import get_logger
+from .protocol import Frame, FrameDecoder
+
+logger = get_logger("AsyncBroker")
+
+
+class _Connection(asyncio.Protocol):
+    """One client connection; it is the address used in subscriptions."""
+
+    def __init__(self, broker: "AsyncBroker"):
+        self.broker = broker
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.broker.channels[self] = None
+        self.broker.inbox[self] = FrameDecoder(self.broker.max_payload, extended=False)
+        self.broker.metrics.accepted += 1
+
+    def data_received(self, data):
+        broker = self.broker
+        if self not in broker.channels:
+            return
+        if broker.profiler is None:
+            broker.received(self, data)
+        else:
+            broker.profiler.call(broker.received, self, data)
+
+    def connection_lost(self, exc):
+        self.broker.close(self)
+
+
+class _Scrape(asyncio.Protocol):
+    """One connection to the metrics port: answers its request and closes."""
+
+    def __init__(self, broker: "AsyncBroker"):
+        self.broker = broker
+        self.transport = None
+        self.request = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.request += data
+        if b"\r\n\r\n" in self.request or b"\n\n" in self.request:
+            self.transport.write(self.broker.scrape(bytes(self.request)))
+            self.transport.close()
+
+
+class AsyncBroker(BaseBroker):
+    """Implementation of a PubSub Message Broker on asyncio protocols.
+
+    Speaks the same wire protocol and offers the same API as Broker.
+    """
+
+    poll_interval = 0.1  # seconds between checks of canceled
+
+    def send(self, conn, frame: bytes):
+        """Queue a frame to conn, the transport writes it as soon as it can."""
+        if conn not in self.channels:
+            return
+        transport = conn.transport
+        if transport.is_closing():
+            return
+        if not self.full(conn, transport.get_write_buffer_size(), frame):
+            if type(frame) is Frame:
+                transport.writelines(frame.parts())
+            else:
+                transport.write(frame)
+
+    def backlog(self) -> Dict[_Connection, int]:
+        """Returns the number of bytes waiting to be written to each connection."""
+        return {conn: conn.transport.get_write_buffer_size() for conn in self.inbox}
+
+    def pending(self, conn) -> int:
+        """Returns the number of bytes waiting to be written to conn."""
+        return conn.transport.get_write_buffer_size()
+
+    def close(self, conn):
+        """Forget a connection and all its subscriptions."""
+        if conn not in self.channels:
+            return
+        super().close(conn)
+        conn.transport.close()
+
+    async def serve(self):
+        """Accept connections until canceled."""
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _Connection(self), sock=self.sock)
+        scraper = None
+        if self.metrics_sock is not None:
+            scraper = await loop.create_server(lambda: _Scrape(self), sock=self.metrics_sock)
+        async with server:
+            while not self.canceled:
+                await asyncio.sleep(self.poll_interval)
+                for conn in list(self.held):
+                    self.flush(conn)  # o transporte pode já ter escoado o que os retinha
+                self.tick()
+
+            for conn in list(self.inbox):
+                self.close(conn)
+        if scraper is not None:
+            scraper.close()
+
+    def run(self):
+        """Run until canceled (or interrupted: Ctrl+C exits through signal_handler)."""
+        loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.serve())
+        finally:
+            # também quando sys.exit interrompe o loop a meio de serve()
+            if self.inbox:
+                for conn in list(self.inbox):
+                    self.close(conn)
+                loop.run_until_complete(asyncio.sleep(0))  # os transportes fecham no loop
+            if self.profiler is not None:
+                logger.info("event loop of the broker:\n%s", self.profiler.report())
+            self.sock.close()
+            if self.metrics_sock is not None:
+                self.metrics_sock.close()
+            loop.close()
@@ -0,0 +1,391 @@
+"""Middleware to communicate with PubSub Message Broker from asyncio applications."""
+import asyncio
+from collections import deque
+from typing import Any, List, Optional, Tuple
+
+from .middleware import MiddlewareType
+from .protocol import (
+    COMPRESSORS, FEATURES, FRAME32, CDProto, CDProtoBadFormat, FrameDecoder, Message,
+    compression_of,
+)
+from .topics import TopicTree
+
+
+class AsyncConnection:
+    """One connection to the broker on asyncio streams, shared by the AsyncQueues of many topics.
+
+    As with Connection, the broker keeps the subscriptions of every topic on
+    the connection and the values it sends are handed to the AsyncQueues
+    subscribed to their topic, numbered in the order they arrive. Open it
+    with `async with AsyncConnection(ser_type) as connection:` (or await
+    connect()) and create the AsyncQueues with connection=connection.
+    """
+
+    recv_size = 2**16  # bytes read from the stream at once
+
+    def __init__(self, ser_type: int, host="localhost", port=5000, compression: str = None):
+        """Create a connection that speaks serializer ser_type, offering compression."""
+        self.ser_type = ser_type
+        self.host = host
+        self.port = port
+        self.offered = compression  # compression algorithm offered to the broker
+        self.compression = None  # and the one it accepted
+        self.features = set()  # protocol features accepted by the broker
+        self.decoder = FrameDecoder()
+        self.queues = TopicTree()  # topic -> (AsyncQueue, None) subscribed on this connection
+        self.window = 0  # values the broker may send before they are acked (0: no acks)
+        self.subscribed = False  # an AsyncQueue already subscribed on this connection
+        self.delivered = 0  # number of the last value received
+        self.acked = 0  # number of the last value acked
+        self.reader = None
+        self.writer = None
+        self.opened = None  # task that opens the connection, awaited by every connect()
+        self.task = None
+        self.room = None  # asyncio.Event set when the reader may read past max_prefetch
+        # command -> futures of its replies
+        self.waiting = {"hello": deque(), "listTopics": deque(), "stats": deque()}
+
+    async def connect(self) -> "AsyncConnection":
+        """Open the connection and negotiate features, once for every AsyncQueue sharing it."""
+        if self.opened is None:
+            self.opened = asyncio.get_running_loop().create_task(self._open())
+        await self.opened
+        return self
+
+    async def _open(self):
+        """Open the stream, start reading it and negotiate features."""
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.room = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self._read())
+
+        offered = list(FEATURES) + ([self.offered] if self.offered else [])
+        msg = await self.request("hello", message=offered)
+        self.features = set(msg.features)
+        self.compression = compression_of(msg.features)
+        if self.compression is not None:
+            self.decoder.decompress = COMPRESSORS[self.compression][1]
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def subscribed_queues(self) -> List["AsyncQueue"]:
+        """Returns every AsyncQueue subscribed on this connection."""
+        return [queue for topic in self.queues.topics() for queue, _ in self.queues.get(topic)]
+
+    async def _read(self):
+        """Decode every frame received, routing replies to the requests waiting for them
+        and values to the AsyncQueues subscribed to their topic.
+
+        With max_prefetch messages not pulled by any AsyncQueue it stops
+        reading, so the broker holds the next ones, unless a request waits
+        for a reply or another AsyncQueue for a value behind them: one idle
+        topic does not starve the others on the connection.
+        """
+        decoder = self.decoder
+        while data := await self.reader.read(self.recv_size):
+            decoder.feed(data)
+            try:
+                messages = [CDProto.decode_msg(payload, header)
+                            for header, payload in decoder.frames()]
+            except CDProtoBadFormat:
+                self.writer.close()
+                break
+            for msg in messages:
+                waiting = self.waiting.get(msg.command)
+                if waiting:
+                    waiting.popleft().set_result(msg)
+                    continue
+                if msg.command != "publish":
+                    continue
+                self.delivered += 1
+                msg.seq = self.delivered
+                # uma AsyncQueue subscrita a vários antecessores do tópico recebe só uma vez
+                for queue in dict(self.queues.match(msg.topic)):
+                    queue.messages.append(msg)
+                    queue.arrived.set()
+            while self.throttled() and not any(self.waiting.values()):
+                self.room.clear()
+                await self.room.wait()
+
+        for waiting in self.waiting.values():
+            while waiting:
+                waiting.popleft().set_exception(ConnectionError("broker closed the connection"))
+        for queue in self.subscribed_queues():
+            queue.messages.append(None)
+            queue.arrived.set()
+
+    def throttled(self) -> bool:
+        """Tells if an AsyncQueue has max_prefetch messages not pulled and none waits in pull()."""
+        queues = self.subscribed_queues()
+        return (any(len(queue.messages) >= queue.max_prefetch for queue in queues)
+                and not any(queue.starving for queue in queues))
+
+    @property
+    def extended(self) -> bool:
+        """Tells if messages of 64 KiB or more can be sent and received."""
+        return FRAME32 in self.features
+
+    async def send(self, command, topic="", message=None):
+        """Sends a message, waiting while the connection is congested."""
+        self.writer.write(CDProto.encode_msg(
+            command, self.ser_type, topic, message, self.extended, self.compression))
+        await self.writer.drain()
+
+    async def request(self, command, topic="", message=None) -> Message:
+        """Sends a message and returns the reply of the broker."""
+        reply = asyncio.get_running_loop().create_future()
+        self.waiting[command].append(reply)
+        self.room.set()  # a resposta pode vir atrás de mensagens que ainda não foram lidas
+        await self.send(command, topic, message)
+        return await reply
+
+    async def subscribe(self, queue: "AsyncQueue"):
+        """Subscribe queue to its topic on this connection.
+
+        Only the first subscription can open a window, as in Connection.
+        """
+        if queue.window and not self.window and self.subscribed:
+            raise ValueError("acknowledged delivery must start with the first subscription")
+        self.subscribed = True
+        self.queues.add(queue.topic, (queue, None))
+        self.window += queue.window or 0
+        await self.send("subscribe", queue.topic, queue.options())
+
+    async def unsubscribe(self, queue: "AsyncQueue"):
+        """Cancel the subscription of queue."""
+        self.queues.remove(queue.topic, queue)
+        if queue.topic not in self.queues:  # outras AsyncQueues ainda precisam do tópico
+            await self.send("unsubscribe", queue.topic)
+
+    def acknowledge(self, now: bool = False):
+        """Acks the values every AsyncQueue processed, once they are half the window
+        or, with now, as soon as there are any."""
+        batch = max(1, self.window // 2)
+        if self.delivered == self.acked or (not now and self.delivered - self.acked < batch):
+            return
+        done = self.delivered
+        for queue in self.subscribed_queues():
+            if queue.current is not None:
+                done = min(done, queue.current - 1)
+            if queue.messages and queue.messages[0] is not None:
+                done = min(done, queue.messages[0].seq - 1)
+        if done - self.acked >= batch or (now and done > self.acked):
+            self.writer.write(CDProto.encode_msg("ack", self.ser_type, message=done))
+            self.acked = done
+
+    async def close(self):
+        """Close the connection."""
+        self.task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class AsyncQueue:
+    """Queue on asyncio streams, speaking the same protocol as Queue.
+
+    Use it as `async with AsyncJSONQueue(topic) as queue:` (or await connect()),
+    then `await queue.push(value)` or `async for topic, value in queue`.
+    """
+
+    ser_type = None  # serializer of the subclass
+    max_prefetch = 1024  # messages decoded ahead of the consumer
+
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, host="localhost", port=5000,
+                 offset=None, last=None, since=None, connection: AsyncConnection = None,
+                 compression: str = None, credits: int = None, policy: str = None,
+                 group: str = None, balance: str = None, window: int = None,
+                 session: str = None):
+        """Create Queue; connect() opens the connection and subscribes.
+
+        AsyncQueues created with the same connection share its stream;
+        without one an AsyncConnection is opened, offering compression, and
+        closed with the AsyncQueue. credits and policy turn on flow control,
+        group and balance join a consumer group, and window and session turn
+        on acknowledged delivery, as in Queue.
+        """
+        self.topic = topic
+        self.type = _type
+        self.offset = offset
+        self.last = last
+        self.since = since
+        self.credits = credits
+        self.policy = policy
+        self.group = group
+        self.balance = balance
+        self.window = window
+        self.session = session
+        self.current = None  # number of the value pulled and not yet processed
+        self.consumed = 0  # values pulled since credits were last granted
+        self.owned = connection is None  # the connection is closed with this AsyncQueue
+        if connection is None:
+            connection = AsyncConnection(self.ser_type, host, port, compression)
+        elif connection.ser_type != self.ser_type:
+            raise ValueError("connection uses another serializer")
+        self.connection = connection
+        self.messages = deque()  # messages of topic received but not yet pulled (None once closed)
+        self.arrived = None  # asyncio.Event set when messages get new ones
+        self.starving = False  # pull() waits for a message
+
+    async def connect(self) -> "AsyncQueue":
+        """Open the connection, if not yet open, and subscribe (consumers)."""
+        await self.connection.connect()
+        self.arrived = asyncio.Event()
+        if self.type == MiddlewareType.CONSUMER:
+            await self.connection.subscribe(self)
+        return self
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def writer(self) -> Optional[asyncio.StreamWriter]:
+        """Stream the messages are written to, None until connected."""
+        return self.connection.writer
+
+    @property
+    def features(self) -> set:
+        """Protocol features accepted by the broker."""
+        return self.connection.features
+
+    @property
+    def compression(self) -> Optional[str]:
+        """Compression algorithm accepted by the broker."""
+        return self.connection.compression
+
+    @property
+    def extended(self) -> bool:
+        """Tells if messages of 64 KiB or more can be sent and received."""
+        return self.connection.extended
+
+    def options(self) -> dict:
+        """Optional fields of the subscribe message."""
+        options = {"offset": self.offset, "last": self.last, "since": self.since,
+                   "credits": self.credits, "policy": self.policy, "group": self.group,
+                   "balance": self.balance, "window": self.window, "session": self.session}
+        return {option: value for option, value in options.items() if value is not None}
+
+    def received(self, topic):
+        """Account for a value received from topic."""
+        if self.credits:
+            # concede créditos aos lotes, não a cada valor
+            self.consumed += 1
+            if self.consumed >= max(1, self.credits // 2):
+                self.writer.write(CDProto.encode_msg("credit", self.ser_type, message=self.consumed))
+                self.consumed = 0
+        if topic != self.topic:
+            return
+        if self.offset is not None:
+            self.offset += 1
+        if self.since is not None:
+            self.since += 1
+
+    async def send(self, command, topic="", message=None):
+        """Sends a message, waiting while the connection is congested."""
+        await self.connection.send(command, topic, message)
+
+    async def request(self, command, topic="", message=None) -> Message:
+        """Sends a message and returns the reply of the broker."""
+        return await self.connection.request(command, topic, message)
+
+    async def push(self, value):
+        """Sends data to broker."""
+        await self.send("publish", self.topic, value)
+
+    async def push_many(self, values):
+        """Sends several values to broker in as few frames as possible."""
+        frames = CDProto.encode_batch(self.ser_type, self.topic, list(values), self.extended,
+                                      self.compression)
+        self.writer.writelines(frames)
+        await self.writer.drain()
+
+    async def pull(self) -> Optional[Tuple[str, Any]]:
+        """Receives (topic, data) from broker, or None if the broker closed the connection.
+
+        With a window the value pulled before counts as processed and is acked
+        with the next batch, or right away if there is none waiting.
+        """
+        if self.connection.window:
+            self.current = None  # o valor anterior já foi processado
+            self.connection.acknowledge(not self.messages)
+        while not self.messages:
+            self.starving = True
+            self.connection.room.set()  # a mensagem pode vir atrás das de outra AsyncQueue
+            self.arrived.clear()
+            try:
+                await self.arrived.wait()
+            finally:
+                self.starving = False
+        if self.messages[0] is None:
+            return None  # fica na fila: as próximas chamadas também terminam
+        msg = self.messages.popleft()
+        self.connection.room.set()
+        self.current = msg.seq
+        self.received(msg.topic)
+        return msg.topic, msg.message
+
+    async def ack(self):
+        """Acks every value pulled so far."""
+        self.current = None
+        self.connection.acknowledge(now=True)
+        await self.writer.drain()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Tuple[str, Any]:
+        msg = await self.pull()
+        if msg is None:
+            raise StopAsyncIteration
+        return msg
+
+    async def list_topics(self) -> List[str]:
+        """Lists all topics available in the broker."""
+        msg = await self.request("listTopics", self.topic)
+        return getattr(msg, "topics", [])
+
+    async def stats(self) -> dict:
+        """Returns a snapshot of the metrics of the broker."""
+        msg = await self.request("stats")
+        return msg.stats
+
+    async def cancel(self):
+        """Cancel subscription."""
+        await self.connection.unsubscribe(self)
+
+    async def close(self):
+        """Close the connection, if this AsyncQueue opened it."""
+        if self.owned:
+            await self.connection.close()
+
+
+class AsyncJSONQueue(AsyncQueue):
+    """AsyncQueue implementation with JSON based serialization."""
+
+    ser_type = 0
+
+
+class AsyncXMLQueue(AsyncQueue):
+    """AsyncQueue implementation with XML based serialization."""
+
+    ser_type = 1
+
+
+class AsyncPickleQueue(AsyncQueue):
+    """AsyncQueue implementation with Pickle based serialization."""
+
+    ser_type = 2
+
+
+class AsyncBinaryQueue(AsyncQueue):
+    """AsyncQueue implementation with compact binary serialization."""
+
+    ser_type = 3
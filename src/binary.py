@@ -0,0 +1,169 @@
+"""Compact binary serialization of messages: struct-packed, type-tagged values.
+
+Every value starts with a one byte tag; integers take the smallest size that
+holds them, so a small reading like a temperature costs two bytes.
+"""
+import struct
+
+_I8 = struct.Struct(">b")
+_I16 = struct.Struct(">h")
+_I32 = struct.Struct(">i")
+_I64 = struct.Struct(">q")
+_FLOAT = struct.Struct(">d")
+_U32 = struct.Struct(">I")
+
+_INT_BY_TAG = {ord("b"): _I8, ord("h"): _I16, ord("i"): _I32, ord("q"): _I64}
+
+
+class BinaryDecodeError(ValueError):
+    """Payload is not a valid binary encoded value."""
+
+
+def _dump_int(value, out: bytearray):
+    if -0x80 <= value < 0x80:
+        out += b"b" + _I8.pack(value)
+    elif -0x8000 <= value < 0x8000:
+        out += b"h" + _I16.pack(value)
+    elif -0x80000000 <= value < 0x80000000:
+        out += b"i" + _I32.pack(value)
+    elif -0x8000000000000000 <= value < 0x8000000000000000:
+        out += b"q" + _I64.pack(value)
+    else:
+        raw = value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True)
+        out += b"n" + _U32.pack(len(raw)) + raw
+
+
+def _dump_str(value, out: bytearray):
+    raw = value.encode("utf-8")
+    if len(raw) < 256:
+        out += b"s" + bytes((len(raw),)) + raw
+    else:
+        out += b"S" + _U32.pack(len(raw)) + raw
+
+
+def _dump_bytes(value, out: bytearray):
+    out += b"y" + _U32.pack(len(value)) + value
+
+
+def _dump_list(value, out: bytearray):
+    out += b"l" + _U32.pack(len(value))
+    for item in value:
+        _dump(item, out)
+
+
+def _dump_dict(value, out: bytearray):
+    out += b"m" + _U32.pack(len(value))
+    for key, item in value.items():
+        _dump(key, out)
+        _dump(item, out)
+
+
+_DUMPERS = {
+    type(None): lambda value, out: out.extend(b"N"),
+    bool: lambda value, out: out.extend(b"T" if value else b"F"),
+    int: _dump_int,
+    float: lambda value, out: out.extend(b"d" + _FLOAT.pack(value)),
+    str: _dump_str,
+    bytes: _dump_bytes,
+    bytearray: _dump_bytes,
+    list: _dump_list,
+    tuple: _dump_list,
+    dict: _dump_dict,
+}
+
+
+def _dump(value, out: bytearray):
+    dumper = _DUMPERS.get(type(value))
+    if dumper is None:
+        # subclasses (IntEnum, OrderedDict, ...) usam o tipo base
+        for base in (bool, int, float, str, bytes, list, tuple, dict):
+            if isinstance(value, base):
+                dumper = _DUMPERS[base]
+                break
+        else:
+            raise TypeError(f"cannot binary encode {type(value).__name__}")
+    dumper(value, out)
+
+
+def pack(*values) -> bytes:
+    """Encodes a sequence of values back to back, with no header."""
+    out = bytearray()
+    for value in values:
+        _dump(value, out)
+    return bytes(out)
+
+
+def dumps(value) -> bytes:
+    """Encodes value (None, bool, int, float, str, bytes, list, tuple or dict)."""
+    return pack(value)
+
+
+def _load(data: memoryview, pos: int):
+    tag = data[pos]
+    pos += 1
+    if tag == 0x73:  # s
+        size = data[pos]
+        pos += 1
+        end = pos + size
+        if end > len(data):
+            raise BinaryDecodeError("truncated value")
+        return str(data[pos:end], "utf-8"), end
+    fmt = _INT_BY_TAG.get(tag)
+    if fmt is not None:
+        return fmt.unpack_from(data, pos)[0], pos + fmt.size
+    if tag == 0x64:  # d
+        return _FLOAT.unpack_from(data, pos)[0], pos + 8
+    if tag == 0x4E:  # N
+        return None, pos
+    if tag == 0x54:  # T
+        return True, pos
+    if tag == 0x46:  # F
+        return False, pos
+
+    size = _U32.unpack_from(data, pos)[0]
+    pos += 4
+    if tag == 0x6C:  # l
+        items = []
+        for _ in range(size):
+            item, pos = _load(data, pos)
+            items.append(item)
+        return items, pos
+    if tag == 0x6D:  # m
+        items = {}
+        for _ in range(size):
+            key, pos = _load(data, pos)
+            items[key], pos = _load(data, pos)
+        return items, pos
+
+    end = pos + size
+    if end > len(data):
+        raise BinaryDecodeError("truncated value")
+    if tag == 0x53:  # S
+        return str(data[pos:end], "utf-8"), end
+    if tag == 0x79:  # y
+        return bytes(data[pos:end]), end
+    if tag == 0x6E:  # n
+        return int.from_bytes(data[pos:end], "big", signed=True), end
+    raise BinaryDecodeError(f"unknown tag {tag:#x}")
+
+
+def unpack(data: bytes, start: int = 0) -> list:
+    """Decodes every value encoded by pack(), starting at offset start."""
+    values = []
+    try:
+        with memoryview(data) as view:
+            pos = start
+            while pos < len(view):
+                value, pos = _load(view, pos)
+                values.append(value)
+    except (IndexError, TypeError, struct.error, UnicodeDecodeError) as err:
+        raise BinaryDecodeError(str(err)) from err
+    return values
+
+
+def loads(data: bytes):
+    """Decodes a value encoded by dumps()."""
+    values = unpack(data)
+    if len(values) != 1:
+        raise BinaryDecodeError("expected exactly one value")
+    return values[0]
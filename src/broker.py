@@ -1,11 +1,27 @@
 """Message Broker"""
+from collections import deque
 import enum
-from typing import List, Tuple
+import itertools
+from typing import Dict, Iterable, List, Tuple
 import selectors
 import socket
 import sys
 import signal
-from .protocol import CDProto
+import time
+from .acks import Window
+from .log import get_logger
+from .protocol import (
+    COMPRESSORS, CONFLATE, DISCONNECT, DROP_NEWEST, EXTENDED, FRAME32, IOV_MAX, ROUND_ROBIN,
+    CDProto, CDProtoBadFormat, Frame, FrameDecoder, Message, accept_features, compression_of,
+)
+from .groups import Group
+from .history import History
+from .metrics import Metrics, http_response
+from .profiling import LoopProfiler
+from .storage import TopicLog
+from .topics import TopicTree, covers, is_pattern, matches
+
+logger = get_logger("Broker")
 
 
 class Serializer(enum.Enum):
@@ -14,114 +30,425 @@ class Serializer(enum.Enum):
     JSON = 0
     XML = 1
     PICKLE = 2
-
-
-class Broker:
-    """Implementation of a PubSub Message Broker."""
-
-    def __init__(self):
-        """Initialize broker."""
+    BINARY = 3
+
+
+class BaseBroker:
+    """State and commands of a PubSub Message Broker, shared by every engine.
+
+    Engines accept connections, feed the bytes they read to received() and
+    implement send(), close() and run().
+    """
+
+    reuse_port = False  # let several processes listen on the same port
+    session_expiry = 300.0  # seconds the values of a disconnected session wait for it
+
+    def __init__(self, host: str = "localhost", port: int = 5000, max_outbox: int = 4 * 2**20,
+                 log: TopicLog = None, history: History = None, metrics_port: int = None,
+                 profiler: LoopProfiler = None, max_held: int = 1024,
+                 ack_timeout: float = 10.0, max_payload: int = 2**26):
+        """Initialize broker.
+
+        max_outbox is the high-water mark, in bytes, of the data waiting to be
+        written to a single connection; frames above it are dropped (or held,
+        for a consumer with credits, until its outbox drains).
+        With a log every publish is also appended to it, and the last value
+        of each topic in the log is restored. With a history the last values
+        of each topic are kept in memory for subscribers that ask for them.
+        With a metrics_port the metrics are served as plain text over HTTP on
+        that port of host. With a profiler every callback of the event loop
+        and the decode, route, encode and send phases are timed.
+        max_held is the number of values held for a consumer out of credits
+        before the overflow policy of its subscription applies.
+        ack_timeout is the number of seconds a consumer with acknowledged
+        delivery has to ack a value before it is sent again.
+        max_payload is the largest payload, in bytes, a frame received may
+        carry once decompressed; bigger frames close their connection.
+        """
         self.canceled = False
-        self._host = "localhost"
-        self._port = 5000
+        self._host = host
+        self._port = port
 
-        # para não bloquear o socket
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind((self._host, self._port))
         self.sock.listen(100)
 
-        self.sel = selectors.DefaultSelector()
-        self.sel.register(self.sock, selectors.EVENT_READ, self.accept)
-
         self.topics = {}
-        self.subscriptions = {}  # topic -> connections (sockets)
+        self.frames = {}  # topic -> serializer -> frame of the value in topics
+        self.subscriptions = TopicTree()  # topic -> connections (sockets)
         self.channels = {}  # conn -> serializer
-
-    def signal_handler(sig, frame):
-        print('\nDone!')
-        sys.exit(0)
-
-    signal.signal(signal.SIGINT, signal_handler)
-    print('Press Ctrl+C to exit...')
-
-    def accept(self, sock, mask):
-
-        # Aceita a conexão
-        conn, addr = sock.accept()
-        conn.setblocking(False)
-
-        self.sel.register(conn, selectors.EVENT_READ, self.read)
-        self.channels[conn] = None
-
-    def read(self, conn, mask):
-
-        if conn in self.channels:
-            msg = None
-            # Lê o header e a informação
-            header = conn.recv(1)
-            if header == b'':
-                self.unsubscribe("", conn)
-                self.sel.unregister(conn)
-                conn.close()
-                return
-            header = int.from_bytes(header, byteorder='big')
-
+        self.inbox = {}  # conn -> FrameDecoder with the bytes received so far
+        self.features = {}  # conn -> protocol features negotiated with hello
+        self.compressions = {}  # conn -> compression algorithm negotiated with hello
+        self.stalled = set()  # conns whose outbox hit max_outbox
+        self.max_outbox = max_outbox
+        self.credits = {}  # conn -> values it may still be sent (only conns with flow control)
+        self.held = {}  # conn -> values held while it has no credits: key -> frame
+        self.policies = {}  # conn -> subscribed topic -> overflow policy
+        self.max_held = max_held
+        self.sequence = itertools.count()  # keys of the held values not conflated
+        self.groups = {}  # (topic, group name) -> Group subscribed to topic
+        self.memberships = {}  # conn -> topic -> Group it is a member of
+        self.windows = {}  # conn -> Window of the values sent and not acked yet
+        self.sessions = {}  # session -> Window of a consumer that disconnected
+        self.ack_timeout = ack_timeout
+        self.max_payload = max_payload
+        self.next_tick = 0.0  # when tick() next looks for overdue acks
+        self.metrics = Metrics()
+
+        self.metrics_sock = None
+        if metrics_port is not None:
+            self.metrics_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.metrics_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.metrics_sock.bind((self._host, metrics_port))
+            self.metrics_sock.listen(10)
+
+        self.history = history
+        self.log = log
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach(self)
+        if log is not None:
+            for topic in log.topics():
+                serializer, payload = log.last(topic)
+                self.put_topic(topic, CDProto.decode_msg(payload, serializer).message)
+
+    def received(self, conn, data: bytes):
+        """Handle every complete frame in the data received so far from conn."""
+        decoder = self.inbox[conn]
+        decoder.feed(data)
+        self.metrics.bytes_in += len(data)
+        try:
+            frames = decoder.frames()
+        except CDProtoBadFormat:  # trama estendida sem frame32, ou maior que max_payload
+            self.close(conn)
+            return
+        for header, payload in frames:
+            self.metrics.messages_in += 1
             # Verifica qual é o tipo da mensagem através da informação recbida
-            if header == Serializer.JSON.value:
-                serializer = Serializer.JSON
-            elif header == Serializer.XML.value:
-                serializer = Serializer.XML
-            elif header == Serializer.PICKLE.value:
-                serializer = Serializer.PICKLE
-            else:
-                serializer = None
-
-            if serializer:
-                self.channels[conn] = serializer
-            else:
-                conn.close()
-
-            if serializer == Serializer.JSON:
-                msg = CDProto.recv_msg(conn)
-            elif serializer == Serializer.XML:
-                msg = CDProto.recv_msg(conn)
-            elif serializer == Serializer.PICKLE:
-                msg = CDProto.recv_msg(conn)
-
-            if msg is not None:
-                command = msg["command"]
-                topic = msg["topic"]
-
-                if command == 'subscribe':
-                    self.subscribe(topic, conn, serializer)
-
-                elif command == 'publish':
-
-                    message = msg["message"]
-                    self.put_topic(topic, message)
-                    for sub_topic in self.subscriptions.keys():
-                        if sub_topic == msg["topic"] or sub_topic in msg["topic"]:
-                            for subscriber in self.subscriptions[sub_topic]:
-                                CDProto.send_msg(
-                                    subscriber[0], command, serializer.value, topic, message)
-
-                elif command == 'listTopics':
+            try:
+                serializer = Serializer(header)
+                msg = self.decode(payload, header)
+            except (ValueError, CDProtoBadFormat):
+                self.close(conn)
+                return
 
-                    topics = self.list_topics()
-                    CDProto.send_msg(
-                        conn, command, serializer.value, topic, topics)
+            self.channels[conn] = serializer
+            self.handle(conn, serializer, msg, payload)
+            if conn not in self.channels:
+                return
 
-                elif command == 'unsubscribe':
-                    self.unsubscribe(topic, conn)
+    def decode(self, payload: bytes, header: int) -> Message:
+        """Decodes the payload of a frame received."""
+        return CDProto.decode_msg(payload, header)
+
+    def handle(self, conn, serializer: Serializer, msg: Message, payload: bytes = None):
+        """Execute a command received from conn, encoded by serializer in payload."""
+        command = msg.command
+        topic = getattr(msg, "topic", "")
+
+        if command == 'subscribe':
+            self.subscribe(topic, conn, serializer, offset=msg.offset, last=msg.last,
+                           since=msg.since, credits=msg.credits, policy=msg.policy,
+                           group=msg.group, balance=msg.balance, window=msg.window,
+                           session=msg.session)
+
+        elif command == 'publish':
+            # quem usa o mesmo formato recebe o payload tal como chegou
+            self.publish(topic, msg.message, serializer, payload)
+
+        elif command == 'publishBatch':
+            for message in msg.messages:
+                self.publish(topic, message, serializer)
+
+        elif command == 'listTopics':
+
+            topics = self.list_topics()
+            self.send(conn, CDProto.encode_msg(
+                command, serializer.value, topic, topics, self.extended(conn)))
+
+        elif command == 'stats':
+            self.send(conn, CDProto.encode_msg(
+                command, serializer.value, message=self.stats(), extended=self.extended(conn)))
+
+        elif command == 'hello':
+            features = accept_features(msg.features)
+            self.features[conn] = set(features)
+            compression = compression_of(features)
+            if compression is not None:
+                self.compressions[conn] = compression
+                self.inbox[conn].decompress = COMPRESSORS[compression][1]
+            self.inbox[conn].extended = FRAME32 in features
+            self.send(conn, CDProto.encode_msg(command, serializer.value, message=features))
+
+        elif command == 'credit':
+            self.grant(conn, msg.credits)
+
+        elif command == 'ack':
+            self.acknowledge(conn, msg.seq)
+
+        elif command == 'unsubscribe':
+            self.unsubscribe(topic, conn)
+
+    def send(self, conn, frame: bytes):
+        """Queue a frame to conn."""
+        raise NotImplementedError
+
+    def backlog(self) -> Dict[object, int]:
+        """Returns the number of bytes waiting to be written to each connection."""
+        raise NotImplementedError
+
+    def pending(self, conn) -> int:
+        """Returns the number of bytes waiting to be written to conn."""
+        raise NotImplementedError
+
+    def load(self, conn) -> tuple:
+        """Load of conn, lowest first: values held for it, then bytes waiting to be written."""
+        return len(self.held.get(conn, ())), self.pending(conn)
+
+    def stats(self) -> Dict[str, float]:
+        """Returns a snapshot of the metrics of the broker (and of its profiler)."""
+        stats = self.metrics.snapshot(self)
+        if self.profiler is not None:
+            stats.update(self.profiler.snapshot())
+        return stats
+
+    def scrape(self, request: bytes) -> bytes:
+        """Returns the HTTP response to a request received on the metrics port."""
+        return http_response(self.stats())
+
+    def close(self, conn):
+        """Forget a connection and all its subscriptions."""
+        self.metrics.closed += 1
+        self.unsubscribe_all(conn)
+        self.channels.pop(conn, None)
+        self.inbox.pop(conn, None)
+        self.features.pop(conn, None)
+        self.compressions.pop(conn, None)
+        self.credits.pop(conn, None)
+        window = self.windows.pop(conn, None)
+        if window is not None and window.session is not None:
+            # o que não foi confirmado (nem enviado) segue quando a sessão voltar
+            now = time.monotonic()
+            for frame in self.held.get(conn, {}).values():
+                window.add(frame, now)
+            if window:
+                window.detached = now
+                self.sessions[window.session] = window
+        self.held.pop(conn, None)
+        self.stalled.discard(conn)
+
+    def full(self, conn, pending: int, frame: bytes) -> bool:
+        """Tells if frame must be dropped because conn already has pending bytes queued."""
+        # uma trama maior que max_outbox passa quando não há nada pendente
+        if not pending or pending + len(frame) <= self.max_outbox:
+            self.stalled.discard(conn)
+            return False
+        # o subscritor não está a ler: descarta a trama inteira
+        self.metrics.dropped += 1
+        if conn not in self.stalled:
+            self.stalled.add(conn)
+            logger.warning("outbox of %s is full, dropping frames", conn)
+        return True
+
+    def extended(self, conn) -> bool:
+        """Tells if conn negotiated frames with a 4 byte size."""
+        return FRAME32 in self.features.get(conn, ())
+
+    def deliver(self, conn, topic, _format: Serializer, frame: bytes = None):
+        """Send the value stored in topic (or frame) to conn, if the framing of conn can carry it.
+
+        The frame is compressed if conn negotiated compression.
+        """
+        compression = self.compressions.get(conn)
+        try:
+            if frame is None:
+                frame = self.encoded(topic, _format, compression)
             else:
-                self.unsubscribe("", conn)
-                self.sel.unregister(conn)
-                conn.close()
+                frame = CDProto.compress_frame(frame, compression)
+        except CDProtoBadFormat:
+            logger.warning("%s cannot be encoded in %s, dropping it for %s",
+                           topic, _format, conn)
+            self.metrics.dropped += 1
+            return
+        if frame[0] & EXTENDED and not self.extended(conn):
+            logger.warning("%s did not negotiate %s, dropping %d bytes of %s",
+                           conn, FRAME32, len(frame), topic)
+            self.metrics.dropped += 1
+            return
+        if self.blocked(conn, frame):
+            self.hold(conn, topic, frame)
+            return
+        self.transmit(conn, frame)
+
+    def blocked(self, conn, frame: bytes = b"") -> bool:
+        """Tells if the values for conn must be held: it has no credits, its window is
+        full or, with credits or a window, frame does not fit in its outbox."""
+        credits = self.credits.get(conn)
+        if credits is not None and credits <= 0:
+            return True
+        window = self.windows.get(conn)
+        if window is not None and window.full():
+            return True
+        # descartada pela outbox cheia, a trama gastava um crédito que nunca voltava
+        # (ou um número que o consumidor nunca recebia)
+        return (credits is not None or window is not None) and self.overflows(conn, frame)
+
+    def overflows(self, conn, frame: bytes) -> bool:
+        """Tells if frame does not fit in the outbox of conn under max_outbox."""
+        pending = self.pending(conn)
+        return pending > 0 and pending + len(frame) > self.max_outbox
+
+    def transmit(self, conn, frame: bytes):
+        """Send a value to conn, using one of its credits and keeping it until acked.
+
+        Callers check blocked() first, so send() never drops a value counted here.
+        """
+        if conn in self.credits:
+            self.credits[conn] -= 1
+        window = self.windows.get(conn)
+        if window is not None:
+            window.add(frame, time.monotonic())
+        metrics = self.metrics
+        metrics.messages_out += 1
+        metrics.bytes_out += len(frame)
+        self.send(conn, frame)
+
+    def hold(self, conn, topic: str, frame: bytes):
+        """Keep frame for conn, which is blocked, as the policy of its subscription says.
+
+        Values for a consumer with a window are never dropped: they are all
+        held, since a full window only means it is processing what it got.
+        """
+        held = self.held.setdefault(conn, {})
+        if not held:
+            self.metrics.slow_consumers += 1
+        if conn in self.windows:
+            held[next(self.sequence)] = frame
+            return
+        policy = self.policy(conn, topic)
+        if policy == CONFLATE:
+            # o valor novo substitui o que ainda estava retido do mesmo tópico
+            if held.pop(topic, None) is not None:
+                self.metrics.conflated += 1
+            key = topic
         else:
-            self.unsubscribe("", conn)
-            self.sel.unregister(conn)
-            conn.close()
+            key = next(self.sequence)
+
+        if len(held) >= self.max_held:
+            self.metrics.overflows += 1
+            if policy == DISCONNECT:
+                logger.warning("%s is not keeping up with %s, disconnecting it", conn, topic)
+                self.metrics.slow_disconnects += 1
+                self.close(conn)
+                return
+            self.metrics.dropped += 1
+            if policy == DROP_NEWEST:
+                return
+            del held[next(iter(held))]
+        held[key] = frame
+
+    def grant(self, conn, credits: int):
+        """Let conn be sent credits more values, starting by the ones held for it."""
+        self.credits[conn] = self.credits.get(conn, 0) + credits
+        self.flush(conn)
+
+    def acknowledge(self, conn, seq: int):
+        """Forget the values sent to conn up to number seq, which it processed."""
+        window = self.windows.get(conn)
+        if window is None:
+            return
+        self.metrics.acked += window.ack(seq)
+        self.flush(conn)
+
+    def flush(self, conn):
+        """Send the values held for conn while it is not blocked."""
+        held = self.held.get(conn)
+        while held:
+            key = next(iter(held))
+            if self.blocked(conn, held[key]):
+                break
+            self.transmit(conn, held.pop(key))
+            if conn not in self.channels:
+                return
+        if not held:
+            self.held.pop(conn, None)
+
+    def redeliver(self, conn, frames: List[bytes]):
+        """Send frames to conn again, as its window and outbox let them through."""
+        self.metrics.redelivered += len(frames)
+        # retidos antes de enviar: se a conexão cair, a sessão fica com eles
+        held = self.held.setdefault(conn, {})
+        for frame in frames:
+            held[next(self.sequence)] = frame
+        self.flush(conn)
+
+    def tick(self):
+        """Send again the values whose ack is overdue and forget sessions not resumed in time.
+
+        The engines call it on every turn of their event loop; it only looks
+        at the windows every ack_timeout / 10 seconds.
+        """
+        if not self.windows and not self.sessions:
+            return
+        now = time.monotonic()
+        if now < self.next_tick:
+            return
+        self.next_tick = now + self.ack_timeout / 10
+        for conn, window in list(self.windows.items()):
+            overdue = window.expired(now)
+            if overdue and conn in self.windows:
+                self.redeliver(conn, overdue)
+        for session, window in list(self.sessions.items()):
+            if now - window.detached > self.session_expiry:
+                logger.warning("session %s was not resumed, dropping %d values", session, len(window))
+                self.metrics.dropped += len(window)
+                del self.sessions[session]
+
+    def policy(self, conn, topic: str) -> str:
+        """Returns the overflow policy of the most specific subscription of conn to topic."""
+        policies = self.policies.get(conn, {})
+        patterns = [pattern for pattern in policies if covers(pattern, topic)]
+        if not patterns:
+            return DROP_NEWEST
+        return policies[max(patterns, key=len)]
+
+    def run(self):
+        """Run until canceled."""
+        raise NotImplementedError
+
+    def publish(self, topic, value, serializer: Serializer = Serializer.JSON, payload: bytes = None):
+        """Store value in topic and send it to every subscriber of topic and its ancestors.
+
+        payload is the publish message already encoded by serializer, as it was
+        received; it is relayed as is instead of being encoded again, and
+        framed apart from its header instead of copied behind it.
+        """
+        self.put_topic(topic, value)
+        published = self.metrics.published
+        published[topic] = published.get(topic, 0) + 1
+        if payload is not None:
+            self.frames[topic][serializer] = Frame(
+                *CDProto.frame_parts(serializer.value, payload, True))
+        if self.log is not None:
+            self.log.append(topic, self.encoded(topic, serializer))
+        if self.history is not None:
+            self.history.append(topic, self.encoded(topic, serializer))
+        for subscriber, _format in self.route(topic).items():
+            self.deliver(subscriber, topic, _format or serializer)
+
+    def route(self, topic: str) -> Dict[object, Serializer]:
+        """Returns the subscribers a publish to topic goes to, and their formats."""
+        # um cliente subscrito a vários antecessores recebe só uma vez
+        routes = {}
+        for subscriber, _format in self.subscriptions.match(topic):
+            if type(subscriber) is Group:
+                subscriber, _format = subscriber.pick(self.load)
+            routes.setdefault(subscriber, _format)
+        return routes
 
     def list_topics(self) -> List[str]:
         """Returns a list of strings containing all topics containing values."""
@@ -136,46 +463,382 @@ class Broker:
     def put_topic(self, topic, value):
         """Store in topic the value."""
         self.topics[topic] = value
+        self.frames[topic] = {}
+
+    def encoded(self, topic, _format: Serializer, compression: str = None) -> bytes:
+        """Returns the publish frame of the value stored in topic, encoded (and
+        compressed) once per format and compression algorithm."""
+        if _format is None:
+            raise CDProtoBadFormat(topic)  # ex.: a entrada de um grupo, não de um subscritor
+        frames = self.frames[topic]
+        key = _format if compression is None else (_format, compression)
+        frame = frames.get(key)
+        if frame is None:
+            if compression is None:
+                frame = CDProto.encode_msg("publish", _format.value, topic, self.topics[topic], True)
+            else:
+                frame = CDProto.compress_frame(self.encoded(topic, _format), compression)
+            frames[key] = frame
+        return frame
 
     def list_subscriptions(self, topic: str) -> List[Tuple[socket.socket, Serializer]]:
         """Provide list of subscribers to a given topic."""
-        if topic in self.subscriptions.keys():
-            return self.subscriptions[topic]
+        if topic in self.subscriptions:
+            return self.subscriptions.get(topic)
         return 
 
-    def subscribe(self, topic: str, address: socket.socket, _format: Serializer = None):
-        """Subscribe to topic by client in address."""
+    def subscribe(self, topic: str, address: socket.socket, _format: Serializer = None,
+                  offset: int = None, last: int = None, since: int = None,
+                  credits: int = None, policy: str = None, group: str = None,
+                  balance: str = None, window: int = None, session: str = None):
+        """Subscribe to topic by client in address.
+
+        With an offset (and a log) every value logged in topic from offset on is
+        sent, instead of just the last one; with last or since (and a history)
+        the last <last> values kept, or the ones from sequence <since> on.
+        topic may be a pattern with "+" and "#" wildcards: it then gets the
+        last value of every topic it matches.
+        With credits, address is sent that many values (plus the ones it grants
+        later) and the others are held for it, applying policy when max_held
+        are already held; the credits of every subscription of address add up.
+        With a group, address joins the subscribers of topic with that group,
+        which get each value once between them, as balance says; only the
+        first member gets the last value of topic.
+        With a window, at most that many values are sent to address and not
+        acked, as with credits; a value not acked in ack_timeout seconds is
+        sent again. None is dropped: whatever policy says, every value beyond
+        the window is held until acks make room for it. The values never acked by a consumer that
+        disconnects are sent to the next one subscribing with the same session.
+        """
         self.channels[address] = _format
+        self.metrics.subscribes += 1
+        if window is not None:
+            self.open_window(address, window, session)
 
-        if topic not in self.subscriptions:
-            self.subscriptions[topic] = [(address, _format)]
+        joined = False  # address entrou num grupo que já existia
+        if group is None:
+            self.subscriptions.add(topic, (address, _format))
         else:
-            self.subscriptions[topic].append((address, _format))
-
-        if topic in self.topics:
+            joined = self.join(topic, group, address, _format, balance)
+        if credits is not None:
+            self.credits[address] = self.credits.get(address, 0) + credits
+            self.policies.setdefault(address, {})[topic] = policy or DROP_NEWEST
+
+        if offset is not None and self.log is not None:
+            self.replay(topic, address, self.log.read(topic, offset))
+        elif (last is not None or since is not None) and self.history is not None:
+            self.replay(topic, address, self.history.read(topic, last, since))
+        elif joined:
+            return  # o grupo já recebeu o último valor
+        elif is_pattern(topic):
+            # recebe o último valor de cada tópico que o padrão abrange
+            for name in [name for name in self.topics if matches(topic, name)]:
+                if self.get_topic(name):
+                    self.deliver(address, name, self.channels[address])
+        elif topic in self.topics:
             last_msg = self.get_topic(topic)
             if last_msg:
-                serializer = self.channels[address]
-                CDProto.send_msg(address, "publish",
-                                 serializer.value, topic, last_msg)
+                self.deliver(address, topic, self.channels[address])
+
+    def replay(self, topic: str, address, frames: Iterable[Tuple[int, bytes]]):
+        """Send to address the (serializer, payload) publish frames of topic."""
+        _format = self.channels[address]
+        for serializer, payload in frames:
+            if _format is None or serializer == _format.value:
+                frame = CDProto.encode_frame(serializer, payload, True)
+            else:
+                value = CDProto.decode_msg(payload, serializer).message
+                try:
+                    frame = CDProto.encode_msg("publish", _format.value, topic, value, True)
+                except CDProtoBadFormat:
+                    continue
+            self.deliver(address, topic, _format, frame)
+
+    def open_window(self, conn, size: int, session: str = None):
+        """Turn on acknowledged delivery for conn, resuming session if it has values waiting."""
+        window = self.windows.get(conn)
+        if window is None:
+            window = self.windows[conn] = Window(0, self.ack_timeout)
+        window.size += size
+        if session is not None and window.session is None:
+            window.session = session
+            resumed = self.sessions.pop(session, None)
+            if resumed is not None:
+                logger.info("session %s resumed by %s", session, conn)
+                self.redeliver(conn, resumed.resume())
+
+    def join(self, topic: str, name: str, address, _format: Serializer, balance: str = None) -> bool:
+        """Adds address to group name of topic; tells if the group already existed."""
+        group = self.groups.get((topic, name))
+        existed = group is not None
+        if not existed:
+            group = self.groups[(topic, name)] = Group(name, topic, balance or ROUND_ROBIN)
+            self.subscriptions.add(topic, (group, None))
+        group.join(address, _format)
+        self.memberships.setdefault(address, {})[topic] = group
+        return existed
+
+    def leave(self, group: Group, address):
+        """Removes address from group, and the group once it has no members."""
+        group.leave(address)
+        if not group:
+            self.subscriptions.remove(group.topic, group)
+            del self.groups[(group.topic, group.name)]
 
     def unsubscribe(self, topic, address):
         """Unsubscribe to topic by client in address."""
-        if topic in self.subscriptions:
-            serializer = self.channels.get(address)
-            self.subscriptions[topic].remove((address, serializer))
-        elif topic == "":
-            for topic, address in self.subscriptions.items():
-                for conn, ser in address:
-                    self.subscriptions[topic].remove((conn, ser))
+        self.metrics.unsubscribes += 1
+        if address in self.policies:
+            self.policies[address].pop(topic, None)
+        groups = self.memberships.get(address)
+        if groups and topic in groups:
+            self.leave(groups.pop(topic), address)
+            if not groups:
+                del self.memberships[address]
+        elif topic in self.subscriptions:
+            self.subscriptions.remove(topic, address)
         else:
-            print("Erro")
+            logger.debug("%s is not subscribed to %s", address, topic)
 
-    def run(self):
-        """Run until canceled."""
+    def unsubscribe_all(self, address):
+        """Cancel every subscription of the client in address, which disconnected."""
+        self.metrics.unsubscribes += 1
+        self.policies.pop(address, None)
+        for group in self.memberships.pop(address, {}).values():
+            self.leave(group, address)
+        self.subscriptions.remove_address(address)
+
+
+class _Outbox:
+    """Frames waiting to be written to one connection.
+
+    The frames are the immutable ones the broker encoded once per publish
+    (and format), shared by every subscriber that has them queued and kept
+    alive while one does; a frame partly written is replaced by a view of
+    the rest, so neither queueing nor writing copies it. write() gathers
+    them with sendmsg.
+    """
+
+    __slots__ = ("frames", "size")
+
+    def __init__(self):
+        self.frames = deque()  # the frames, the first one maybe a view of its unwritten part
+        self.size = 0  # bytes in frames
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, frame: bytes):
+        """Queues frame (not copied), the header and payload of a Frame one after the other."""
+        if type(frame) is Frame:
+            self.frames.append(frame.header)
+            self.frames.append(frame.payload)
+        else:
+            self.frames.append(frame)
+        self.size += len(frame)
+
+    def write(self, conn) -> int:
+        """Writes as much as conn accepts in one syscall; returns the bytes written."""
+        frames = self.frames
+        if hasattr(conn, "sendmsg"):
+            sent = conn.sendmsg(list(itertools.islice(frames, IOV_MAX)))
+        else:
+            sent = conn.send(frames[0])
+        self.written(sent)
+        return sent
+
+    def written(self, sent: int):
+        """Forgets the first sent bytes, which were written."""
+        frames = self.frames
+        self.size -= sent
+        while frames and sent >= len(frames[0]):
+            sent -= len(frames.popleft())
+        if sent:
+            frames[0] = memoryview(frames[0])[sent:]
+
+
+class Broker(BaseBroker):
+    """Implementation of a PubSub Message Broker on a selectors event loop."""
+
+    chunk_size = 2**16  # bytes read from a connection at once
+    poll_interval = 0.1  # seconds between checks of canceled
+
+    def __init__(self, host: str = "localhost", port: int = 5000, max_outbox: int = 4 * 2**20,
+                 log: TopicLog = None, history: History = None, metrics_port: int = None,
+                 profiler: LoopProfiler = None, max_held: int = 1024,
+                 ack_timeout: float = 10.0, max_payload: int = 2**26):
+        """Initialize broker."""
+        super().__init__(host, port, max_outbox, log, history, metrics_port, profiler, max_held,
+                         ack_timeout, max_payload)
+
+        # para não bloquear o socket
+        self.sock.setblocking(False)
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.sock, selectors.EVENT_READ, self.accept)
+        if self.metrics_sock is not None:
+            self.metrics_sock.setblocking(False)
+            self.sel.register(self.metrics_sock, selectors.EVENT_READ, self.accept_scrape)
+
+        self.outbox = {}  # conn -> _Outbox of the frames still to be written
+
+    def signal_handler(sig, frame):
+        print('\nDone!')
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    print('Press Ctrl+C to exit...')
+
+    def accept(self, sock, mask):
 
-        while not self.canceled:
-            events = self.sel.select()
-            for key, mask in events:
-                callback = key.data
-                callback(key.fileobj, mask)
+        # Aceita a conexão
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+
+        self.sel.register(conn, selectors.EVENT_READ, self.read)
+        self.channels[conn] = None
+        self.inbox[conn] = FrameDecoder(self.max_payload, extended=False)
+        self.metrics.accepted += 1
+
+    def accept_scrape(self, sock, mask):
+        """Accept a connection to the metrics port."""
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self.sel.register(conn, selectors.EVENT_READ, self.read_scrape)
+
+    def read_scrape(self, conn, mask):
+        """Answer the request of a scrape, once its headers are complete."""
+        try:
+            data = conn.recv(self.chunk_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if data and b"\r\n\r\n" not in data and b"\n\n" not in data:
+            return  # responde quando chegar o fim dos cabeçalhos do pedido
+        self.sel.unregister(conn)
+        if data:
+            conn.setblocking(True)
+            try:
+                conn.sendall(self.scrape(data))
+            except OSError:
+                pass
+        conn.close()
+
+    def read(self, conn, mask):
+        """Read everything available in conn and handle every complete frame."""
+        try:
+            data = conn.recv(self.chunk_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if data == b'':
+            self.close(conn)
+            return
+
+        self.received(conn, data)
+
+    def ready(self, conn, mask):
+        """Serve a connection that is waiting to write."""
+        if mask & selectors.EVENT_WRITE:
+            self.write(conn, mask)
+        if mask & selectors.EVENT_READ and conn in self.channels:
+            self.read(conn, mask)
+
+    def send(self, conn, frame: bytes):
+        """Queue a frame to conn, writing as much as the socket accepts now."""
+        if conn not in self.channels:
+            return
+        pending = self.outbox.get(conn)
+        if pending:
+            if not self.full(conn, len(pending), frame):
+                pending.append(frame)
+            return
+
+        try:
+            if type(frame) is not Frame:
+                sent = conn.send(frame)
+            elif hasattr(conn, "sendmsg"):
+                sent = conn.sendmsg(frame.parts())
+            else:
+                sent = conn.send(frame.header)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close(conn)
+            return
+
+        if sent < len(frame):
+            pending = self.outbox[conn] = _Outbox()
+            pending.append(frame)
+            pending.written(sent)
+            self.sel.modify(conn, selectors.EVENT_READ | selectors.EVENT_WRITE, self.ready)
+
+    def write(self, conn, mask):
+        """Flush the pending outbox of conn."""
+        pending = self.outbox.get(conn)
+        if not pending:
+            return
+        try:
+            pending.write(conn)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close(conn)
+            return
+
+        if not pending:
+            del self.outbox[conn]
+            self.stalled.discard(conn)
+            self.sel.modify(conn, selectors.EVENT_READ, self.read)
+            if conn in self.held:
+                self.flush(conn)  # o que foi retido por a outbox estar cheia
+
+    def backlog(self) -> Dict[socket.socket, int]:
+        """Returns the number of bytes waiting to be written to each connection."""
+        return {conn: len(pending) for conn, pending in self.outbox.items()}
+
+    def pending(self, conn) -> int:
+        """Returns the number of bytes waiting to be written to conn."""
+        return len(self.outbox.get(conn, b""))
+
+    def close(self, conn):
+        """Forget a connection and all its subscriptions."""
+        if conn not in self.channels:
+            return
+        super().close(conn)
+        self.outbox.pop(conn, None)
+        self.sel.unregister(conn)
+        conn.close()
+
+    def run(self):
+        """Run until canceled (or interrupted: Ctrl+C exits through signal_handler)."""
+
+        profiler = self.profiler
+        try:
+            while not self.canceled:
+                events = self.sel.select(self.poll_interval)
+                for key, mask in events:
+                    callback = key.data
+                    if profiler is None:
+                        callback(key.fileobj, mask)
+                    else:
+                        profiler.call(callback, key.fileobj, mask)
+                self.tick()
+        finally:
+            for conn in list(self.inbox):
+                self.close(conn)
+            if profiler is not None:
+                logger.info("event loop of the broker:\n%s", profiler.report())
+            self.sel.unregister(self.sock)
+            if self.metrics_sock is not None:
+                self.sel.unregister(self.metrics_sock)
+                self.metrics_sock.close()
+            self.sel.close()
+            self.sock.close()
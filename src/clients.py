@@ -1,22 +1,26 @@
 """Prototype broker clients: consumer + producer."""
+from src.aiomiddleware import AsyncConnection, AsyncPickleQueue
 from src.log import get_logger
-from src.middleware import PickleQueue, MiddlewareType
+from src.middleware import Connection, PickleQueue, MiddlewareType
 
 
 class Consumer:
     """Consumer implementation"""
 
-    def __init__(self, topic, queue_type=PickleQueue):
-        """Initialize Queue"""
+    def __init__(self, topic, queue_type=PickleQueue, group=None):
+        """Initialize Queue; consumers with the same group share the events of topic."""
         self.topic = topic
-        self.queue = queue_type(f"{topic}", _type=MiddlewareType.CONSUMER)
+        self.queue = queue_type(f"{topic}", _type=MiddlewareType.CONSUMER, group=group)
         self.logger = get_logger(f"Consumer {topic}")
         self.received = []
 
     def run(self, events=10):
         """Consume at most <events> events."""
         for _ in range(events):
-            topic, data = self.queue.pull()
+            msg = self.queue.pull()
+            if msg is None:  # o broker fechou a ligação
+                break
+            topic, data = msg
             self.logger.info("%s: %s", topic, data)
             self.received.append(data)
 
@@ -29,8 +33,10 @@ class Producer:
         self.logger = get_logger(f"Producer {topic}")
 
         if isinstance(topic, list):
+            # todos os subtópicos partilham a mesma ligação ao broker
+            connection = Connection(queue_type.ser_type)
             self.queue = [
-                queue_type(subtopic, _type=MiddlewareType.PRODUCER)
+                queue_type(subtopic, _type=MiddlewareType.PRODUCER, connection=connection)
                 for subtopic in topic
             ]
         else:
@@ -46,3 +52,66 @@ class Producer:
                 self.logger.info("%s: %s", queue.topic, value)
 
                 self.produced.append(value)
+
+
+class AsyncConsumer:
+    """Consumer implementation on asyncio."""
+
+    def __init__(self, topic, queue_type=AsyncPickleQueue, group=None):
+        """Initialize Queue; connect() subscribes, joining group if given."""
+        self.topic = topic
+        self.queue = queue_type(f"{topic}", _type=MiddlewareType.CONSUMER, group=group)
+        self.logger = get_logger(f"Consumer {topic}")
+        self.received = []
+
+    async def connect(self):
+        """Connect to the broker and subscribe to topic."""
+        await self.queue.connect()
+
+    async def run(self, events=10):
+        """Consume at most <events> events."""
+        if self.queue.writer is None:
+            await self.connect()
+        for _ in range(events):
+            msg = await self.queue.pull()
+            if msg is None:  # o broker fechou a ligação
+                break
+            topic, data = msg
+            self.logger.info("%s: %s", topic, data)
+            self.received.append(data)
+
+
+class AsyncProducer:
+    """Producer implementation on asyncio."""
+
+    def __init__(self, topic, value_generator, queue_type=AsyncPickleQueue):
+        """Initialize Queue; connect() opens the connection."""
+        self.logger = get_logger(f"Producer {topic}")
+
+        if isinstance(topic, list):
+            # todos os subtópicos partilham a mesma ligação ao broker
+            connection = AsyncConnection(queue_type.ser_type)
+            self.queue = [
+                queue_type(subtopic, _type=MiddlewareType.PRODUCER, connection=connection)
+                for subtopic in topic
+            ]
+        else:
+            self.queue = [queue_type(topic, _type=MiddlewareType.PRODUCER)]
+        self.produced = []
+        self.gen = value_generator
+
+    async def connect(self):
+        """Connect every queue to the broker, over the connection they share."""
+        for queue in self.queue:
+            await queue.connect()
+
+    async def run(self, events=10):
+        """Produce at most <events> events."""
+        if self.queue[0].writer is None:
+            await self.connect()
+        for _ in range(events):
+            for queue, value in zip(self.queue, self.gen()):
+                await queue.push(value)
+                self.logger.info("%s: %s", queue.topic, value)
+
+                self.produced.append(value)
@@ -0,0 +1,237 @@
+"""Multi-process Message Broker: one worker per core on the same port."""
+import multiprocessing
+import os
+import pickle
+import selectors
+import socket
+import zlib
+from typing import Dict, List
+
+from .broker import Broker, Serializer
+from .log import get_logger
+from .protocol import FRAME32, CDProto, FrameDecoder
+from .topics import TopicTree, is_pattern, split_topic
+
+logger = get_logger("Cluster")
+
+
+def shard_key(topic: str) -> tuple:
+    """Returns the segments that decide which worker owns topic.
+
+    "/weather2/humidity" is owned by the worker of "/weather2", so a topic and
+    all its subtopics always live in the same shard.
+    """
+    segments = split_topic(topic)
+    return segments[:2] if segments[0] == "" else segments[:1]
+
+
+class WorkerBroker(Broker):
+    """Broker process that owns a shard of the topic space.
+
+    Every worker accepts clients on the same port (SO_REUSEPORT). Publishes
+    are forwarded to the owner of their topic, which stores the value and
+    delivers it to its own subscribers and to the workers that told it they
+    have subscribers for the topic. New topic names are announced to every
+    worker so list_topics() is the same everywhere. The frames of these
+    internal messages are never dropped for a full outbox. Consumer groups are
+    not supported: the members of a group land on different workers, which
+    would each get the value, so a subscription with a group is refused by
+    closing its connection.
+    """
+
+    reuse_port = True
+
+    def __init__(self, index: int, links: Dict[int, socket.socket], host: str = "localhost",
+                 port: int = 5000, max_outbox: int = 4 * 2**20):
+        """Initialize worker <index>; links maps every other worker to its IPC socket."""
+        super().__init__(host, port, max_outbox)
+        self.index = index
+        self.workers = len(links) + 1
+        self.links = links  # worker -> IPC socket
+        self.peers = {}  # IPC socket -> worker
+        self.names = set()  # every topic with a value, in any shard
+        self.remote = TopicTree()  # topic -> workers with subscribers to it
+
+        for worker, link in links.items():
+            link.setblocking(False)
+            self.sel.register(link, selectors.EVENT_READ, self.read)
+            self.channels[link] = Serializer.PICKLE
+            self.inbox[link] = FrameDecoder()  # um valor reencaminhado leva mais que o seu payload
+            self.features[link] = {FRAME32}
+            self.peers[link] = worker
+
+    def owners(self, topic: str) -> List[int]:
+        """Returns the workers that own topic and its subtopics.
+
+        The first one stores the values published to topic itself.
+        """
+        key = shard_key(topic)
+        if key == ("",) or is_pattern("/".join(key)):  # "/" e "/+/..." abrangem todos os shards
+            return list(range(self.workers))
+        return [zlib.crc32("/".join(key).encode("utf-8")) % self.workers]
+
+    def forward(self, worker: int, **msg):
+        """Send an internal message to another worker."""
+        self.send(self.links[worker], CDProto.encode_frame(
+            Serializer.PICKLE.value, pickle.dumps(msg), True))
+
+    def full(self, conn, pending: int, frame: bytes) -> bool:
+        """Tells if frame must be dropped; never for the link to another worker,
+        where a lost publish, interest or topic would leave the shards out of sync."""
+        if conn in self.peers:
+            return False
+        return super().full(conn, pending, frame)
+
+    def received(self, conn, data: bytes):
+        """Handle frames from clients and from the other workers."""
+        worker = self.peers.get(conn)
+        if worker is None:
+            super().received(conn, data)
+            return
+
+        decoder = self.inbox[conn]
+        decoder.feed(data)
+        for _, payload in decoder.frames():
+            self.handle_peer(worker, pickle.loads(payload))
+
+    def handle_peer(self, worker: int, msg: dict):
+        """Execute an internal message sent by another worker."""
+        op = msg["op"]
+        topic = msg["topic"]
+
+        if op == "publish":
+            self.publish(topic, msg["message"])
+
+        elif op == "deliver":
+            super().publish(topic, msg["message"])
+
+        elif op == "replay":
+            # primeiro subscritor deste worker: recebe o último valor do dono
+            self.put_topic(topic, msg["message"])
+            # só os subscritores do próprio tópico: os dos antecessores já o receberam
+            for address, _format in self.subscriptions.get(topic):
+                self.deliver(address, topic, _format or Serializer.JSON)
+
+        elif op == "interest":
+            if not msg["on"]:
+                self.remote.remove(topic, worker)
+                return
+            self.remote.add(topic, (worker, None))
+            if self.get_topic(topic) and self.owners(topic)[0] == self.index:
+                self.forward(worker, op="replay", topic=topic, message=self.topics[topic])
+
+        elif op == "topic":
+            self.names.add(topic)
+
+    def publish(self, topic, value, serializer: Serializer = Serializer.JSON, payload: bytes = None):
+        """Store and deliver value if this worker owns topic, else forward it to the owner."""
+        owner = self.owners(topic)[0]
+        if owner != self.index:
+            self.forward(owner, op="publish", topic=topic, message=value)
+            return
+
+        if topic not in self.names:
+            self.names.add(topic)
+            for worker in self.links:
+                self.forward(worker, op="topic", topic=topic)
+
+        super().publish(topic, value, serializer, payload)
+        for worker in {worker for worker, _ in self.remote.match(topic)}:
+            self.forward(worker, op="deliver", topic=topic, message=value)
+
+    def list_topics(self) -> List[str]:
+        """Returns a list of strings containing all topics containing values, in every shard."""
+        return list(self.names)
+
+    def subscribe(self, topic: str, address: socket.socket, _format: Serializer = None, **options):
+        """Subscribe to topic, telling its owners the first time this worker needs it."""
+        if options.get("group") is not None:
+            logger.warning("%s subscribed to %s with group %s, which a cluster cannot balance",
+                           address, topic, options["group"])
+            self.close(address)
+            return
+        first = topic not in self.subscriptions
+        super().subscribe(topic, address, _format, **options)
+        if first:
+            self.interest(topic, True)
+
+    def unsubscribe(self, topic, address):
+        """Unsubscribe to topic, telling its owners when this worker no longer needs it."""
+        super().unsubscribe(topic, address)
+        if topic not in self.subscriptions:
+            self.interest(topic, False)
+
+    def unsubscribe_all(self, address):
+        """Cancel every subscription of address, telling the owners of the topics no longer needed."""
+        topics = self.subscriptions.topics_of(address) + list(self.memberships.get(address, ()))
+        super().unsubscribe_all(address)
+        for topic in topics:
+            if topic not in self.subscriptions:
+                self.interest(topic, False)
+
+    def interest(self, topic: str, on: bool):
+        """Tell the other owners of topic whether this worker has subscribers to it."""
+        owners = self.owners(topic)
+        if not on and owners[0] != self.index:
+            # sem subscritores a cópia local deixa de ser atualizada
+            self.topics.pop(topic, None)
+            self.frames.pop(topic, None)
+        for owner in owners:
+            if owner != self.index:
+                self.forward(owner, op="interest", topic=topic, on=on)
+
+
+def _work(index, links, host, port, ready):
+    broker = WorkerBroker(index, links, host, port)
+    ready.put(index)
+    broker.run()
+
+
+class Cluster:
+    """Runs <workers> WorkerBroker processes that share host:port."""
+
+    def __init__(self, workers: int = os.cpu_count(), host: str = "localhost", port: int = 5000):
+        """Initialize cluster."""
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.processes = []
+
+    def start(self):
+        """Start the workers, connected to each other by socket pairs."""
+        links = [{} for _ in range(self.workers)]
+        for i in range(self.workers):
+            for j in range(i + 1, self.workers):
+                links[i][j], links[j][i] = socket.socketpair()
+
+        # spawn: os workers não herdam os sockets do processo que os lança
+        context = multiprocessing.get_context("spawn")
+        ready = context.Queue()
+        for index in range(self.workers):
+            process = context.Process(
+                target=_work, args=(index, links[index], self.host, self.port, ready),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+        # espera que todos os workers estejam a escutar na porta
+        for _ in range(self.workers):
+            ready.get()
+        for worker_links in links:
+            for link in worker_links.values():
+                link.close()
+
+    def run(self):
+        """Start the workers and wait for them."""
+        self.start()
+        for process in self.processes:
+            process.join()
+
+    def stop(self):
+        """Stop every worker."""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
@@ -0,0 +1,63 @@
+"""Consumer groups: subscriptions that share the values published to a topic."""
+from typing import Callable, Dict, List, Tuple
+
+from .protocol import LEAST_LOADED, ROUND_ROBIN
+
+
+class Group:
+    """The members of one consumer group subscribed to one topic.
+
+    The broker subscribes the group itself in place of its members, so a
+    publish routed to it is delivered to just one of them, the one pick()
+    returns: each member in turn (ROUND_ROBIN) or the one with the least
+    load (LEAST_LOADED), ties going to the next in turn. A member leaving
+    only takes it out of the turns, the others share its part from the
+    next value on.
+    """
+
+    __slots__ = ("name", "topic", "balance", "members", "order", "turn")
+
+    def __init__(self, name: str, topic: str, balance: str = ROUND_ROBIN):
+        """Initialize group."""
+        self.name = name
+        self.topic = topic
+        self.balance = balance
+        self.members: Dict[object, object] = {}  # address -> Serializer
+        self.order: List[object] = []  # addresses, in turn order
+        self.turn = 0  # index in order of the next member
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def join(self, address, _format):
+        """Adds address to the group, or updates its format if it already is a member."""
+        if address not in self.members:
+            self.order.append(address)
+        self.members[address] = _format
+
+    def leave(self, address):
+        """Removes address from the group."""
+        if address not in self.members:
+            return
+        del self.members[address]
+        index = self.order.index(address)
+        del self.order[index]
+        if index < self.turn:
+            self.turn -= 1
+        if self.turn >= len(self.order):
+            self.turn = 0
+
+    def pick(self, load: Callable = None) -> Tuple[object, object]:
+        """Returns the (address, Serializer) of the member that gets the next value.
+
+        load(address) is the load of a member, compared by LEAST_LOADED.
+        """
+        order = self.order
+        turn = self.turn
+        if self.balance == LEAST_LOADED and load is not None and len(order) > 1:
+            # a procura começa na vez atual: os empatados vão rodando
+            turn = min(range(turn, turn + len(order)), key=lambda i: load(order[i % len(order)]))
+            turn %= len(order)
+        address = order[turn]
+        self.turn = (turn + 1) % len(order)
+        return address, self.members[address]
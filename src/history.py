@@ -0,0 +1,119 @@
+"""Bounded in-memory history of the last values published to each topic."""
+from array import array
+from typing import List, Optional, Tuple
+
+from .protocol import EXTENDED, frame_parts_of
+
+
+class _Ring:
+    """Frames of one topic in a circular byte buffer, indexed by two arrays."""
+
+    __slots__ = ("data", "starts", "sizes", "head", "count", "end", "first")
+
+    def __init__(self, capacity: int):
+        self.data = bytearray()  # grows up to max_bytes, then wraps around
+        self.starts = array("I", bytes(4 * capacity))  # start of each frame in data
+        self.sizes = array("I", bytes(4 * capacity))
+        self.head = 0  # slot of the oldest frame
+        self.count = 0
+        self.end = 0  # position right after the newest frame
+        self.first = 0  # sequence of the oldest frame
+
+    def evict(self):
+        """Drops the oldest frame."""
+        self.head = (self.head + 1) % len(self.starts)
+        self.count -= 1
+        self.first += 1
+        if not self.count:
+            self.end = 0
+
+    def place(self, size: int, max_bytes: int) -> int:
+        """Evicts old frames until size bytes fit, and returns where they go."""
+        if self.count == len(self.starts):
+            self.evict()
+        while self.count:
+            oldest = self.starts[self.head]
+            if self.end > oldest:  # os dados não dão a volta ao buffer
+                if max_bytes - self.end >= size:
+                    return self.end
+                if oldest >= size:
+                    return 0
+            elif oldest - self.end >= size:
+                return self.end
+            self.evict()
+        return 0
+
+
+class History:
+    """The last values published to each topic, kept as encoded publish frames.
+
+    Every topic gets a ring of at most capacity frames and max_bytes bytes;
+    the oldest frames are dropped to make room. Frames are numbered by
+    sequence, from 0 for the first value published to the topic.
+    """
+
+    def __init__(self, capacity: int = 1024, max_bytes: int = 2**20):
+        """Initialize history."""
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._rings = {}  # topic -> _Ring
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def end(self, topic: str) -> int:
+        """Returns the sequence the next frame appended to topic will get."""
+        ring = self._rings.get(topic)
+        return ring.first + ring.count if ring else 0
+
+    def append(self, topic: str, frame: bytes) -> int:
+        """Stores a frame (bytes or a Frame) in the history of topic and returns its sequence."""
+        ring = self._rings.get(topic)
+        if ring is None:
+            ring = self._rings[topic] = _Ring(self.capacity)
+
+        size = len(frame)
+        if size > self.max_bytes:
+            # não cabe: o histórico passa a começar depois desta trama
+            ring.first += ring.count + 1
+            ring.count = ring.end = 0
+            return ring.first - 1
+
+        position = ring.place(size, self.max_bytes)
+        if position + size > len(ring.data):
+            ring.data.extend(bytes(position + size - len(ring.data)))
+        start = position
+        for part in frame_parts_of(frame):
+            ring.data[start : start + len(part)] = part
+            start += len(part)
+
+        slot = (ring.head + ring.count) % self.capacity
+        ring.starts[slot] = position
+        ring.sizes[slot] = size
+        ring.count += 1
+        ring.end = position + size
+        return ring.first + ring.count - 1
+
+    def read(self, topic: str, last: Optional[int] = None,
+             since: Optional[int] = None) -> List[Tuple[int, bytes]]:
+        """Returns (serializer, payload) of the last <last> frames of topic, or of
+        the ones from sequence <since> on (both: the fewest frames)."""
+        ring = self._rings.get(topic)
+        if ring is None:
+            return []
+
+        skip = 0
+        if last is not None:
+            skip = max(skip, ring.count - max(last, 0))
+        if since is not None:
+            skip = max(skip, since - ring.first)
+
+        frames = []
+        data = ring.data
+        for i in range(skip, ring.count):
+            slot = (ring.head + i) % self.capacity
+            start = ring.starts[slot]
+            header = data[start]
+            begin = start + (5 if header & EXTENDED else 3)
+            frames.append((header & ~EXTENDED, bytes(data[begin : start + ring.sizes[slot]])))
+        return frames
@@ -0,0 +1,98 @@
+"""Counters of a Message Broker and their plain-text exposition."""
+import time
+from typing import Dict
+
+
+class Metrics:
+    """Counters a broker updates on its hot paths.
+
+    Updating one is a single integer (or dict entry) increment; the gauges
+    (open connections, subscribers, outbox depth) are only computed when a
+    snapshot is taken.
+    """
+
+    def __init__(self):
+        """Initialize counters."""
+        self.started = time.monotonic()
+        self.accepted = 0  # connections accepted
+        self.closed = 0  # connections closed
+        self.messages_in = 0  # frames received
+        self.bytes_in = 0
+        self.messages_out = 0  # values sent to subscribers
+        self.bytes_out = 0
+        self.dropped = 0  # values dropped for a subscriber (full outbox or held, framing, format)
+        self.slow_consumers = 0  # times values were held for a consumer out of credits or window
+        self.overflows = 0  # values arriving when max_held were already held for a consumer
+        self.conflated = 0  # held values replaced by a newer one of the same topic
+        self.slow_disconnects = 0  # consumers disconnected by their overflow policy
+        self.acked = 0  # values acked by consumers with acknowledged delivery
+        self.redelivered = 0  # values sent again: ack overdue or session resumed
+        self.subscribes = 0
+        self.unsubscribes = 0
+        self.published = {}  # topic -> values published
+
+    def snapshot(self, broker) -> Dict[str, float]:
+        """Returns every counter and gauge of broker, by name.
+
+        Per-topic names carry the topic as a label, e.g. published{topic="/weather"}.
+        """
+        backlog = broker.backlog()
+        stats = {
+            "uptime_seconds": round(time.monotonic() - self.started, 3),
+            "connections_accepted": self.accepted,
+            "connections_closed": self.closed,
+            "connections_open": len(broker.inbox),
+            "messages_in": self.messages_in,
+            "bytes_in": self.bytes_in,
+            "messages_out": self.messages_out,
+            "bytes_out": self.bytes_out,
+            "messages_dropped": self.dropped,
+            "subscribes": self.subscribes,
+            "unsubscribes": self.unsubscribes,
+            "topics": len(broker.topics),
+            "subscribed_topics": len(broker.subscriptions),
+            "consumer_groups": len(broker.groups),
+            "outbox_bytes": sum(backlog.values()),
+            "outbox_max_bytes": max(backlog.values(), default=0),
+            "stalled_connections": len(broker.stalled),
+            "slow_consumer_events": self.slow_consumers,
+            "held_overflows": self.overflows,
+            "held_conflated": self.conflated,
+            "slow_consumer_disconnects": self.slow_disconnects,
+            "held_messages": sum(len(held) for held in broker.held.values()),
+            "consumers_without_credits": sum(1 for credits in broker.credits.values()
+                                             if credits <= 0),
+            "messages_acked": self.acked,
+            "messages_redelivered": self.redelivered,
+            "messages_in_flight": sum(len(window) for window in broker.windows.values()),
+            "sessions_detached": len(broker.sessions),
+        }
+        for topic, count in self.published.items():
+            stats[f"published{{topic={_quote(topic)}}}"] = count
+        for topic in broker.subscriptions.topics():
+            stats[f"subscribers{{topic={_quote(topic)}}}"] = len(broker.subscriptions.get(topic))
+        return stats
+
+
+def _quote(topic: str) -> str:
+    """Label value of topic in the text exposition format."""
+    escaped = topic.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+def exposition(stats: Dict[str, float], prefix: str = "broker_") -> bytes:
+    """Renders a snapshot in the plain-text format scraped by Prometheus."""
+    lines = [f"{prefix}{name} {value}" for name, value in stats.items()]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def http_response(stats: Dict[str, float]) -> bytes:
+    """The HTTP response of a scrape of the metrics port."""
+    body = exposition(stats)
+    header = (
+        "HTTP/1.0 200 OK\r\n"
+        "Content-Type: text/plain; version=0.0.4\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return header.encode("ascii") + body
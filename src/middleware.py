@@ -1,9 +1,14 @@
 """Middleware to communicate with PubSub Message Broker."""
+from collections import deque
 from collections.abc import Callable
 from enum import Enum
-from typing import Any, Tuple
+from typing import Any, Optional, Tuple
 import socket
-from .protocol import CDProto
+from .protocol import (
+    COMPRESSORS, FEATURES, FRAME32, CDProto, CDProtoBadFormat, FrameDecoder, Message,
+    compression_of,
+)
+from .topics import TopicTree
 
 
 class MiddlewareType(Enum):
@@ -13,141 +18,295 @@ class MiddlewareType(Enum):
     PRODUCER = 2
 
 
-class Queue:
-    """Representation of Queue interface for both Consumers and Producers."""
+class Connection:
+    """One connection to the broker, shared by the Queues of many topics.
 
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        """Create Queue."""
-        self.topic = topic
-        self.type = _type
-        self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-        self.sock.connect(('localhost',5000))
+    The broker keeps the subscriptions of every topic on the connection; the
+    values it sends are handed to the Queues subscribed to their topic.
+    With compression (a name in COMPRESSORS, e.g. "zlib") large messages are
+    compressed both ways, if the broker accepts it. Values are numbered in
+    the order they arrive; with acknowledged delivery the connection acks
+    them once every Queue they went to has processed them.
+    """
 
-    def push(self, value):
-        """Sends data to broker."""
+    recv_size = 2**16  # bytes read from the socket at once
 
-    def pull(self) -> Tuple[str, Any]:
-        """Receives (topic, data) from broker. Should BLOCK the consumer!"""
-    
-    def list_topics(self, callback: Callable):
-        """Lists all topics available in the broker."""
-        
-    def cancel(self):
-        """Cancel subscription."""
+    def __init__(self, ser_type: int, host="localhost", port=5000, compression: str = None):
+        """Open a connection that speaks serializer ser_type."""
+        self.ser_type = ser_type
+        self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.sock.connect((host, port))
+        self.queues = TopicTree()  # topic -> (Queue, None) subscribed on this connection
+        self.replies = deque()  # messages that are not values of a topic
+        self.decoder = FrameDecoder()
+        self.buffer = bytearray(self.recv_size)
+        self.features = set()  # protocol features accepted by the broker
+        self.compression = None  # compression algorithm accepted by the broker
+        self.window = 0  # values the broker may send before they are acked (0: no acks)
+        self.subscribed = False  # a Queue already subscribed on this connection
+        self.delivered = 0  # number of the last value received
+        self.acked = 0  # number of the last value acked
+        self.hello(compression)
+
+    def hello(self, compression: str = None):
+        """Negotiates with the broker the protocol features of this connection."""
+        offered = list(FEATURES) + ([compression] if compression else [])
+        CDProto.send_msg(self.sock, "hello", self.ser_type, message=offered)
+        msg = self.receive()
+        self.features = set(msg.features)
+        self.compression = compression_of(msg.features)
+        if self.compression is not None:
+            self.decoder.decompress = COMPRESSORS[self.compression][1]
+
+    @property
+    def extended(self) -> bool:
+        """Tells if messages of 64 KiB or more can be sent and received."""
+        return FRAME32 in self.features
+
+    def subscribe(self, queue: "Queue"):
+        """Subscribe queue to its topic on this connection.
+
+        The values are numbered from the start of the connection and the
+        broker numbers them from the subscription that opens the window, so
+        only the first subscription can open it.
+        """
+        if queue.window and not self.window and self.subscribed:
+            raise ValueError("acknowledged delivery must start with the first subscription")
+        self.subscribed = True
+        self.queues.add(queue.topic, (queue, None))
+        self.window += queue.window or 0
+        CDProto.send_msg(self.sock, "subscribe", self.ser_type, queue.topic, queue.options())
+
+    def unsubscribe(self, queue: "Queue"):
+        """Cancel the subscription of queue."""
+        self.queues.remove(queue.topic, queue)
+        if queue.topic not in self.queues:  # outras Queues ainda precisam do tópico
+            CDProto.send_msg(self.sock, "unsubscribe", self.ser_type, queue.topic)
+
+    def fill(self) -> bool:
+        """Reads what is available and hands every complete message to its Queues.
+
+        Every recv reads as much as is available and decodes all the complete
+        frames in it, so a consumer that is behind makes one syscall for many
+        messages. Returns False if the broker closed the connection.
+        """
+        with memoryview(self.buffer) as view:
+            try:
+                size = self.sock.recv_into(view)
+            except ConnectionError:
+                return False
+            if size == 0:
+                return False
+            self.decoder.feed(view[:size])
+        for header, payload in self.decoder.frames():
+            msg = CDProto.decode_msg(payload, header)
+            if msg.command != "publish":
+                self.replies.append(msg)
+                continue
+            self.delivered += 1
+            msg.seq = self.delivered
+            # uma Queue subscrita a vários antecessores do tópico recebe só uma vez
+            for queue in dict(self.queues.match(msg.topic)):
+                queue.prefetched.append(msg)
+        return True
+
+    def receive(self, queue: "Queue" = None) -> Optional[Message]:
+        """Returns the next message for queue (or reply), or None if the broker closed the connection."""
+        inbox = self.replies if queue is None else queue.prefetched
+        while not inbox and not self.replies:
+            if self.window:
+                self.acknowledge(now=True)  # antes de bloquear confirma o que já foi processado
+            if not self.fill():
+                return None
+        return (inbox or self.replies).popleft()
+
+    def acknowledge(self, now: bool = False):
+        """Acks the values every Queue processed, once they are half the window
+        or, with now, as soon as there are any.
+
+        If the broker closed the connection nothing is acked; the next
+        receive() tells it by returning None.
+        """
+        batch = max(1, self.window // 2)
+        if self.delivered == self.acked or (not now and self.delivered - self.acked < batch):
+            return
+        done = self.delivered
+        for topic in self.queues.topics():
+            for queue, _ in self.queues.get(topic):
+                if queue.current is not None:
+                    done = min(done, queue.current - 1)
+                if queue.prefetched:
+                    done = min(done, queue.prefetched[0].seq - 1)
+        if done - self.acked >= batch or (now and done > self.acked):
+            try:
+                CDProto.send_msg(self.sock, "ack", self.ser_type, message=done)
+            except CDProtoBadFormat:
+                return
+            self.acked = done
+
+    def close(self):
+        """Close the connection."""
+        self.sock.close()
 
 
-class JSONQueue(Queue):
-    """Queue implementation with JSON based serialization."""
+class Queue:
+    """Representation of Queue interface for both Consumers and Producers."""
 
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        super().__init__(topic, _type)
-        self.ser_type = 0
+    ser_type = None  # serializer of the subclass
+
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, host="localhost", port=5000,
+                 offset=None, last=None, since=None, connection: Connection = None,
+                 compression: str = None, credits: int = None, policy: str = None,
+                 group: str = None, balance: str = None, window: int = None,
+                 session: str = None):
+        """Create Queue.
+
+        A consumer created with an offset first gets every value the broker
+        logged in topic from that offset on; offset then tracks the next one,
+        so a new Queue(topic, offset=queue.offset) resumes where this one stopped.
+        last and since do the same with the history the broker keeps in memory:
+        the last <last> values, or the ones from sequence <since> on.
+        Queues created with the same connection share its socket; without one
+        a Connection is opened, offering compression to the broker.
+        A consumer created with credits gets at most that many values ahead of
+        pull(), which grants new credits as values are pulled; the broker holds
+        the rest, applying policy (a name in POLICIES) when it holds too many.
+        Consumers of topic created with the same group get each value once
+        between them, balanced as balance (a name in BALANCES) says.
+        A consumer created with a window acks the values it pulls: a value
+        counts as processed when pull() is called again (or ack()), and the
+        broker sends again the ones not acked in time. With a session, the
+        values a consumer never acked go to the next one with that session.
+        """
+        self.topic = topic
+        self.type = _type
+        self.offset = offset
+        self.last = last
+        self.since = since
+        self.credits = credits
+        self.policy = policy
+        self.group = group
+        self.balance = balance
+        self.window = window
+        self.session = session
+        self.current = None  # number of the value pulled and not yet processed
+        self.consumed = 0  # values pulled since credits were last granted
+        if connection is None:
+            connection = Connection(self.ser_type, host, port, compression)
+        elif connection.ser_type != self.ser_type:
+            raise ValueError("connection uses another serializer")
+        self.connection = connection
+        self.sock = connection.sock
+        self.prefetched = deque()  # messages of topic received but not yet pulled
 
         if self.type == MiddlewareType.CONSUMER:
-            CDProto.send_msg(self.sock, "subscribe", self.ser_type, self.topic)
+            connection.subscribe(self)
+
+    def receive(self) -> Optional[Message]:
+        """Returns the next message from the broker, or None if it closed the connection."""
+        return self.connection.receive(self)
+
+    def options(self) -> dict:
+        """Optional fields of the subscribe message."""
+        options = {"offset": self.offset, "last": self.last, "since": self.since,
+                   "credits": self.credits, "policy": self.policy, "group": self.group,
+                   "balance": self.balance, "window": self.window, "session": self.session}
+        return {option: value for option, value in options.items() if value is not None}
+
+    def received(self, topic):
+        """Account for a value received from topic."""
+        if self.credits:
+            # concede créditos aos lotes, não a cada valor
+            self.consumed += 1
+            if self.consumed >= max(1, self.credits // 2):
+                CDProto.send_msg(self.sock, "credit", self.ser_type, message=self.consumed)
+                self.consumed = 0
+        if topic != self.topic:
+            return
+        if self.offset is not None:
+            self.offset += 1
+        if self.since is not None:
+            self.since += 1
+
+    @property
+    def features(self) -> set:
+        """Protocol features accepted by the broker."""
+        return self.connection.features
+
+    @property
+    def extended(self) -> bool:
+        """Tells if messages of 64 KiB or more can be sent and received."""
+        return self.connection.extended
 
     def push(self, value):
         """Sends data to broker."""
+        CDProto.send_msg(self.sock, "publish", self.ser_type, self.topic, value, self.extended,
+                         self.connection.compression)
+
+    def push_many(self, values):
+        """Sends several values to broker in as few frames as possible."""
+        frames = CDProto.encode_batch(self.ser_type, self.topic, list(values), self.extended,
+                                      self.connection.compression)
+        CDProto.send_parts(self.sock, frames)
 
-        CDProto.send_msg(self.sock, "publish", self.ser_type, self.topic, value)
-        
     def pull(self) -> Tuple[str, Any]:
         """Receives (topic, data) from broker. Should BLOCK the consumer!"""
+        if self.connection.window:
+            self.current = None  # o valor anterior já foi processado
+            self.connection.acknowledge()
 
-        header = self.sock.recv(1)
-        msg = CDProto.recv_msg(self.sock)
+        msg = self.receive()
 
         if msg is not None:
-            if msg["command"] == "publish":
-                return msg["topic"], msg["message"]
-            elif msg["command"] == "listTopics":
+            if msg.command == "publish":
+                self.current = msg.seq
+                self.received(msg.topic)
+                return msg.topic, msg.message
+            elif msg.command == "listTopics":
                 self.list_topics(self.pull())
         else:
             return
 
-    
+    def ack(self):
+        """Acks every value pulled so far, without waiting for the batch."""
+        self.current = None
+        self.connection.acknowledge(now=True)
+
     def list_topics(self, callback: Callable):
         """Lists all topics available in the broker."""
         CDProto.send_msg(self.sock, "listTopics", self.ser_type, self.topic)
         callback()
 
+    def stats(self) -> Optional[dict]:
+        """Returns a snapshot of the metrics of the broker, or None if it closed the connection."""
+        CDProto.send_msg(self.sock, "stats", self.ser_type)
+        msg = self.connection.receive()
+        return None if msg is None else msg.stats
 
     def cancel(self):
         """Cancel subscription."""
-        CDProto.send_msg(self.sock, "unsubscribe", self.ser_type, self.topic)
+        self.connection.unsubscribe(self)
 
 
-class XMLQueue(Queue):
-    """Queue implementation with XML based serialization."""
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        super().__init__(topic, _type)
-        self.ser_type = 1
-
-        if self.type == MiddlewareType.CONSUMER:
-            CDProto.send_msg(self.sock, "subscribe", self.ser_type, self.topic)
-
-    def push(self, value):
-        """Sends data to broker."""
-        CDProto.send_msg(self.sock, "publish", self.ser_type, self.topic, value)
-        
-    def pull(self) -> Tuple[str, Any]:
-        """Receives (topic, data) from broker. Should BLOCK the consumer!"""
+class JSONQueue(Queue):
+    """Queue implementation with JSON based serialization."""
 
-        header = self.sock.recv(1)
-        msg = CDProto.recv_msg(self.sock)
+    ser_type = 0
 
-        if msg:
-            if msg["command"] == "publish": 
-                return msg["topic"], msg["message"]
-            elif msg["command"] == "listTopics":
-                self.list_topics(self.pull())
-        else:
-            return
 
-    
-    def list_topics(self, callback: Callable):
-        """Lists all topics available in the broker."""
-        CDProto.send_msg(self.sock, "listTopics", self.ser_type, self.topic)
-        callback()
-      
+class XMLQueue(Queue):
+    """Queue implementation with XML based serialization."""
 
-    def cancel(self):
-        """Cancel subscription."""
-        CDProto.send_msg(self.sock, "unsubscribe", self.ser_type, self.topic)
+    ser_type = 1
 
 
 class PickleQueue(Queue):
     """Queue implementation with Pickle based serialization."""
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        super().__init__(topic, _type)
-        self.ser_type = 2
 
-        if self.type == MiddlewareType.CONSUMER:
-            CDProto.send_msg(self.sock, "subscribe", self.ser_type, self.topic)
+    ser_type = 2
 
-    def push(self, value):
-        """Sends data to broker."""
-        CDProto.send_msg(self.sock, "publish", self.ser_type, self.topic, value)
-        
-    def pull(self) -> Tuple[str, Any]:
-        """Receives (topic, data) from broker. Should BLOCK the consumer!"""
-        
-        header = self.sock.recv(1)
-        msg = CDProto.recv_msg(self.sock)
-
-        if msg:
-            if msg["command"] == "publish": 
-                return msg["topic"], msg["message"]
-            elif msg["command"] == "listTopics":
-                self.list_topics(self.pull())
-        else:
-            return
-    
-    def list_topics(self, callback: Callable):
-        """Lists all topics available in the broker."""
-        CDProto.send_msg(self.sock, "listTopics", self.ser_type, self.topic)
-        callback()     
 
-    def cancel(self):
-        """Cancel subscription."""
-        CDProto.send_msg(self.sock, "unsubscribe", self.ser_type, self.topic)
+class BinaryQueue(Queue):
+    """Queue implementation with compact binary serialization."""
+
+    ser_type = 3
@@ -0,0 +1,140 @@
+"""Opt-in instrumentation of the event loop of a Message Broker."""
+import cProfile
+import io
+import pstats
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List
+
+from .log import get_logger
+
+logger = get_logger("Profiler")
+
+# fase -> método do BaseBroker que a implementa
+PHASES = {"decode": "decode", "route": "route", "encode": "encoded", "send": "send"}
+BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 1e-1, 5e-1, 1.0)  # seconds
+
+
+class LoopProfiler:
+    """Timing of every callback of the event loop and of the phases inside them.
+
+    Each callback run is counted in a histogram of its durations (BUCKETS, in
+    seconds, plus one bucket for longer runs); decode, route, encode and send
+    add up their time per phase. A callback running for more than slow
+    seconds is logged with the time each phase took in it.
+
+    A broker without a LoopProfiler pays nothing for it: the phase methods
+    are only wrapped by attach().
+    """
+
+    def __init__(self, slow: float = 0.1):
+        """Initialize profiler."""
+        self.slow = slow
+        self.histograms: Dict[str, List[int]] = {}  # callback -> runs per bucket
+        self.totals: Dict[str, float] = {}  # callback -> seconds
+        self.phases = {phase: 0.0 for phase in PHASES}  # phase -> seconds
+        self.calls = {phase: 0 for phase in PHASES}
+        self.current = {}  # phase -> seconds in the callback running now
+
+    def attach(self, broker):
+        """Times the phase methods of broker."""
+        for phase, method in PHASES.items():
+            setattr(broker, method, self.timed(phase, getattr(broker, method)))
+
+    def timed(self, phase: str, method: Callable) -> Callable:
+        """Wraps method so its time is added to phase."""
+        current = self.current
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.phases[phase] += elapsed
+                self.calls[phase] += 1
+                current[phase] = current.get(phase, 0.0) + elapsed
+
+        return timed
+
+    def call(self, callback: Callable, conn, *args):
+        """Runs the callback of an event on conn, timing it."""
+        self.current.clear()
+        start = time.perf_counter()
+        try:
+            return callback(conn, *args)
+        finally:
+            self.record(getattr(callback, "__name__", str(callback)), time.perf_counter() - start,
+                        conn)
+
+    def record(self, name: str, elapsed: float, conn=None):
+        """Counts a run of callback name that took elapsed seconds."""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * (len(BUCKETS) + 1)
+            self.totals[name] = 0.0
+        histogram[bisect_left(BUCKETS, elapsed)] += 1
+        self.totals[name] += elapsed
+
+        if elapsed > self.slow:
+            phases = ", ".join(f"{phase} {seconds * 1000:.1f}ms"
+                               for phase, seconds in self.current.items())
+            logger.warning("slow callback %s on %s took %.1fms (%s)",
+                           name, _peer(conn), elapsed * 1000, phases or "no phases")
+
+    def snapshot(self) -> Dict[str, float]:
+        """Returns the histograms and phase timers by name, like Metrics.snapshot()."""
+        stats = {}
+        for name, histogram in self.histograms.items():
+            count = 0
+            for bound, runs in zip(BUCKETS + ("+Inf",), histogram):
+                count += runs
+                stats[f'loop_callback_seconds_bucket{{callback="{name}",le="{bound}"}}'] = count
+            stats[f'loop_callback_seconds_count{{callback="{name}"}}'] = count
+            stats[f'loop_callback_seconds_sum{{callback="{name}"}}'] = round(self.totals[name], 6)
+        for phase in PHASES:
+            stats[f'loop_phase_seconds_sum{{phase="{phase}"}}'] = round(self.phases[phase], 6)
+            stats[f'loop_phase_seconds_count{{phase="{phase}"}}'] = self.calls[phase]
+        return stats
+
+    def report(self) -> str:
+        """Returns a table of the callbacks and phases timed so far."""
+        lines = [f"{'callback':>16} {'runs':>10} {'total ms':>10} {'mean us':>9} {'max bucket':>11}"]
+        for name, histogram in self.histograms.items():
+            runs = sum(histogram)
+            top = max(i for i, count in enumerate(histogram) if count)
+            bound = f"<={BUCKETS[top] * 1000:g}ms" if top < len(BUCKETS) else "longer"
+            lines.append(f"{name:>16} {runs:>10} {self.totals[name] * 1000:>10.1f} "
+                         f"{self.totals[name] / runs * 1e6:>9.1f} {bound:>11}")
+        lines.append(f"{'phase':>16} {'calls':>10} {'total ms':>10}")
+        for phase in PHASES:
+            lines.append(f"{phase:>16} {self.calls[phase]:>10} {self.phases[phase] * 1000:>10.1f}")
+        return "\n".join(lines)
+
+
+def _peer(conn) -> str:
+    """Address of the peer of conn, for log messages."""
+    try:
+        if hasattr(conn, "transport"):  # conexão do AsyncBroker
+            peer = conn.transport.get_extra_info("peername")
+        else:
+            peer = conn.getpeername()
+        return "%s:%s" % peer[:2]
+    except (AttributeError, OSError, TypeError):
+        return str(conn)
+
+
+def profiled(run: Callable, path: str = None, top: int = 25):
+    """Runs run() under cProfile; when it returns (or raises) the stats are
+    dumped to path, if given, and the top functions by cumulative time logged."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return run()
+    finally:
+        profile.disable()
+        if path:
+            profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(top)
+        logger.info("profile of the broker:\n%s", out.getvalue())
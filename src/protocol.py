@@ -1,7 +1,59 @@
 import json
 import pickle
 from socket import socket
+from typing import Callable, Iterable, List, Optional, Tuple
 import xml.etree.ElementTree as ET
+import zlib
+
+from . import binary
+from .topics import pattern_segments
+
+EXTENDED = 0x80  # flag no byte do cabeçalho: o tamanho ocupa 4 bytes em vez de 2
+FRAME32 = "frame32"  # funcionalidade negociada no hello: tramas com tamanho de 4 bytes
+FEATURES = (FRAME32,)  # funcionalidades suportadas por esta implementação
+COMPRESSED = 0x40  # flag no byte do cabeçalho: o payload vai comprimido com o algoritmo negociado
+COMPRESS_MIN = 512  # payloads mais pequenos não compensa comprimir
+IOV_MAX = 1024  # partes que um só sendmsg aceita (limite do Linux)
+MAX_PAYLOAD = 2**32 - 1  # maior payload que uma trama (estendida) pode levar
+
+
+def inflate(data: bytes, max_size: int) -> bytes:
+    """Decompresses zlib data, refusing to produce more than max_size bytes."""
+    inflater = zlib.decompressobj()
+    payload = inflater.decompress(data, max_size)
+    # uma trama pequena não pode crescer sem limite dentro do broker
+    if inflater.unconsumed_tail or not inflater.eof:
+        raise ValueError("compressed payload larger than %d bytes or truncated" % max_size)
+    return payload
+
+
+# algoritmos de compressão que se podem negociar no hello: nome -> (compress, decompress)
+COMPRESSORS = {"zlib": (zlib.compress, inflate)}
+
+
+def register_compressor(name: str, compress: Callable[[bytes], bytes],
+                        decompress: Callable[[bytes, int], bytes]):
+    """Makes the compression algorithm name negotiable in hello.
+
+    decompress(data, max_size) must fail rather than return more than max_size bytes.
+    """
+    COMPRESSORS[name] = (compress, decompress)
+
+
+def accept_features(offered: Iterable[str]) -> List[str]:
+    """Returns the features of offered to accept: the ones in FEATURES and the
+    first compression algorithm known (the client lists them by preference)."""
+    offered = list(offered)
+    accepted = [feature for feature in offered if feature in FEATURES]
+    compression = compression_of(offered)
+    if compression is not None:
+        accepted.append(compression)
+    return accepted
+
+
+def compression_of(features: Iterable[str]) -> Optional[str]:
+    """Returns the compression algorithm in features, if any."""
+    return next((feature for feature in features if feature in COMPRESSORS), None)
 
 
 class Message:
@@ -11,14 +63,39 @@ class Message:
         self.command = command
 
 class Subscribe(Message):
-    """Message to join a chat topic."""
-
-    def __init__(self, command, topic):
+    """Message to join a chat topic.
+
+    offset asks the broker to first replay its log of topic from that offset;
+    last and since ask for the last values kept in its history of topic, or
+    for the ones from that sequence on. credits turns on flow control: the
+    broker sends that many values (and as many more as granted by Credit)
+    and holds the others, as policy says. Subscriptions to topic with the
+    same group share its values: each goes to one of them, picked as
+    balance says. window turns on acknowledged delivery: at most that many
+    values are sent and not yet acked by Ack; session names the consumer so
+    the ones it never acked are sent again when it reconnects.
+    """
+
+    def __init__(self, command, topic, offset=None, last=None, since=None, credits=None,
+                 policy=None, group=None, balance=None, window=None, session=None):
         super().__init__(command)
         self.topic = topic
+        self.offset = offset
+        self.last = last
+        self.since = since
+        self.credits = credits
+        self.policy = policy
+        self.group = group
+        self.balance = balance
+        self.window = window
+        self.session = session
 
     def dict(self):
-        return {"command": self.command, "topic": self.topic}
+        msg = {"command": self.command, "topic": self.topic}
+        for option in SUBSCRIBE_OPTIONS:
+            if getattr(self, option) is not None:
+                msg[option] = getattr(self, option)
+        return msg
 
     def __str__(self):
         return f'{{"command": "{self.command}", "topic": "{self.topic}"}}'
@@ -51,6 +128,70 @@ class Publish(Message):
     def dict(self):
         return {"command": self.command,  "topic": self.topic, "message": self.message}
 
+class PublishBatch(Message):
+    """Message with several values published to the same topic, in order."""
+
+    def __init__(self, command, topic, messages):
+        super().__init__(command)
+        self.topic = topic
+        self.messages = messages
+
+    def dict(self):
+        return {"command": self.command, "topic": self.topic, "messages": self.messages}
+
+class Hello(Message):
+    """Message that negotiates the protocol features of a connection."""
+
+    def __init__(self, command, features):
+        super().__init__(command)
+        self.features = features
+
+    def dict(self):
+        return {"command": self.command, "features": self.features}
+
+class Credit(Message):
+    """Message that lets the broker send credits more values to the connection."""
+
+    def __init__(self, command, credits):
+        super().__init__(command)
+        self.credits = credits
+
+    def dict(self):
+        return {"command": self.command, "credits": self.credits}
+
+class Ack(Message):
+    """Message that acks every value received on the connection up to number seq.
+
+    Values are numbered from 1 in the order they are sent on a connection,
+    so one Ack covers all the ones processed since the last.
+    """
+
+    def __init__(self, command, seq):
+        super().__init__(command)
+        self.seq = seq
+
+    def dict(self):
+        return {"command": self.command, "seq": self.seq}
+
+class Stats(Message):
+    """Message that asks the broker for a snapshot of its metrics."""
+
+    def __init__(self, command):
+        super().__init__(command)
+
+    def dict(self):
+        return {"command": self.command}
+
+class StatsOK(Message):
+    """Reply to Stats: metric name -> value."""
+
+    def __init__(self, command, stats):
+        super().__init__(command)
+        self.stats = stats
+
+    def dict(self):
+        return {"command": self.command, "stats": self.stats}
+
 class Unsubscribe(Message):
     def __init__(self, command,  topic):
         super().__init__(command)
@@ -60,24 +201,101 @@ class Unsubscribe(Message):
     def dict(self):
         return {"command": self.command, "topic": self.topic}
 
+# comandos e respetivos campos, pela ordem em que vão no formato binário
+BINARY_COMMANDS = [
+    "subscribe", "publish", "publishBatch", "listTopics", "unsubscribe", "hello", "stats",
+    "credit", "ack",
+]
+BINARY_FIELDS = {
+    "subscribe": ("topic",),
+    "publish": ("topic", "message"),
+    "publishBatch": ("topic", "messages"),
+    "listTopics": ("topics",),
+    "unsubscribe": ("topic",),
+    "hello": ("features",),
+    "stats": ("stats",),
+    "credit": ("credits",),
+    "ack": ("seq",),
+}
+# campos opcionais do subscribe e respetivos tipos
+SUBSCRIBE_OPTIONS = {"offset": int, "last": int, "since": int, "credits": int, "policy": str,
+                     "group": str, "balance": str, "window": int, "session": str}
+# o que o broker faz a um valor quando os valores retidos de um consumidor sem créditos enchem
+DROP_OLDEST = "drop_oldest"  # descarta o valor retido mais antigo
+DROP_NEWEST = "drop_newest"  # descarta o novo valor
+CONFLATE = "conflate"  # retém só o último valor de cada tópico
+DISCONNECT = "disconnect"  # fecha a conexão do consumidor
+POLICIES = (DROP_OLDEST, DROP_NEWEST, CONFLATE, DISCONNECT)
+# como o broker escolhe o membro de um grupo que recebe cada valor
+ROUND_ROBIN = "round_robin"  # cada membro por sua vez
+LEAST_LOADED = "least_loaded"  # o que tem menos valores retidos e bytes por enviar
+BALANCES = (ROUND_ROBIN, LEAST_LOADED)
+
+
+def _topic(msg: dict) -> str:
+    """Returns the topic of a decoded message, which must be a str."""
+    topic = msg["topic"]
+    if not isinstance(topic, str):
+        raise TypeError(topic)
+    return topic
+
+
+class Frame:
+    """A frame kept as its header and payload, not joined.
+
+    The broker frames the payload of a publish it relays like this, so the
+    payload is never copied to put a header in front of it. len() is the
+    size of the whole frame and indexing reads the header, as on bytes.
+    """
+
+    __slots__ = ("header", "payload")
+
+    def __init__(self, header: bytes, payload: bytes):
+        self.header = header
+        self.payload = payload
+
+    def __len__(self) -> int:
+        return len(self.header) + len(self.payload)
+
+    def __getitem__(self, index: int) -> int:
+        return self.header[index]
+
+    def __bytes__(self) -> bytes:
+        return self.header + self.payload
+
+    def parts(self) -> List[bytes]:
+        """Returns the header and the payload, to be written one after the other."""
+        return [self.header, self.payload]
+
+
+def frame_parts_of(frame) -> List[bytes]:
+    """Returns the pieces frame (bytes or a Frame) is written as."""
+    return frame.parts() if type(frame) is Frame else [frame]
+
+
 class CDProto:
 
     @classmethod
-    def subscribe(self, topic) -> Subscribe:
+    def subscribe(self, topic, **options) -> Subscribe:
         """Creates a SubscribeMessage object."""
-        return Subscribe("subscribe", topic)
+        return Subscribe("subscribe", topic, **options)
 
     @classmethod
     def publish(self, topic, message) -> Publish:
         """Creates a PublishMessage object."""
         return Publish("publish",  topic, message)
 
+    @classmethod
+    def publishBatch(self, topic, messages) -> PublishBatch:
+        """Creates a PublishBatchMessage object."""
+        return PublishBatch("publishBatch", topic, messages)
+
     @classmethod
     def listTopics(self,  list=None) -> ListTopics:
         """Creates a ListTopicsMessage object."""
         if list:
             return ListTopicsOK("listTopics", list)
-        return ListTopics("listTopics", type)
+        return ListTopics("listTopics")
 
     @classmethod
     def unsubscribe(self,  topic) -> Unsubscribe:
@@ -85,68 +303,400 @@ class CDProto:
         return Unsubscribe("unsubscribe",  topic)
 
     @classmethod
-    def send_msg(self, connection: socket, command, serializer: int, topic="",  message=None):
+    def hello(self, features) -> Hello:
+        """Creates a HelloMessage object."""
+        return Hello("hello", features)
+
+    @classmethod
+    def credit(self, credits) -> Credit:
+        """Creates a CreditMessage object."""
+        return Credit("credit", credits)
+
+    @classmethod
+    def ack(self, seq) -> Ack:
+        """Creates an AckMessage object."""
+        return Ack("ack", seq)
+
+    @classmethod
+    def stats(self, stats=None) -> Stats:
+        """Creates a StatsMessage object (the reply when stats is given)."""
+        if stats is not None:
+            return StatsOK("stats", stats)
+        return Stats("stats")
+
+    @classmethod
+    def encode_msg(self, command, serializer: int, topic="", message=None, extended=False,
+                   compression: str = None) -> bytes:
+        """Encodes a message into a frame: serializer (1 byte) + size (2 bytes) + msg.
+
+        With extended, messages too big for 2 bytes of size get an extended frame;
+        with compression, messages of COMPRESS_MIN bytes or more are compressed.
+        """
+        payload = self.encode_payload(command, serializer, topic, message)
+        return self.encode_frame(serializer, payload, extended, compression)
+
+    @classmethod
+    def encode_payload(self, command, serializer: int, topic="", message=None) -> bytes:
+        """Encodes a message with the codec of serializer, without the frame header."""
         msg = ""
         if command == "subscribe":
-            msg = self.subscribe(topic)
+            msg = self.subscribe(topic, **(message or {}))
         elif command == "publish":
             msg = self.publish(topic, message)
+        elif command == "publishBatch":
+            msg = self.publishBatch(topic, message)
         elif command == "listTopics":
             msg = self.listTopics(message)
         elif command == "unsubscribe":
             msg = self.unsubscribe(topic)
-
-        if serializer == 0:
-            msg = json.dumps(msg.dict()).encode('utf-8')
-        elif serializer == 1:
-            msg = msg.dict()
-            for key in msg:
-                msg[key] = str(msg[key])
-            msg = ET.tostring(ET.Element("message", msg))
-        elif serializer == 2:
-            msg = pickle.dumps(msg.dict())
-        else:
+        elif command == "hello":
+            msg = self.hello(message)
+        elif command == "stats":
+            msg = self.stats(message)
+        elif command == "credit":
+            msg = self.credit(message)
+        elif command == "ack":
+            msg = self.ack(message)
+
+        codec = CODECS.get(serializer)
+        if codec is None:
             raise CDProtoBadFormat(msg)
+        try:
+            msg = codec.encode(msg)
+        except (TypeError, ValueError, pickle.PicklingError):
+            # valor que o serializer não suporta (ex.: bytes em JSON)
+            raise CDProtoBadFormat(msg)
+        return msg
+
+    @classmethod
+    def encode_frame(self, serializer: int, payload: bytes, extended=False,
+                     compression: str = None) -> bytes:
+        """Builds a frame: serializer (1 byte) + size (2 bytes) + payload.
+
+        Payloads of 64 KiB or more need extended: the EXTENDED flag is set in
+        the serializer byte and the size takes 4 bytes. With compression a
+        payload of COMPRESS_MIN bytes or more is compressed by that algorithm,
+        when that makes it smaller, and the COMPRESSED flag is set.
+        """
+        header, payload = self.frame_parts(serializer, payload, extended, compression)
+        return header + payload
 
+    @classmethod
+    def frame_parts(self, serializer: int, payload: bytes, extended=False,
+                    compression: str = None) -> Tuple[bytes, bytes]:
+        """Returns the header (serializer and size) and the payload of a frame, not joined."""
+        if compression is not None and len(payload) >= COMPRESS_MIN:
+            compressed = COMPRESSORS[compression][0](payload)
+            if len(compressed) < len(payload):
+                serializer |= COMPRESSED
+                payload = compressed
+        if extended and len(payload) >= 2**16:
+            serializer |= EXTENDED
+            width = 4
+        else:
+            width = 2
         try:
-            size = (len(msg)).to_bytes(2, byteorder="big")
+            size = (len(payload)).to_bytes(width, byteorder="big")
             header = serializer.to_bytes(1, byteorder="big")
-            connection.send(header + size + msg)
+        except OverflowError:
+            raise CDProtoBadFormat(payload)
+        return header + size, payload
+
+    @classmethod
+    def compress_frame(self, frame: bytes, compression: str = None) -> bytes:
+        """Returns frame (bytes or a Frame) with its payload compressed by compression (if worth it)."""
+        header = frame[0]
+        if compression is None or header & COMPRESSED:
+            return frame
+        if type(frame) is Frame:
+            payload = frame.payload
+        else:
+            payload = frame[5 if header & EXTENDED else 3 :]
+        return self.encode_frame(header & ~EXTENDED, payload, True, compression)
+
+    @classmethod
+    def encode_batch(self, serializer: int, topic, messages: list, extended=False,
+                     compression: str = None) -> List[bytes]:
+        """Encodes messages into as few publishBatch frames as fit the frame size."""
+        try:
+            return [self.encode_msg(
+                "publishBatch", serializer, topic, messages, extended, compression)]
+        except CDProtoBadFormat:
+            if len(messages) < 2:
+                raise
+        half = len(messages) // 2
+        return (self.encode_batch(serializer, topic, messages[:half], extended, compression)
+                + self.encode_batch(serializer, topic, messages[half:], extended, compression))
+
+    @classmethod
+    def send_msg(self, connection: socket, command, serializer: int, topic="",  message=None,
+                 extended=False, compression: str = None):
+        """Sends a message through a (blocking) connection.
+
+        The header and the payload of an extended frame go in one sendmsg,
+        without copying the payload to join them.
+        """
+        payload = self.encode_payload(command, serializer, topic, message)
+        header, payload = self.frame_parts(serializer, payload, extended, compression)
+        try:
+            if header[0] & EXTENDED:
+                # uma trama estendida raramente cabe num só send()
+                self.send_parts(connection, [header, payload])
+            else:
+                connection.send(header + payload)
         except:
-            raise CDProtoBadFormat(msg)
+            raise CDProtoBadFormat(payload)
+
+    @classmethod
+    def send_parts(self, connection: socket, parts: List[bytes]):
+        """Writes parts (frames or pieces of frames) through a (blocking) connection.
+
+        Where sockets have sendmsg the parts are gathered by the kernel
+        (scatter-gather), so they are never copied into one buffer.
+        """
+        if not hasattr(connection, "sendmsg"):
+            connection.sendall(b"".join(parts))
+            return
+        parts = list(parts)
+        first = 0
+        while first < len(parts):
+            sent = connection.sendmsg(parts[first:first + IOV_MAX])
+            # o que o kernel não aceitou segue no próximo sendmsg
+            while first < len(parts) and sent >= len(parts[first]):
+                sent -= len(parts[first])
+                first += 1
+            if sent:
+                parts[first] = memoryview(parts[first])[sent:]
+
+    @classmethod
+    def message(self, msg: dict) -> Message:
+        """Creates the Message object described by a decoded dict."""
+        try:
+            command = msg["command"]
+            if command == "subscribe":
+                options = {option: kind(msg[option])
+                           for option, kind in SUBSCRIBE_OPTIONS.items() if option in msg}
+                if options.get("policy", DROP_NEWEST) not in POLICIES:
+                    raise ValueError(options["policy"])
+                if options.get("balance", ROUND_ROBIN) not in BALANCES:
+                    raise ValueError(options["balance"])
+                topic = _topic(msg)
+                pattern_segments(topic)
+                return self.subscribe(topic, **options)
+            elif command == "publish":
+                return self.publish(_topic(msg), msg["message"])
+            elif command == "publishBatch":
+                if not isinstance(msg["messages"], list):
+                    raise TypeError(msg["messages"])
+                return self.publishBatch(_topic(msg), msg["messages"])
+            elif command == "listTopics":
+                return self.listTopics(msg.get("topics"))
+            elif command == "unsubscribe":
+                return self.unsubscribe(_topic(msg))
+            elif command == "hello":
+                return self.hello(msg["features"])
+            elif command == "stats":
+                return self.stats(msg.get("stats"))
+            elif command == "credit":
+                return self.credit(int(msg["credits"]))
+            elif command == "ack":
+                return self.ack(int(msg["seq"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+        raise CDProtoBadFormat(msg)
 
     @classmethod
-    def recv_msg(self, connection: socket) -> Message:
-        """Receives through a connection a Message object."""
+    def decode_msg(self, payload: bytes, serializer: int) -> Message:
+        """Decodes the payload of a frame with the codec named in its header."""
+        codec = CODECS.get(serializer)
+        if codec is None or not payload:
+            raise CDProtoBadFormat(payload)
+        try:
+            return codec.decode(payload)
+        except CDProtoBadFormat:
+            raise
+        except Exception:
+            raise CDProtoBadFormat(payload)
 
-        size = connection.recv(2)
+    @classmethod
+    def recv_msg(self, connection: socket, serializer: int) -> Message:
+        """Receives through a connection a Message object.
+
+        serializer is the header byte already read; with the EXTENDED flag
+        the size that follows takes 4 bytes.
+        """
+        width = 4 if serializer & EXTENDED else 2
+        size = self.recv_exact(connection, width)
         size = int.from_bytes(size, byteorder="big")
 
         if size == 0:
             return
-        elif size >= 2**16:
-            raise CDProtoBadFormat(size)
 
-        size = connection.recv(size)
+        return self.decode_msg(self.recv_exact(connection, size), serializer & ~EXTENDED)
 
-        try:
-            msg = json.loads(size.decode('utf-8'))
-        except:
-            try:
-                msg = pickle.loads(size)
-            except:
-                msg = (ET.fromstring(size.decode("utf-8"))).attrib
-
-        if msg["command"] == "subscribe":
-            return self.subscribe(msg["topic"]).dict()
-        elif msg["command"] == "publish":
-            return self.publish(msg["topic"], msg["message"]).dict()
-        elif msg["command"] == "listTopics":
-            if msg["topics"]:
-                return self.listTopics(msg["topics"]).dict()
-            return self.listTopics().dict()
-        elif msg["command"] == "unsubscribe":
-            return self.unsubscribe(msg["topic"]).dict()
+    @classmethod
+    def recv_exact(self, connection: socket, size: int) -> bytes:
+        """Receives size bytes, or fewer if the connection is closed first."""
+        data = connection.recv(size)
+        if len(data) == size or not data:
+            return data
+
+        buffer = bytearray(size)
+        with memoryview(buffer) as view:
+            view[:len(data)] = data
+            received = len(data)
+            while received < size:
+                count = connection.recv_into(view[received:])
+                if count == 0:
+                    return bytes(view[:received])
+                received += count
+        return bytes(buffer)
+
+
+class Codec:
+    """Converts messages of one serializer to bytes and back."""
+
+    def encode(self, msg: Message) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, payload: bytes) -> Message:
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+
+    def encode(self, msg: Message) -> bytes:
+        return json.dumps(msg.dict()).encode('utf-8')
+
+    def decode(self, payload: bytes) -> Message:
+        return CDProto.message(json.loads(payload))
+
+
+class XMLCodec(Codec):
+    """XML codec: every value goes as a string; lists as <key><item>...</item></key>
+    and dicts as <key><item key="...">...</item></key>."""
+
+    def encode(self, msg: Message) -> bytes:
+        element = ET.Element("message")
+        for key, value in msg.dict().items():
+            if isinstance(value, list):
+                items = ET.SubElement(element, key)
+                for item in value:
+                    ET.SubElement(items, "item").text = str(item)
+            elif isinstance(value, dict):
+                items = ET.SubElement(element, key)
+                for name, item in value.items():
+                    ET.SubElement(items, "item", key=str(name)).text = str(item)
+            else:
+                element.set(key, str(value))
+        return ET.tostring(element)
+
+    def decode(self, payload: bytes) -> Message:
+        element = ET.fromstring(payload)
+        msg = element.attrib
+        for items in element:
+            if len(items) and "key" in items[0].attrib:
+                msg[items.tag] = {item.get("key"): item.text or "" for item in items}
+            else:
+                msg[items.tag] = [item.text or "" for item in items]
+        return CDProto.message(msg)
+
+
+class PickleCodec(Codec):
+
+    def encode(self, msg: Message) -> bytes:
+        return pickle.dumps(msg.dict())
+
+    def decode(self, payload: bytes) -> Message:
+        return CDProto.message(pickle.loads(payload))
+
+
+class BinaryCodec(Codec):
+    """Binary codec: command code (1 byte) + fields in BINARY_FIELDS order + extra fields."""
+
+    def encode(self, msg: Message) -> bytes:
+        msg = msg.dict()
+        command = msg.pop("command")
+        fields = [msg.pop(field) for field in BINARY_FIELDS[command] if field in msg]
+        if msg:
+            fields.append(msg)
+        return bytes((BINARY_COMMANDS.index(command),)) + binary.pack(*fields)
+
+    def decode(self, payload: bytes) -> Message:
+        command = BINARY_COMMANDS[payload[0]]
+        fields = binary.unpack(payload, 1)
+
+        names = BINARY_FIELDS[command]
+        msg = dict(zip(names, fields))
+        if len(fields) > len(names):
+            msg.update(fields[-1])
+        msg["command"] = command
+        return CDProto.message(msg)
+
+
+# serializer (byte do cabeçalho) -> codec
+CODECS = {0: JSONCodec(), 1: XMLCodec(), 2: PickleCodec(), 3: BinaryCodec()}
+
+
+class FrameDecoder:
+    """Incremental decoder of frames received in chunks of any size."""
+
+    def __init__(self, max_size: int = MAX_PAYLOAD, extended: bool = True):
+        self._buffer = bytearray()
+        self.decompress = None  # decompress of the algorithm negotiated for the connection
+        self.max_size = max_size  # largest payload a frame may carry, once decompressed
+        self.extended = extended  # extended frames are accepted (frame32 was negotiated)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data: bytes):
+        """Appends received bytes to the buffer."""
+        self._buffer += data
+
+    def frames(self) -> List[Tuple[int, bytes]]:
+        """Removes and returns (serializer, payload) of every complete frame.
+
+        An incomplete header or payload stays buffered until more data is fed.
+        The EXTENDED flag is removed from the serializer returned. Compressed
+        frames are decompressed with decompress, up to max_size bytes; without
+        it (or if it fails) the COMPRESSED flag is left in the serializer,
+        which no codec accepts. Raises CDProtoBadFormat, before buffering its
+        payload, on an extended frame when extended is off or on a frame that
+        declares more than max_size bytes.
+        """
+        buffer = self._buffer
+        frames = []
+        start = 0
+        with memoryview(buffer) as view:
+            while len(buffer) - start >= 3:
+                header = buffer[start]
+                if header & EXTENDED:
+                    if not self.extended:
+                        raise CDProtoBadFormat(bytes(view[start : start + 5]))
+                    if len(buffer) - start < 5:
+                        break
+                    begin = start + 5
+                    header &= ~EXTENDED
+                else:
+                    begin = start + 3
+                size = int.from_bytes(view[start + 1 : begin], "big")
+                if size > self.max_size:
+                    raise CDProtoBadFormat(bytes(view[start:begin]))
+                end = begin + size
+                if end > len(buffer):
+                    break
+                payload = bytes(view[begin:end])
+                if header & COMPRESSED and self.decompress is not None:
+                    try:
+                        payload = self.decompress(payload, self.max_size)
+                        header &= ~COMPRESSED
+                    except Exception:
+                        pass
+                frames.append((header, payload))
+                start = end
+        del buffer[:start]
+        return frames
 
 
 class CDProtoBadFormat(Exception):
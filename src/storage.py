@@ -0,0 +1,235 @@
+"""Durable append-only log of the values published to each topic."""
+import bisect
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from .protocol import EXTENDED, frame_parts_of
+
+_ENTRY = struct.Struct(">II")  # offset relativo ao segmento, posição no segmento
+
+
+def _frame_end(data, position: int) -> int:
+    """Returns where the frame starting at position ends, or -1 if it is incomplete."""
+    if len(data) - position < 3:
+        return -1
+    begin = position + (5 if data[position] & EXTENDED else 3)
+    if begin > len(data):
+        return -1
+    end = begin + int.from_bytes(data[position + 1 : begin], "big")
+    return end if end <= len(data) else -1
+
+
+class _Segment:
+    """One segment file of a topic and the offsets indexed in it."""
+
+    __slots__ = ("base", "path", "offsets", "positions", "size")
+
+    def __init__(self, directory: str, base: int):
+        self.base = base  # offset of the first frame in the segment
+        self.path = os.path.join(directory, f"{base:020d}")
+        self.offsets: List[int] = []  # offsets relative to base, every index_interval bytes
+        self.positions: List[int] = []
+        self.size = 0
+
+    def load_index(self):
+        """Reads the index file of the segment."""
+        try:
+            with open(self.path + ".idx", "rb") as index:
+                data = index.read()
+        except FileNotFoundError:
+            return
+        data = data[: len(data) - len(data) % _ENTRY.size]  # entrada incompleta no fim
+        for offset, position in _ENTRY.iter_unpack(data):
+            self.offsets.append(offset)
+            self.positions.append(position)
+
+    def seek(self, offset: int) -> Tuple[int, int]:
+        """Returns the closest indexed (offset, position) at or before offset."""
+        i = bisect.bisect_right(self.offsets, offset - self.base) - 1
+        if i < 0:
+            return self.base, 0
+        return self.base + self.offsets[i], self.positions[i]
+
+
+class _Topic:
+    """Segments of one topic; appends go to the last one."""
+
+    __slots__ = ("directory", "segments", "file", "index", "end", "last", "indexed")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments: List[_Segment] = []
+        self.file = None  # last segment, while open
+        self.index = None  # its index file
+        self.end = 0  # offset of the next frame
+        self.last = -1  # position of the last frame in the open segment
+        self.indexed = 0  # position of the last indexed frame in the open segment
+
+
+class TopicLog:
+    """Append-only log with the publish frames of every topic, kept in a directory.
+
+    Each topic has a directory of segment files named by the offset of their
+    first frame; frames are stored as sent on the wire. Every index_interval
+    bytes the offset and position of a frame go to the index file of the
+    segment, so opening the log reads the indexes and only the tail of the
+    last segment, and a replay from an offset starts at the closest indexed
+    frame. Reads use mmap.
+
+    Only the last segment (and its index) of the max_open topics appended
+    to most recently are kept open, so the log holds at most 2 * max_open
+    file descriptors however many topics it has.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 2**26, index_interval: int = 2**12,
+                 max_open: int = 128):
+        """Open the log in directory, creating it if needed."""
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.max_open = max_open
+        self._topics = {}  # topic -> _Topic
+        self._open_topics: "OrderedDict[str, _Topic]" = OrderedDict()  # topics with files open, LRU first
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                self._topics[unquote(name)] = self._load(path)
+
+    def _load(self, directory: str) -> _Topic:
+        topic = _Topic(directory)
+        bases = sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+        for base in bases:
+            segment = _Segment(directory, base)
+            segment.load_index()
+            segment.size = os.path.getsize(segment.path)
+            topic.segments.append(segment)
+        if not topic.segments:
+            topic.segments.append(_Segment(directory, 0))
+
+        # só a cauda do último segmento, depois da última entrada do índice, é lida
+        segment = topic.segments[-1]
+        offset, position = segment.seek(2**63)
+        with open(segment.path, "a+b") as file:
+            file.seek(position)
+            data = file.read()
+            last = -1
+            start = 0
+            while (end := _frame_end(data, start)) >= 0:
+                last, start = start, end
+                offset += 1
+            if start < len(data):  # trama incompleta de uma escrita interrompida
+                file.truncate(position + start)
+        segment.size = position + start
+        topic.end = offset
+        topic.last = position + last if last >= 0 else -1
+        topic.indexed = segment.positions[-1] if segment.positions else 0
+        return topic
+
+    def _open(self, name: str, topic: _Topic):
+        """Opens the last segment of topic for appends, closing the least recently used one."""
+        if topic.file is not None:
+            self._open_topics.move_to_end(name)
+            return
+        while len(self._open_topics) >= self.max_open:
+            self._close(self._open_topics.popitem(last=False)[1])
+        segment = topic.segments[-1]
+        topic.file = open(segment.path, "ab", buffering=0)
+        try:
+            topic.index = open(segment.path + ".idx", "ab", buffering=0)
+        except OSError:
+            topic.file.close()
+            topic.file = None
+            raise
+        self._open_topics[name] = topic
+
+    @staticmethod
+    def _close(topic: _Topic):
+        if topic.file is not None:
+            topic.file.close()
+            topic.index.close()
+            topic.file = topic.index = None
+
+    def topics(self) -> List[str]:
+        """Returns the topics with frames in the log."""
+        return [name for name, topic in self._topics.items() if topic.end]
+
+    def end(self, topic: str) -> int:
+        """Returns the offset the next frame appended to topic will get."""
+        log = self._topics.get(topic)
+        return log.end if log else 0
+
+    def append(self, topic: str, frame: bytes) -> int:
+        """Appends a frame (bytes or a Frame) to the log of topic and returns its offset."""
+        log = self._topics.get(topic)
+        if log is None:
+            directory = os.path.join(self.directory, quote(topic, safe=""))
+            os.makedirs(directory, exist_ok=True)
+            log = self._topics[topic] = self._load(directory)
+
+        segment = log.segments[-1]
+        if segment.size >= self.segment_bytes:
+            self._close(log)
+            segment = _Segment(log.directory, log.end)
+            log.segments.append(segment)
+            log.indexed = 0
+        self._open(topic, log)
+        if segment.size - log.indexed >= self.index_interval:
+            entry = _ENTRY.pack(log.end - segment.base, segment.size)
+            log.index.write(entry)
+            segment.offsets.append(log.end - segment.base)
+            segment.positions.append(segment.size)
+            log.indexed = segment.size
+
+        for part in frame_parts_of(frame):
+            log.file.write(part)
+        log.last = segment.size
+        segment.size += len(frame)
+        log.end += 1
+        return log.end - 1
+
+    def read(self, topic: str, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+        """Yields (serializer, payload) of every frame of topic from offset on."""
+        log = self._topics.get(topic)
+        if log is None or offset >= log.end:
+            return
+        offset = max(offset, 0)
+        i = bisect.bisect_right([segment.base for segment in log.segments], offset) - 1
+        for segment in log.segments[i:]:
+            if not segment.size:
+                continue
+            current, position = segment.seek(offset)
+            with open(segment.path, "rb") as file, \
+                    mmap.mmap(file.fileno(), segment.size, access=mmap.ACCESS_READ) as data:
+                while position < segment.size:
+                    end = _frame_end(data, position)
+                    if current >= offset:
+                        header = data[position]
+                        begin = position + (5 if header & EXTENDED else 3)
+                        yield header & ~EXTENDED, data[begin:end]
+                    current += 1
+                    position = end
+            offset = current
+
+    def last(self, topic: str) -> Optional[Tuple[int, bytes]]:
+        """Returns (serializer, payload) of the last frame of topic, or None."""
+        log = self._topics.get(topic)
+        if log is None or log.last < 0:
+            return None
+        with open(log.segments[-1].path, "rb") as file:
+            file.seek(log.last)
+            data = file.read(5)
+            begin = 5 if data[0] & EXTENDED else 3
+            size = int.from_bytes(data[1:begin], "big")
+            file.seek(log.last + begin)
+            return data[0] & ~EXTENDED, file.read(size)
+
+    def close(self):
+        """Close the files open for appends."""
+        while self._open_topics:
+            self._close(self._open_topics.popitem()[1])
@@ -0,0 +1,184 @@
+"""Hierarchical topic index used to route publishes to subscribers."""
+from typing import Dict, Iterator, List, Set, Tuple
+
+SINGLE = "+"  # wildcard of exactly one segment
+MULTI = "#"  # wildcard of every segment from here on (and of none)
+
+
+def split_topic(topic: str) -> Tuple[str, ...]:
+    """Split a topic into its "/"-separated path segments.
+
+    A trailing "/" is ignored, so "/weather/" and "/weather" name the same
+    node and "/" (or "") is the parent of every "/..." topic.
+    """
+    return tuple(topic.rstrip("/").split("/"))
+
+
+def pattern_segments(pattern: str) -> Tuple[str, ...]:
+    """Split pattern like split_topic, refusing a "#" that is not its last segment."""
+    segments = split_topic(pattern)
+    if MULTI in segments[:-1]:
+        raise ValueError("%r: \"#\" must be the last level of a pattern" % pattern)
+    return segments
+
+
+def is_pattern(topic: str) -> bool:
+    """Tells if topic has wildcard segments."""
+    return any(segment in (SINGLE, MULTI) for segment in split_topic(topic))
+
+
+def matches(pattern: str, topic: str) -> bool:
+    """Tells if topic is named by pattern itself (not just one of its subtopics)."""
+    segments = split_topic(topic)
+    expected = pattern_segments(pattern)
+    for i, part in enumerate(expected):
+        if part == MULTI:
+            return True
+        if i >= len(segments) or part not in (SINGLE, segments[i]):
+            return False
+    return len(segments) == len(expected)
+
+
+def covers(pattern: str, topic: str) -> bool:
+    """Tells if a subscription to pattern receives the publishes to topic."""
+    segments = split_topic(topic)
+    return any(matches(pattern, "/".join(segments[:depth])) for depth in range(1, len(segments) + 1))
+
+
+class _Node:
+    """One path segment of the topic tree."""
+
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.subscribers: Dict[object, object] = {}  # address -> Serializer
+
+
+class TopicTree:
+    """Trie of subscriptions keyed by topic path segments.
+
+    A subscription to a topic also receives every publish made to one of its
+    subtopics, so routing a publish only has to walk the ancestors of the
+    published topic instead of testing every subscribed topic.
+
+    A segment "+" matches any one segment and a last segment "#" any number
+    of them, so "/weather2/+/celsius" and "/weather2/#" are subscribable.
+    Matching follows at most one wildcard branch per segment and node, so
+    it costs time proportional to the depth of the topic, not to the
+    number of patterns.
+
+    Subscribers are (address, Serializer) tuples and an address holds at most
+    one subscription per topic. Every address also indexes the topics it is
+    subscribed to, so forgetting it costs only as much as those topics.
+    Topics are kept without a trailing "/", as split_topic reads them, so
+    "/weather/" and "/weather" are one subscription and "/" is "".
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._topics: Dict[str, _Node] = {}  # subscribed topic, without trailing "/" -> node
+        self._addresses: Dict[object, Set[str]] = {}  # address -> its subscribed topics
+
+    def __contains__(self, topic: str) -> bool:
+        return topic.rstrip("/") in self._topics
+
+    def __len__(self) -> int:
+        return len(self._topics)
+
+    def topics(self) -> List[str]:
+        """Returns the topics that currently have subscribers."""
+        return list(self._topics)
+
+    def get(self, topic: str) -> List[tuple]:
+        """Returns the subscribers of exactly <topic>."""
+        node = self._topics.get(topic.rstrip("/"))
+        if node is None:
+            return []
+        return list(node.subscribers.items())
+
+    def topics_of(self, address) -> List[str]:
+        """Returns the topics address is subscribed to."""
+        return list(self._addresses.get(address, ()))
+
+    def add(self, topic: str, subscriber: tuple):
+        """Adds a subscriber to topic, replacing the one address already had there.
+
+        Raises ValueError if topic has a "#" before its last level.
+        """
+        topic = topic.rstrip("/")
+        node = self._topics.get(topic)
+        if node is None:
+            node = self._root
+            for segment in pattern_segments(topic):
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _Node()
+                node = child
+            self._topics[topic] = node
+        address, _format = subscriber
+        node.subscribers[address] = _format
+        self._addresses.setdefault(address, set()).add(topic)
+
+    def remove(self, topic: str, address):
+        """Removes the subscription of address to topic, pruning branches left empty."""
+        topic = topic.rstrip("/")
+        node = self._topics.get(topic)
+        if node is None or address not in node.subscribers:
+            return
+        del node.subscribers[address]
+        topics = self._addresses[address]
+        topics.discard(topic)
+        if not topics:
+            del self._addresses[address]
+        if node.subscribers:
+            return
+
+        del self._topics[topic]
+        path = [self._root]
+        segments = split_topic(topic)
+        for segment in segments:
+            path.append(path[-1].children[segment])
+
+        # sobe na árvore a apagar os nós que ficaram sem uso
+        for segment, parent, child in zip(
+            reversed(segments), reversed(path[:-1]), reversed(path[1:])
+        ):
+            if child.subscribers or child.children:
+                break
+            del parent.children[segment]
+
+    def remove_address(self, address):
+        """Removes every subscription held by address."""
+        for topic in self.topics_of(address):
+            self.remove(topic, address)
+
+    def match(self, topic: str) -> Iterator[tuple]:
+        """Yields the subscribers of topic and of all its ancestors, wildcards included.
+
+        A subscriber of several patterns that match topic is yielded once per pattern.
+        """
+        nodes = [self._root]
+        for segment in split_topic(topic):
+            reached = []
+            for node in nodes:
+                multi = node.children.get(MULTI)
+                if multi is not None:
+                    yield from multi.subscribers.items()
+                child = node.children.get(segment)
+                if child is not None:
+                    reached.append(child)
+                single = node.children.get(SINGLE)
+                if single is not None and single is not child:
+                    reached.append(single)
+            if not reached:
+                return
+            nodes = reached
+            for node in nodes:
+                yield from node.subscribers.items()
+
+        # "/weather2/#" também abrange o próprio "/weather2"
+        for node in nodes:
+            multi = node.children.get(MULTI)
+            if multi is not None:
+                yield from multi.subscribers.items()
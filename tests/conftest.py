@@ -3,12 +3,15 @@ import time
 
 import pytest
 
+from src.aiobroker import AsyncBroker
 from src.broker import Broker
 
+ENGINES = {"selectors": Broker, "asyncio": AsyncBroker}
 
-@pytest.fixture(scope="session")
-def broker():
-    broker = Broker()
+
+@pytest.fixture(scope="session", params=list(ENGINES))
+def broker(request):
+    broker = ENGINES[request.param]()
 
     thread = threading.Thread(target=broker.run, daemon=True)
     thread.start()
@@ -2,6 +2,7 @@
 import json
 import pickle
 import random
+import socket
 import string
 import threading
 import time
@@ -10,7 +11,10 @@ from unittest.mock import MagicMock, patch
 import pytest
 
 from src.clients import Consumer, Producer
-from src.middleware import JSONQueue, PickleQueue, XMLQueue
+from src.middleware import (
+    BinaryQueue, Connection, JSONQueue, MiddlewareType, PickleQueue, XMLQueue,
+)
+from src.protocol import CDProto
 
 TOPIC = "".join(random.sample(string.ascii_lowercase, 6))
 
@@ -98,3 +102,124 @@ def test_broker(producer_JSON, broker):
     assert broker.list_topics() == [TOPIC]
 
     assert broker.get_topic(TOPIC) == producer_JSON.produced[-1]
+
+
+def test_push_many(broker):
+    topic = TOPIC + "/batch"
+    consumer_json = JSONQueue(topic)
+    consumer_xml = XMLQueue(topic)
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+    values = list(range(5000))  # não cabe numa só trama
+
+    sent = []
+    real_sendmsg = socket.socket.sendmsg
+
+    def sendmsg(sock, buffers):
+        sent.append(buffers)
+        return real_sendmsg(sock, buffers)
+
+    with patch("socket.socket.sendmsg", sendmsg):
+        producer.push_many(values)
+    assert len(sent) == 1  # as tramas vão juntas, sem serem copiadas para um só buffer
+
+    assert [consumer_json.pull()[1] for _ in values] == values
+    assert [int(consumer_xml.pull()[1]) for _ in values] == values
+    assert broker.get_topic(topic) == values[-1]
+
+
+def test_binary_interoperates(broker):
+    topic = TOPIC + "/binary"
+    consumer_binary = BinaryQueue(topic)
+    consumer_json = JSONQueue(topic)
+    values = [21, -3, 2**40, 21.5, "Ó mar salgado", None, True, [1, "a"], {"t": 20}]
+
+    for queue_type in [BinaryQueue, PickleQueue]:
+        producer = queue_type(topic, _type=MiddlewareType.PRODUCER)
+        for value in values:
+            producer.push(value)
+
+        assert [consumer_binary.pull()[1] for _ in values] == values
+        assert [consumer_json.pull()[1] for _ in values] == values
+
+
+def test_large_messages(broker):
+    topic = TOPIC + "/large"
+    consumer = PickleQueue(topic)
+    legacy = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    legacy.connect(("localhost", 5000))
+    CDProto.send_msg(legacy, "subscribe", 2, topic)  # sem hello: tramas de 2 bytes
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    value = bytes(range(256)) * 2**12  # 1 MiB
+    producer.push(value)
+    producer.push(1)
+
+    assert consumer.extended
+    assert consumer.pull() == (topic, value)
+    assert consumer.pull() == (topic, 1)
+    assert broker.get_topic(topic) == 1
+
+    # quem não negociou as tramas estendidas só recebe as mensagens que cabem
+    header = legacy.recv(1)
+    assert CDProto.recv_msg(legacy, header[0]).message == 1
+    legacy.close()
+
+
+def test_pull_prefetches_frames(broker):
+    topic = TOPIC + "/prefetch"
+    consumer = BinaryQueue(topic)
+    producer = BinaryQueue(topic, _type=MiddlewareType.PRODUCER)
+    values = list(range(2000))
+    producer.push_many(values)
+    sent = None
+    for _ in range(100):  # o consumidor fica atrasado: o broker já escreveu tudo para os sockets
+        if broker.metrics.messages_out == sent and not any(broker.backlog().values()):
+            break
+        sent = broker.metrics.messages_out
+        time.sleep(0.05)
+
+    reads = []
+    real_recv_into = socket.socket.recv_into
+
+    def recv_into(sock, buffer):
+        if sock is consumer.sock:  # os Consumers de TOPIC, noutras threads, também recebem estes
+            reads.append(buffer)
+        return real_recv_into(sock, buffer)
+
+    with patch("socket.socket.recv_into", recv_into):
+        assert [consumer.pull()[1] for _ in values] == values
+    assert len(reads) < len(values) / 100
+
+
+def test_shared_connection(broker):
+    topic = TOPIC + "/shared"
+    connections = len(broker.channels)
+    connection = Connection(JSONQueue.ser_type)
+    queue_a = JSONQueue(topic + "/a", connection=connection)
+    queue_b = JSONQueue(topic + "/b", connection=connection)
+    queue_all = JSONQueue(topic, connection=connection)
+    producer = Producer([topic + "/a", topic + "/b"], lambda: iter([1, 2]), JSONQueue)
+    time.sleep(0.1)
+
+    assert len(broker.channels) == connections + 2  # consumidores e produtor
+    assert len({queue.sock for queue in producer.queue}) == 1
+    assert len(broker.list_subscriptions(topic + "/a")) == 1
+    assert broker.list_subscriptions(topic + "/a")[0][0] is broker.list_subscriptions(topic)[0][0]
+
+    producer.run(2)
+    assert [queue_a.pull(), queue_a.pull()] == [(topic + "/a", 1)] * 2
+    assert [queue_b.pull(), queue_b.pull()] == [(topic + "/b", 2)] * 2
+    assert [queue_all.pull() for _ in range(4)] == [
+        (topic + "/a", 1), (topic + "/b", 2), (topic + "/a", 1), (topic + "/b", 2)
+    ]
+
+    queue_b.cancel()
+    producer.run(1)
+    assert queue_a.pull() == (topic + "/a", 1)
+    assert queue_all.pull() == (topic + "/a", 1)
+    time.sleep(0.1)
+    assert not queue_b.prefetched
+
+    with pytest.raises(ValueError):
+        PickleQueue(topic, connection=connection)
@@ -1,9 +1,16 @@
 """Test simple consumer/producer interaction."""
+import json
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ET
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from src.broker import Serializer
+from src.broker import Serializer, _Outbox
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue, XMLQueue
+from src.protocol import COMPRESSORS, CONFLATE, DISCONNECT, DROP_OLDEST, CDProto, Frame
 
 
 def test_subscriptions(broker):
@@ -38,3 +45,346 @@ def test_topics(broker):
     assert len(broker.list_topics()) >= 2  # t3, t4 and the topic from basic
     assert "/t3" in broker.list_topics()
     assert "/t4" in broker.list_topics()
+
+
+def test_slow_subscriber_backpressure(broker):
+    topic = "/backpressure"
+    payload = "x" * 4000
+    events = 1000
+
+    # subscritor lento: nunca lê e tem um buffer de receção mínimo
+    slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(("localhost", 5000))
+    CDProto.send_msg(slow, "subscribe", 0, topic)
+
+    fast = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    fast.connect(("localhost", 5000))
+    CDProto.send_msg(fast, "subscribe", 0, topic)
+    received = []
+
+    def recv_exact(size):
+        data = b""
+        while len(data) < size:
+            data += fast.recv(size - len(data))
+        return data
+
+    def pull():
+        for _ in range(events):
+            size = int.from_bytes(recv_exact(3)[1:], "big")
+            received.append(json.loads(recv_exact(size))["message"])
+
+    thread = threading.Thread(target=pull, daemon=True)
+    thread.start()
+    time.sleep(0.1)
+
+    max_outbox, broker.max_outbox = broker.max_outbox, 2**17
+    try:
+        producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+        for _ in range(events):
+            producer.push(payload)
+            time.sleep(0.0005)
+            assert all(size <= broker.max_outbox for size in broker.backlog().values())
+
+        thread.join(timeout=5)
+        assert received == [payload] * events
+    finally:
+        broker.max_outbox = max_outbox
+
+    # o que chegou ao subscritor lento são tramas inteiras
+    slow.settimeout(0.5)
+    data = b""
+    try:
+        while chunk := slow.recv(2**16):
+            data += chunk
+    except socket.timeout:
+        pass
+    frames = 0
+    while data:
+        size = int.from_bytes(data[1:3], "big")
+        assert data[0] == 0 and len(data) >= 3 + size
+        assert json.loads(data[3 : 3 + size]) == {
+            "command": "publish", "topic": topic, "message": payload
+        }
+        data = data[3 + size :]
+        frames += 1
+    assert 0 < frames < events
+    slow.close()
+    fast.close()
+
+
+@pytest.mark.parametrize("msg", [
+    {"command": "publishBatch", "topic": "/malformed", "messages": 5},
+    {"command": "publish", "topic": 5, "message": 1},
+])
+def test_malformed_frame_closes_connection(broker, msg):
+    payload = json.dumps(msg).encode()
+    rogue = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    rogue.connect(("localhost", 5000))
+    rogue.settimeout(5)
+    rogue.send(bytes([0]) + len(payload).to_bytes(2, "big") + payload)
+    assert rogue.recv(1) == b""  # o broker fecha a ligação
+    rogue.close()
+
+    consumer = JSONQueue("/malformed")  # e continua a servir as outras
+    producer = JSONQueue("/malformed", _type=MiddlewareType.PRODUCER)
+    producer.push(1)
+    assert consumer.pull() == ("/malformed", 1)
+
+
+def test_fanout_encodes_once_per_format(broker):
+    topic = "/fanout"
+    consumers = [JSONQueue(topic) for _ in range(5)] + [XMLQueue(topic) for _ in range(5)]
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    with patch("json.dumps", MagicMock(side_effect=json.dumps)) as json_dump:
+        with patch("xml.etree.ElementTree.tostring", MagicMock(side_effect=ET.tostring)) as xml_dump:
+            producer.push(42)
+            received = [consumer.pull() for consumer in consumers]
+
+            assert json_dump.call_count == 1
+            assert xml_dump.call_count == 1
+
+    assert received == [(topic, 42)] * 5 + [(topic, "42")] * 5
+
+    # o último valor guardado é reenviado com a trama já codificada
+    with patch("json.dumps", MagicMock(side_effect=json.dumps)) as json_dump:
+        late = JSONQueue(topic)
+        assert late.pull() == (topic, 42)
+        assert json_dump.call_count == 3  # apenas o hello (pedido e resposta) e o subscribe
+
+
+def test_value_not_encodable_for_subscriber(broker):
+    topic = "/unencodable"
+    consumer_json = JSONQueue(topic)
+    consumer_pickle = PickleQueue(topic)
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    producer.push(b"\x00\x01")  # bytes não existem em JSON
+    producer.push(2)
+
+    assert consumer_pickle.pull() == (topic, b"\x00\x01")
+    assert consumer_pickle.pull() == (topic, 2)
+    assert consumer_json.pull() == (topic, 2)
+
+
+def test_disconnect_removes_only_its_subscriptions(broker):
+    leaving = MagicMock()
+    staying = MagicMock()
+    for topic in ("/churn", "/churn/a", "/churn/b"):
+        broker.subscribe(topic, leaving, Serializer.JSON)
+    broker.subscribe("/churn", staying, Serializer.PICKLE)
+
+    broker.unsubscribe_all(leaving)
+
+    assert broker.list_subscriptions("/churn") == [(staying, Serializer.PICKLE)]
+    assert broker.list_subscriptions("/churn/a") is None
+    assert broker.subscriptions.topics_of(leaving) == []
+    broker.unsubscribe("/churn", staying)
+    assert broker.subscriptions.topics_of(staying) == []
+
+
+def test_disconnect_with_empty_topic_subscribed(broker):
+    empty = MagicMock()
+    leaving = MagicMock()
+    broker.subscribe("", empty, Serializer.JSON)
+    broker.subscribe("/churn/empty", leaving, Serializer.JSON)
+
+    broker.unsubscribe_all(leaving)  # "" é um tópico como outro qualquer
+    assert broker.list_subscriptions("/churn/empty") is None
+    assert broker.list_subscriptions("") == [(empty, Serializer.JSON)]
+    broker.unsubscribe("", empty)
+    assert broker.subscriptions.topics_of(empty) == []
+
+
+def test_cancel_keeps_other_queue_of_connection(broker):
+    topic = "/shared/cancel"
+    first = PickleQueue(topic)
+    second = PickleQueue(topic, connection=first.connection)
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    first.cancel()
+    producer.push(1)
+    assert second.pull() == (topic, 1)
+
+
+def test_compression_once_per_format(broker):
+    topic = "/compressed"
+    value = {"quote": "Tudo vale a pena se a alma não é pequena. " * 50}
+    compress, decompress = COMPRESSORS["zlib"]
+    counted = MagicMock(side_effect=compress)
+    with patch.dict(COMPRESSORS, zlib=(counted, decompress)):
+        consumers = [JSONQueue(topic, compression="zlib") for _ in range(3)]
+        plain = JSONQueue(topic)
+        producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+        time.sleep(0.1)
+        assert consumers[0].connection.compression == "zlib"
+        assert plain.connection.compression is None
+
+        producer.push(value)
+        for consumer in consumers + [plain]:
+            assert consumer.pull() == (topic, value)
+        assert counted.call_count == 1  # comprimido uma vez para os três subscritores
+
+        compressing = PickleQueue(topic, _type=MiddlewareType.PRODUCER, compression="zlib")
+        compressing.push(value)
+        for consumer in consumers + [plain]:
+            assert consumer.pull() == (topic, value)
+
+
+def test_max_payload_once_decompressed(broker):
+    topic = "/compressed/bomb"
+    max_payload, broker.max_payload = broker.max_payload, 2**16
+    bomber = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        bomber.connect(("localhost", 5000))
+        bomber.settimeout(5)
+        CDProto.send_msg(bomber, "hello", 0, message=["zlib"])
+        size = int.from_bytes(bomber.recv(3)[1:], "big")
+        assert "zlib" in json.loads(bomber.recv(size))["features"]
+
+        CDProto.send_msg(bomber, "publish", 0, topic, " " * 2**17, compression="zlib")
+        assert bomber.recv(1) == b""  # descomprimida passava max_payload: a conexão é fechada
+        assert broker.get_topic(topic) is None
+    finally:
+        broker.max_payload = max_payload
+        bomber.close()
+
+
+def test_extended_frame_without_frame32(broker):
+    topic = "/extended/refused"
+    frame = CDProto.encode_msg("publish", 2, topic, "x" * 2**17, extended=True)
+    rogue = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    rogue.connect(("localhost", 5000))
+    rogue.settimeout(5)
+    rogue.send(frame[:5])  # sem hello: tamanho de 4 bytes não negociado
+    assert rogue.recv(1) == b""
+    rogue.close()
+    assert broker.get_topic(topic) is None
+
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)  # negociou frame32
+    consumer = PickleQueue(topic)
+    producer.push("x" * 2**17)
+    assert consumer.pull() == (topic, "x" * 2**17)
+
+
+def test_credits_keep_order(broker):
+    topic = "/credits/order"
+    consumer = JSONQueue(topic, credits=4)
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    for value in range(50):
+        producer.push(value)
+    assert [consumer.pull() for _ in range(50)] == [(topic, value) for value in range(50)]
+
+
+def test_credits_with_full_outbox(broker):
+    topic = "/credits/outbox"
+    values = [f"{i:03}" + "x" * 60000 for i in range(150)]
+    dropped = broker.metrics.dropped
+
+    # consumidor com créditos que não lê: a outbox enche antes de os gastar
+    slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(("localhost", 5000))
+    CDProto.send_msg(slow, "subscribe", 0, topic, {"credits": 100})
+    time.sleep(0.1)
+
+    max_outbox, broker.max_outbox = broker.max_outbox, 2**16
+    try:
+        producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+        for value in values:
+            producer.push(value)
+        time.sleep(0.2)
+
+        def recv_exact(size):
+            data = b""
+            while len(data) < size:
+                data += slow.recv(size - len(data))
+            return data
+
+        slow.settimeout(5)
+        received = []
+        for _ in values:
+            size = int.from_bytes(recv_exact(3)[1:], "big")
+            received.append(json.loads(recv_exact(size))["message"])
+            CDProto.send_msg(slow, "credit", 0, message=1)
+        assert received == values  # retidas em vez de descartadas: nenhum crédito se perde
+        assert broker.metrics.dropped == dropped
+    finally:
+        broker.max_outbox = max_outbox
+        slow.close()
+
+
+@pytest.mark.parametrize("policy, expected", [
+    (CONFLATE, [1, 10]),
+    (DROP_OLDEST, [1, 8, 9, 10]),
+    (DISCONNECT, [1, None]),
+])
+def test_slow_consumer_policies(broker, policy, expected):
+    topic = f"/credits/{policy}"
+    overflows = broker.metrics.overflows
+    max_held, broker.max_held = broker.max_held, 3
+    try:
+        consumer = JSONQueue(topic, credits=1, policy=policy)
+        producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+        time.sleep(0.1)
+
+        for value in range(1, 11):
+            producer.push(value)
+        time.sleep(0.2)  # tudo chega ao broker antes de haver créditos
+        received = []
+        for _ in expected:
+            msg = consumer.pull()
+            received.append(msg and msg[1])
+        assert received == expected
+        if policy != CONFLATE:
+            assert broker.metrics.overflows > overflows
+    finally:
+        broker.max_held = max_held
+
+
+def test_outbox_shares_frames():
+    frames = [bytes([i]) * 100 for i in range(3)]
+    outbox = _Outbox()
+    for frame in frames:
+        outbox.append(frame)
+    assert len(outbox) == 300
+    assert all(queued is frame for queued, frame in zip(outbox.frames, frames))  # sem cópias
+
+    conn = MagicMock()
+    conn.sendmsg.side_effect = [150, 150]
+    assert outbox.write(conn) == 150
+    assert len(outbox) == 150
+    assert bytes(outbox.frames[0]) == frames[1][50:]
+    assert outbox.frames[0].obj is frames[1]
+    outbox.write(conn)
+    assert not outbox and not outbox.frames
+
+    # uma Frame entra como cabeçalho e payload, sem os juntar
+    payload = bytes(1000)
+    outbox.append(Frame(b"\x02\x03\xe8", payload))
+    assert len(outbox) == 1003
+    assert outbox.frames[1] is payload
+    conn.sendmsg.side_effect = [503]
+    outbox.write(conn)
+    assert outbox.frames[0].obj is payload and len(outbox) == 500
+
+
+def test_relayed_payload_not_copied(broker):
+    topic = "/relayed"
+    value = "x" * 2**17
+    consumers = [PickleQueue(topic), JSONQueue(topic)]
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    producer.push(value)
+    assert [consumer.pull() for consumer in consumers] == [(topic, value)] * 2
+    frame = broker.frames[topic][Serializer.PICKLE]
+    assert type(frame) is Frame  # o payload recebido, com o cabeçalho à parte
+    assert len(frame.payload) == int.from_bytes(frame.header[1:5], "big")
+    assert PickleQueue(topic).pull() == (topic, value)  # e o último valor segue igual
@@ -0,0 +1,113 @@
+"""Test the multi-process broker."""
+import pickle
+import socket
+import time
+
+import pytest
+
+from src.cluster import Cluster, WorkerBroker
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+from src.protocol import CDProto, FrameDecoder
+
+PORT = 5100
+TOPICS = [f"/cluster{i}/value" for i in range(8)]
+
+
+@pytest.fixture(scope="module")
+def cluster():
+    cluster = Cluster(workers=3, port=PORT)
+    cluster.start()
+    yield cluster
+    cluster.stop()
+
+
+def _list_topics(queue):
+    CDProto.send_msg(queue.sock, "listTopics", queue.ser_type)
+    return queue.receive().topics
+
+
+def test_publish_across_workers(cluster):
+    # com várias ligações por tópico os clientes ficam em workers diferentes
+    consumers = {topic: [JSONQueue(topic, port=PORT) for _ in range(3)] for topic in TOPICS}
+    root = PickleQueue("/", port=PORT)
+    time.sleep(0.2)
+
+    producers = [
+        JSONQueue(topic, _type=MiddlewareType.PRODUCER, port=PORT) for topic in TOPICS
+    ]
+    for i, producer in enumerate(producers):
+        producer.push(i)
+
+    for i, topic in enumerate(TOPICS):
+        for consumer in consumers[topic]:
+            assert consumer.pull() == (topic, i)
+    assert sorted(root.pull() for _ in TOPICS) == [(t, i) for i, t in enumerate(TOPICS)]
+
+
+def test_retained_and_topics_are_global(cluster):
+    producer = JSONQueue(TOPICS[0], _type=MiddlewareType.PRODUCER, port=PORT)
+    producer.push("last")
+    time.sleep(0.2)
+
+    for _ in range(6):
+        late = JSONQueue(TOPICS[0], port=PORT)
+        assert late.pull() == (TOPICS[0], "last")
+        assert sorted(_list_topics(late)) == sorted(TOPICS)
+
+
+def test_groups_are_refused(cluster):
+    topic = TOPICS[1]
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER, port=PORT)
+    producer.push("kept")
+    time.sleep(0.2)
+
+    for _ in range(6):  # os membros ficam em workers diferentes
+        member = JSONQueue(topic, port=PORT, group="g")
+        assert member.pull() is None  # o worker fecha a ligação
+    late = JSONQueue(topic, port=PORT)
+    assert late.pull() == (topic, "kept")
+
+
+def test_replay_only_to_new_subscribers(cluster):
+    topic = "/cluster-replay/value"
+    roots = [PickleQueue("/", port=PORT) for _ in range(6)]  # em todos os workers
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER, port=PORT)
+    time.sleep(0.2)
+    producer.push("once")
+    assert [root.pull() for root in roots] == [(topic, "once")] * len(roots)
+
+    for _ in range(6):  # primeiros subscritores de topic noutros workers: o dono reenvia-o
+        late = JSONQueue(topic, port=PORT)
+        assert late.pull() == (topic, "once")
+    time.sleep(0.2)
+    producer.push("next")
+    assert [root.pull() for root in roots] == [(topic, "next")] * len(roots)  # sem repetições
+
+
+def test_links_never_drop():
+    link, peer = socket.socketpair()
+    broker = WorkerBroker(0, {1: link}, port=PORT + 1, max_outbox=2**10)
+    try:
+        for i in range(2000):  # o outro worker não lê: a outbox passa muito max_outbox
+            broker.forward(1, op="topic", topic=f"/links/{i}")
+        assert broker.metrics.dropped == 0
+        assert broker.backlog()[link] > broker.max_outbox
+
+        decoder = FrameDecoder()
+        received = []
+        peer.setblocking(False)
+        for _ in range(10000):
+            if len(received) == 2000:
+                break
+            broker.write(link, None)
+            try:
+                decoder.feed(peer.recv(2**16))
+            except BlockingIOError:
+                pass
+            received += [pickle.loads(payload)["topic"] for _, payload in decoder.frames()]
+        assert received == [f"/links/{i}" for i in range(2000)]
+    finally:
+        broker.sel.close()
+        broker.sock.close()
+        link.close()
+        peer.close()
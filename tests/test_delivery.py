@@ -0,0 +1,193 @@
+"""Test acknowledged delivery."""
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from src.acks import Window
+from src.middleware import JSONQueue, MiddlewareType
+from src.protocol import CDProto
+
+
+def test_window_acks_cumulatively():
+    window = Window(3, timeout=1.0)
+    for value in (b"a", b"b", b"c"):
+        window.add(value, now=0.0)
+    assert window.full()
+
+    assert window.ack(2) == 2
+    assert not window.full()
+    assert window.ack(2) == 0
+    assert [frame for _, frame in window.frames.values()] == [b"c"]
+
+
+def test_window_expires_and_resumes():
+    window = Window(10, timeout=1.0, session="s")
+    window.add(b"a", now=0.0)
+    window.add(b"b", now=0.5)
+    assert window.expired(now=1.2) == [b"a"]
+    assert window.add(b"a", now=1.2) == 3  # volta a ser enviado com um número novo
+
+    assert window.resume() == [b"b", b"a"]
+    assert len(window) == 0
+    assert window.add(b"b", now=2.0) == 1
+
+
+def test_acked_values_in_order(broker):
+    topic = "/acks/order"
+    consumer = JSONQueue(topic, window=4)
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    acked = broker.metrics.acked
+    for value in range(50):
+        producer.push(value)
+    assert [consumer.pull() for _ in range(50)] == [(topic, value) for value in range(50)]
+    consumer.ack()
+    time.sleep(0.1)
+    assert broker.metrics.acked - acked == 50
+
+
+def test_session_resumes_unacked(broker):
+    topic = "/acks/session"
+    crashing = JSONQueue(topic, window=10, session="acks-session")
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    for value in range(5):
+        producer.push(value)
+    for _ in range(3):
+        crashing.pull()
+    crashing.ack()  # processou 0, 1 e 2
+    crashing.connection.close()  # e falhou antes dos restantes
+    for _ in range(50):
+        if "acks-session" in broker.sessions:
+            break
+        time.sleep(0.05)
+
+    resumed = JSONQueue(topic, window=10, session="acks-session")
+    assert [resumed.pull(), resumed.pull()] == [(topic, 3), (topic, 4)]
+
+
+def test_redelivered_after_timeout(broker):
+    topic = "/acks/timeout"
+    ack_timeout, broker.ack_timeout = broker.ack_timeout, 0.2
+    broker.next_tick = 0  # senão só voltava a ver as janelas daqui a ack_timeout / 10 antigo
+    try:
+        consumer = JSONQueue(topic, window=10)
+        producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+        time.sleep(0.1)
+
+        redelivered = broker.metrics.redelivered
+        producer.push("once")
+        assert consumer.pull() == (topic, "once")
+        time.sleep(0.5)  # não confirmou a tempo
+        assert consumer.pull() == (topic, "once")
+        assert broker.metrics.redelivered > redelivered
+    finally:
+        broker.ack_timeout = ack_timeout
+
+
+def test_window_with_full_outbox(broker):
+    topic = "/acks/outbox"
+    values = [f"{i:03}" + "x" * 60000 for i in range(150)]
+    redelivered = broker.metrics.redelivered
+
+    # consumidor que não lê: a outbox enche antes de a janela
+    slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(("localhost", 5000))
+    CDProto.send_msg(slow, "subscribe", 0, topic, {"window": 100})
+    time.sleep(0.1)
+
+    max_outbox, broker.max_outbox = broker.max_outbox, 2**16
+    try:
+        producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+        for value in values:
+            producer.push(value)
+        time.sleep(0.2)
+
+        def recv_exact(size):
+            data = b""
+            while len(data) < size:
+                data += slow.recv(size - len(data))
+            return data
+
+        slow.settimeout(5)
+        received = []
+        for seq, _ in enumerate(values, 1):
+            size = int.from_bytes(recv_exact(3)[1:], "big")
+            received.append(json.loads(recv_exact(size))["message"])
+            CDProto.send_msg(slow, "ack", 0, message=seq)
+        assert received == values  # só é numerado o que segue: os acks batem certo
+        assert broker.metrics.redelivered == redelivered
+    finally:
+        broker.max_outbox = max_outbox
+        slow.close()
+
+
+def test_window_never_drops(broker):
+    topic = "/acks/overflow"
+    max_held, broker.max_held = broker.max_held, 3
+    slow_disconnects = broker.metrics.slow_disconnects
+    try:
+        consumer = JSONQueue(topic, window=1)
+        producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+        time.sleep(0.1)
+
+        for value in range(1, 7):
+            producer.push(value)
+        time.sleep(0.2)  # com a janela cheia o broker retém mais de max_held valores
+        assert [consumer.pull() for _ in range(6)] == [(topic, value) for value in range(1, 7)]
+        assert broker.metrics.slow_disconnects == slow_disconnects
+    finally:
+        broker.max_held = max_held
+
+
+def test_window_with_burst(broker):
+    topic = "/acks/burst"
+    consumer = JSONQueue(topic, window=8)
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    producer.push_many(range(3000))  # mais do que max_held de uma vez
+    assert [consumer.pull() for _ in range(3000)] == [(topic, value) for value in range(3000)]
+
+
+def test_pull_after_broker_closed():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("localhost", 0))
+    server.listen()
+    pulled = threading.Event()
+
+    def fake_broker():
+        conn, _ = server.accept()
+        conn.recv(2**16)  # hello
+        CDProto.send_msg(conn, "hello", 0, message=[])
+        conn.recv(2**16)  # subscribe
+        CDProto.send_msg(conn, "publish", 0, "/closed", 1)
+        pulled.wait(5)
+        # fecha com RST, como um broker que caiu
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        conn.close()
+
+    thread = threading.Thread(target=fake_broker, daemon=True)
+    thread.start()
+    consumer = JSONQueue("/closed", port=server.getsockname()[1], window=1)
+    assert consumer.pull() == ("/closed", 1)
+    pulled.set()
+    thread.join(timeout=5)
+    assert consumer.pull() is None  # o ack falha, mas pull() diz apenas que acabou
+    server.close()
+
+
+def test_window_opened_by_first_subscription(broker):
+    plain = JSONQueue("/acks/mixed")
+    with pytest.raises(ValueError):
+        JSONQueue("/acks/mixed/other", connection=plain.connection, window=4)
+
+    windowed = JSONQueue("/acks/mixed", window=4)
+    JSONQueue("/acks/mixed/other", connection=windowed.connection)
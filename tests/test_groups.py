@@ -0,0 +1,100 @@
+"""Test consumer groups."""
+import threading
+import time
+from unittest.mock import MagicMock
+
+from src.broker import Serializer
+from src.groups import Group
+from src.middleware import JSONQueue, MiddlewareType
+from src.protocol import LEAST_LOADED
+
+
+def test_round_robin_rebalances_on_leave():
+    group = Group("g", "/t")
+    for member in "abc":
+        group.join(member, None)
+
+    assert [group.pick()[0] for _ in range(4)] == ["a", "b", "c", "a"]
+    group.leave("a")  # a vez era do b
+    assert [group.pick()[0] for _ in range(3)] == ["b", "c", "b"]
+    group.leave("c")
+    assert [group.pick()[0] for _ in range(2)] == ["b", "b"]
+
+
+def test_least_loaded_rotates_ties():
+    group = Group("g", "/t", LEAST_LOADED)
+    for member in "abc":
+        group.join(member, None)
+    load = {"a": 5, "b": 0, "c": 0}
+
+    assert [group.pick(load.get)[0] for _ in range(4)] == ["b", "c", "b", "c"]
+    load["a"] = 0
+    assert group.pick(load.get)[0] == "a"
+
+
+def test_group_shares_values(broker):
+    topic = "/groups/shared"
+    members = [JSONQueue(topic, group="workers") for _ in range(3)]
+    everyone = JSONQueue(topic)
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+
+    for value in range(30):
+        producer.push(value)
+    assert [everyone.pull()[1] for _ in range(30)] == list(range(30))
+    received = [[member.pull()[1] for _ in range(10)] for member in members]
+    assert sorted(sum(received, [])) == list(range(30))
+
+    # quem sai deixa de ter vez: os outros recebem tudo
+    members[0].cancel()
+    members[1].connection.close()
+    time.sleep(0.1)
+    for value in range(30, 40):
+        producer.push(value)
+    assert [members[2].pull()[1] for _ in range(10)] == list(range(30, 40))
+
+
+def test_group_removed_with_last_member(broker):
+    member = MagicMock()
+    broker.subscribe("/groups/empty", member, Serializer.JSON, group="g")
+    assert ("/groups/empty", "g") in broker.groups
+
+    broker.unsubscribe_all(member)
+    assert ("/groups/empty", "g") not in broker.groups
+    assert broker.list_subscriptions("/groups/empty") is None
+
+
+def test_group_scales_out(broker):
+    topic = "/groups/scale"
+    events = 60
+    work = 0.005  # segundos de trabalho por valor
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+
+    def consume(members):
+        queues = [JSONQueue(topic, group=f"scale{members}") for _ in range(members)]
+        time.sleep(0.1)
+        done = []
+
+        def run(queue):
+            for _ in range(events // members):
+                queue.pull()
+                time.sleep(work)
+            done.append(queue)
+
+        threads = [threading.Thread(target=run, args=(queue,), daemon=True) for queue in queues]
+        for thread in threads:
+            thread.start()
+        start = time.monotonic()
+        for value in range(events):
+            producer.push(value)
+        for thread in threads:
+            thread.join(timeout=5)
+        elapsed = time.monotonic() - start
+        for queue in queues:
+            queue.connection.close()
+        assert len(done) == members
+        return elapsed
+
+    one = consume(1)
+    four = consume(4)
+    assert one / four > 2  # quatro membros dividem o trabalho por quatro
@@ -0,0 +1,82 @@
+"""Test the in-memory topic history."""
+import threading
+import time
+
+from src.broker import Broker
+from src.history import History
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+from src.protocol import CDProto, Frame
+
+PORT = 5301
+
+
+def _frame(value):
+    return CDProto.encode_msg("publish", 2, "/t", value, True)
+
+
+def _values(frames):
+    return [CDProto.decode_msg(payload, serializer).message for serializer, payload in frames]
+
+
+def test_capacity_and_sequences():
+    history = History(capacity=4)
+    for i in range(10):
+        assert history.append("/t", _frame(i)) == i
+
+    assert history.end("/t") == 10
+    assert _values(history.read("/t")) == [6, 7, 8, 9]
+    assert _values(history.read("/t", last=2)) == [8, 9]
+    assert _values(history.read("/t", since=8)) == [8, 9]
+    assert _values(history.read("/t", since=0)) == [6, 7, 8, 9]
+    assert _values(history.read("/t", last=3, since=8)) == [8, 9]
+    assert history.read("/t", since=10) == []
+    assert history.read("/other", last=5) == []
+
+
+def test_frames_kept_apart():
+    history = History(capacity=4)
+    payload = CDProto.encode_payload("publish", 2, "/t", "x" * 2**17)
+    history.append("/t", Frame(*CDProto.frame_parts(2, payload, True)))
+    history.append("/t", _frame(1))
+    assert _values(history.read("/t")) == ["x" * 2**17, 1]
+
+
+def test_bytes_are_capped():
+    frame = _frame("x" * 100)
+    history = History(capacity=1000, max_bytes=10 * len(frame) + 50)
+    for _ in range(3):
+        for i in range(50):
+            history.append("/t", _frame(str(i) * (100 // len(str(i)))))
+
+    ring = history._rings["/t"]
+    assert len(ring.data) <= history.max_bytes
+    assert _values(history.read("/t")) == [str(i) * (100 // len(str(i))) for i in range(40, 50)]
+
+    # uma trama maior que o limite esvazia o histórico em vez de ficar guardada
+    assert history.append("/t", _frame("x" * 2000)) == 150
+    assert history.read("/t") == []
+    assert history.append("/t", _frame(1)) == 151
+    assert _values(history.read("/t", since=0)) == [1]
+
+
+def test_subscribe_last_and_since():
+    broker = Broker(port=PORT, history=History(capacity=8))
+    thread = threading.Thread(target=broker.run, daemon=True)
+    thread.start()
+    try:
+        producer = PickleQueue("/history", _type=MiddlewareType.PRODUCER, port=PORT)
+        for i in range(20):
+            producer.push(i)
+        time.sleep(0.1)
+
+        consumer = JSONQueue("/history", port=PORT, last=3)
+        assert [consumer.pull()[1] for _ in range(3)] == [17, 18, 19]
+
+        consumer = PickleQueue("/history", port=PORT, since=15)
+        assert [consumer.pull()[1] for _ in range(5)] == [15, 16, 17, 18, 19]
+        producer.push(20)
+        assert consumer.pull() == ("/history", 20)
+        assert consumer.since == 21
+    finally:
+        broker.canceled = True
+        thread.join(timeout=5)
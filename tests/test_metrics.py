@@ -0,0 +1,83 @@
+"""Test the metrics of the broker."""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from src.aiobroker import AsyncBroker
+from src.aiomiddleware import AsyncJSONQueue
+from src.broker import Broker
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue, XMLQueue
+
+PORT = 5302
+METRICS_PORT = 5303
+
+
+def test_stats_command(broker):
+    topic = "/metrics/stats"
+    before = JSONQueue(topic, _type=MiddlewareType.PRODUCER).stats()
+    consumer = PickleQueue(topic)
+    producer = JSONQueue(topic, _type=MiddlewareType.PRODUCER)
+    for i in range(3):
+        producer.push(i)
+    assert [consumer.pull() for _ in range(3)] == [(topic, i) for i in range(3)]
+
+    stats = producer.stats()
+    assert stats[f'published{{topic="{topic}"}}'] == 3
+    assert stats[f'subscribers{{topic="{topic}"}}'] == 1
+    assert stats["messages_out"] - before["messages_out"] >= 3
+    assert stats["subscribes"] - before["subscribes"] == 1
+    assert stats["connections_open"] >= 2
+    # em XML os valores chegam como texto
+    assert XMLQueue(topic, _type=MiddlewareType.PRODUCER).stats()[f'published{{topic="{topic}"}}'] == "3"
+
+    async def _stats():
+        async with AsyncJSONQueue(topic, _type=MiddlewareType.PRODUCER) as queue:
+            return await queue.stats()
+
+    assert asyncio.run(_stats())[f'published{{topic="{topic}"}}'] == 3
+
+
+def test_dropped_and_unsubscribe(broker):
+    topic = "/metrics/dropped"
+    before = broker.stats()
+    consumer = JSONQueue(topic)
+    producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+    producer.push(b"\x00")  # bytes não existem em JSON
+    consumer.cancel()
+    time.sleep(0.1)
+
+    stats = broker.stats()
+    assert stats["messages_dropped"] - before["messages_dropped"] == 1
+    assert stats["unsubscribes"] - before["unsubscribes"] == 1
+    assert f'subscribers{{topic="{topic}"}}' not in stats
+
+
+@pytest.mark.parametrize("engine", [Broker, AsyncBroker])
+def test_scrape_endpoint(engine):
+    broker = engine(port=PORT, metrics_port=METRICS_PORT)
+    thread = threading.Thread(target=broker.run, daemon=True)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        producer = JSONQueue("/scrape", _type=MiddlewareType.PRODUCER, port=PORT)
+        producer.push(1)
+        time.sleep(0.1)
+
+        with socket.create_connection(("localhost", METRICS_PORT)) as sock:
+            sock.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b""
+            while data := sock.recv(4096):
+                response += data
+
+        header, body = response.split(b"\r\n\r\n", 1)
+        assert header.startswith(b"HTTP/1.0 200 OK")
+        lines = body.decode().splitlines()
+        assert "broker_connections_open 1" in lines
+        assert 'broker_published{topic="/scrape"} 1' in lines
+        assert "broker_messages_in 2" in lines  # hello e publish
+    finally:
+        broker.canceled = True
+        thread.join(timeout=5)
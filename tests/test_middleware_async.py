@@ -0,0 +1,185 @@
+"""Test the asyncio queues and clients."""
+import asyncio
+import random
+import string
+
+import pytest
+
+from src.aiomiddleware import (
+    AsyncBinaryQueue, AsyncConnection, AsyncJSONQueue, AsyncPickleQueue, AsyncXMLQueue,
+)
+from src.clients import AsyncConsumer, AsyncProducer
+from src.middleware import MiddlewareType, PickleQueue
+
+TOPIC = "/" + "".join(random.sample(string.ascii_lowercase, 6))
+
+
+def gen():
+    while True:
+        yield random.randint(0, 100)
+
+
+def test_push_and_async_for(broker):
+    async def main():
+        async with AsyncJSONQueue(TOPIC) as consumer, \
+                AsyncXMLQueue(TOPIC) as consumer_xml, \
+                AsyncBinaryQueue(TOPIC, _type=MiddlewareType.PRODUCER) as producer:
+            for value in range(5):
+                await producer.push(value)
+            await producer.push_many(range(5, 10))
+
+            received = []
+            async for topic, value in consumer:
+                assert topic == TOPIC
+                received.append(value)
+                if len(received) == 10:
+                    break
+            assert received == list(range(10))
+            assert [int((await consumer_xml.pull())[1]) for _ in range(10)] == list(range(10))
+
+            assert TOPIC in await consumer.list_topics()
+
+    asyncio.run(main())
+
+
+def test_interoperates_with_blocking_queues(broker):
+    topic = TOPIC + "/sync"
+
+    async def main():
+        async with AsyncPickleQueue(topic) as consumer:
+            producer = PickleQueue(topic, _type=MiddlewareType.PRODUCER)
+            producer.push({"t": 1})
+            assert await consumer.pull() == (topic, {"t": 1})
+
+    asyncio.run(main())
+
+
+def test_async_clients(broker):
+    topic = TOPIC + "/clients"
+
+    async def main():
+        consumers = [AsyncConsumer(topic) for _ in range(100)]
+        await asyncio.gather(*(consumer.connect() for consumer in consumers))
+
+        producer = AsyncProducer(topic, gen)
+        await producer.run(10)
+        await asyncio.gather(*(consumer.run(10) for consumer in consumers))
+
+        assert all(consumer.received == producer.produced for consumer in consumers)
+
+    asyncio.run(main())
+
+
+def test_compression(broker):
+    topic = TOPIC + "/compressed"
+    value = "Valeu a pena? Tudo vale a pena " * 100
+
+    async def main():
+        async with AsyncPickleQueue(topic, compression="zlib") as consumer, \
+                AsyncJSONQueue(topic, _type=MiddlewareType.PRODUCER,
+                               compression="zlib") as producer:
+            assert producer.compression == "zlib"
+            await producer.push(value)
+            await producer.push_many([value, 1])
+            assert [await consumer.pull() for _ in range(3)] == [
+                (topic, value), (topic, value), (topic, 1)]
+
+    asyncio.run(main())
+
+
+def test_acknowledged_delivery(broker):
+    topic = TOPIC + "/acked"
+
+    async def main():
+        async with AsyncJSONQueue(topic, window=4) as consumer, \
+                AsyncJSONQueue(topic, _type=MiddlewareType.PRODUCER) as producer:
+            await asyncio.sleep(0.1)
+            acked = broker.metrics.acked
+            await producer.push_many(range(20))
+            assert [(await consumer.pull())[1] for _ in range(20)] == list(range(20))
+            await consumer.ack()
+            await asyncio.sleep(0.1)
+            assert broker.metrics.acked - acked == 20
+
+    asyncio.run(main())
+
+
+def test_request_while_not_pulling(broker):
+    topic = TOPIC + "/prefetch"
+
+    async def main():
+        consumer = AsyncJSONQueue(topic)
+        consumer.max_prefetch = 10
+        async with consumer, AsyncJSONQueue(topic, _type=MiddlewareType.PRODUCER) as producer:
+            await asyncio.sleep(0.1)
+            await producer.push_many(range(50))
+            await asyncio.sleep(0.1)  # a fila enche e o consumidor deixa de ler
+
+            # a resposta vem atrás dos valores que ainda não foram lidos
+            assert topic in await asyncio.wait_for(consumer.list_topics(), 5)
+            assert [(await consumer.pull())[1] for _ in range(50)] == list(range(50))
+
+    asyncio.run(main())
+
+
+def test_idle_topic_does_not_starve_others(broker):
+    topic = TOPIC + "/starve"
+
+    async def main():
+        async with AsyncConnection(AsyncJSONQueue.ser_type) as connection:
+            idle = await AsyncJSONQueue(topic + "/a", connection=connection).connect()
+            busy = await AsyncJSONQueue(topic + "/b", connection=connection).connect()
+            idle.max_prefetch = busy.max_prefetch = 10
+            async with AsyncJSONQueue(topic, _type=MiddlewareType.PRODUCER) as producer:
+                await asyncio.sleep(0.1)
+                producer.topic = topic + "/a"
+                values = [f"{i:04}" + "x" * 1000 for i in range(300)]
+                await producer.push_many(values)
+                producer.topic = topic + "/b"
+                await producer.push(1)
+                await asyncio.sleep(0.1)  # a fila de /a enche e a leitura pára
+
+                # a mensagem de /b vem atrás das de /a que ninguém lê
+                assert await asyncio.wait_for(busy.pull(), 5) == (topic + "/b", 1)
+                assert [(await idle.pull())[1] for _ in values] == values
+
+    asyncio.run(main())
+
+
+def test_shared_connection(broker):
+    topic = TOPIC + "/shared"
+
+    async def main():
+        connections = len(broker.channels)
+        async with AsyncConnection(AsyncJSONQueue.ser_type) as connection:
+            queue_a = await AsyncJSONQueue(topic + "/a", connection=connection).connect()
+            queue_b = await AsyncJSONQueue(topic + "/b", connection=connection).connect()
+            queue_all = await AsyncJSONQueue(topic, connection=connection).connect()
+            producer = AsyncProducer([topic + "/a", topic + "/b"], lambda: iter([1, 2]),
+                                     AsyncJSONQueue)
+            await producer.connect()
+            await asyncio.sleep(0.1)
+
+            assert len(broker.channels) == connections + 2  # consumidores e produtor
+            assert len({queue.connection for queue in producer.queue}) == 1
+            assert len(broker.list_subscriptions(topic + "/a")) == 1
+
+            await producer.run(2)
+            assert [await queue_a.pull(), await queue_a.pull()] == [(topic + "/a", 1)] * 2
+            assert [await queue_b.pull(), await queue_b.pull()] == [(topic + "/b", 2)] * 2
+            assert [await queue_all.pull() for _ in range(4)] == [
+                (topic + "/a", 1), (topic + "/b", 2), (topic + "/a", 1), (topic + "/b", 2)
+            ]
+
+            await queue_b.cancel()
+            await producer.run(1)
+            assert await queue_a.pull() == (topic + "/a", 1)
+            assert await queue_all.pull() == (topic + "/a", 1)
+            await asyncio.sleep(0.1)
+            assert not queue_b.messages
+
+            with pytest.raises(ValueError):
+                AsyncPickleQueue(topic, connection=connection)
+            await producer.queue[0].connection.close()
+
+    asyncio.run(main())
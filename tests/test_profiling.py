@@ -0,0 +1,87 @@
+"""Test the event loop instrumentation."""
+import logging
+import pstats
+import socket
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from src.aiobroker import AsyncBroker
+from src.broker import Broker
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+from src.profiling import LoopProfiler, profiled
+
+PORT = 5304
+
+
+def test_histograms_and_slow_callbacks(caplog):
+    profiler = LoopProfiler(slow=0.01)
+
+    def read(conn, mask):
+        decode = profiler.timed("decode", lambda: time.sleep(0.02))
+        decode()
+
+    profiler.call(lambda conn, mask: None, "fast", 1)
+    with caplog.at_level(logging.WARNING):
+        profiler.call(read, "client", 1)
+
+    stats = profiler.snapshot()
+    assert stats['loop_callback_seconds_count{callback="read"}'] == 1
+    assert stats['loop_callback_seconds_bucket{callback="read",le="0.01"}'] == 0
+    assert stats['loop_callback_seconds_bucket{callback="read",le="0.05"}'] == 1
+    assert stats['loop_phase_seconds_count{phase="decode"}'] == 1
+    assert "slow callback read on client" in caplog.text
+    assert "decode" in caplog.text
+
+
+@pytest.mark.parametrize("engine", [Broker, AsyncBroker])
+def test_broker_phases(engine):
+    idle = engine(port=PORT)
+    assert "send" not in vars(idle)  # sem profiler nada é embrulhado
+    idle.sock.close()
+
+    broker = engine(port=PORT + 1, profiler=LoopProfiler())
+    thread = threading.Thread(target=broker.run, daemon=True)
+    thread.start()
+    try:
+        time.sleep(0.2)
+        consumer = JSONQueue("/profiled", port=PORT + 1)
+        producer = PickleQueue("/profiled", _type=MiddlewareType.PRODUCER, port=PORT + 1)
+        producer.push(1)
+        assert consumer.pull() == ("/profiled", 1)
+
+        stats = broker.stats()
+        for phase in ("decode", "route", "encode", "send"):
+            assert stats[f'loop_phase_seconds_count{{phase="{phase}"}}'] > 0
+        callback = "read" if engine is Broker else "received"
+        assert stats[f'loop_callback_seconds_count{{callback="{callback}"}}'] > 0
+        assert "phase" in broker.profiler.report()
+    finally:
+        broker.canceled = True
+        thread.join(timeout=5)
+
+
+@pytest.mark.parametrize("engine", [Broker, AsyncBroker])
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_report_on_exit(engine, caplog):
+    broker = engine(port=PORT + 2, profiler=LoopProfiler())
+    client = socket.create_connection(("localhost", PORT + 2))
+    client.settimeout(5)
+    thread = threading.Thread(target=broker.run, daemon=True)
+    # Ctrl+C sai do loop por sys.exit, sem passar por canceled
+    with caplog.at_level(logging.INFO), patch.object(broker, "tick", side_effect=SystemExit):
+        thread.start()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert "event loop of the broker" in caplog.text
+    assert broker.sock.fileno() == -1
+    assert client.recv(1) == b""  # as conexões também foram fechadas
+    client.close()
+
+
+def test_profiled_dumps_stats(tmp_path):
+    path = tmp_path / "broker.prof"
+    assert profiled(lambda: sum(range(1000)), str(path)) == 499500
+    assert pstats.Stats(str(path)).total_calls > 0
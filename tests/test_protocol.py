@@ -0,0 +1,230 @@
+"""Test message framing and decoding."""
+import json
+import pickle
+import zlib
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.protocol import (
+    COMPRESSED, COMPRESSORS, CONFLATE, EXTENDED, Ack, CDProto, CDProtoBadFormat, Credit,
+    FrameDecoder, Publish, PublishBatch, Subscribe, accept_features, inflate, register_compressor,
+)
+
+
+def test_decoder_split_frames():
+    frames = b"".join(
+        CDProto.encode_msg("publish", ser, "/t", i) for i, ser in enumerate([0, 1, 2])
+    )
+    decoder = FrameDecoder()
+    received = []
+
+    # entrega byte a byte: cabeçalhos e corpos ficam partidos
+    for i in range(len(frames)):
+        decoder.feed(frames[i : i + 1])
+        received += decoder.frames()
+
+    assert [header for header, _ in received] == [0, 1, 2]
+    assert [CDProto.decode_msg(payload, header).message for header, payload in received] == [
+        0, "1", 2
+    ]
+    assert len(decoder) == 0
+
+
+def test_decoder_many_frames_in_one_chunk():
+    frames = [CDProto.encode_msg("publish", 0, "/t", i) for i in range(100)]
+    decoder = FrameDecoder()
+
+    decoder.feed(b"".join(frames) + frames[0][:5])
+
+    assert len(decoder.frames()) == 100
+    assert len(decoder) == 5
+
+
+def test_extended_frames():
+    value = "x" * 2**17
+
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.encode_msg("publish", 0, "/t", value)
+
+    small = CDProto.encode_msg("publish", 2, "/t", 1, extended=True)
+    large = CDProto.encode_msg("publish", 2, "/t", value, extended=True)
+    assert small[0] == 2  # só as mensagens grandes usam tramas estendidas
+    assert large[0] == 2 | EXTENDED
+    assert int.from_bytes(large[1:5], "big") == len(large) - 5
+
+    decoder = FrameDecoder()
+    frames = small + large + small
+    for i in range(0, len(frames), 1000):
+        decoder.feed(frames[i : i + 1000])
+    received = decoder.frames()
+    assert [header for header, _ in received] == [2, 2, 2]
+    assert CDProto.decode_msg(received[1][1], 2).message == value
+
+
+def test_decoder_refuses_frames():
+    large = CDProto.encode_msg("publish", 2, "/t", "x" * 2**17, extended=True)
+    decoder = FrameDecoder(extended=False)  # frame32 não foi negociado
+    decoder.feed(large[:5])
+    with pytest.raises(CDProtoBadFormat):
+        decoder.frames()
+
+    decoder = FrameDecoder(2**16)
+    decoder.feed(large[:5])  # o tamanho declarado chega para recusar, sem esperar pelo payload
+    with pytest.raises(CDProtoBadFormat):
+        decoder.frames()
+
+
+def test_compressed_frames():
+    value = "Valeu a pena? Tudo vale a pena " * 100
+    small = CDProto.encode_msg("publish", 0, "/t", "x", compression="zlib")
+    large = CDProto.encode_msg("publish", 0, "/t", value, compression="zlib")
+    assert small[0] == 0  # abaixo de COMPRESS_MIN não compensa
+    assert large[0] == 0 | COMPRESSED
+    assert len(large) < len(CDProto.encode_msg("publish", 0, "/t", value)) // 10
+    assert CDProto.compress_frame(CDProto.encode_msg("publish", 0, "/t", value), "zlib") == large
+
+    decoder = FrameDecoder()
+    decoder.feed(small + large)
+    assert [header for header, _ in decoder.frames()] == [0, 0 | COMPRESSED]  # sem decompress
+
+    decoder.decompress = COMPRESSORS["zlib"][1]
+    decoder.feed(large)
+    [(header, payload)] = decoder.frames()
+    assert CDProto.decode_msg(payload, header).message == value
+
+    # mensagens grandes demais para 2 bytes de tamanho podem caber depois de comprimidas
+    assert CDProto.encode_msg("publish", 0, "/t", "x" * 2**17, compression="zlib")[0] == COMPRESSED
+
+
+def test_decompression_is_bounded():
+    bomb = CDProto.encode_frame(0, zlib.compress(b" " * 2**20), True)
+    bomb = bytes([bomb[0] | COMPRESSED]) + bomb[1:]
+    decoder = FrameDecoder(2**16)
+    decoder.decompress = COMPRESSORS["zlib"][1]
+
+    decoder.feed(bomb)
+    [(header, _)] = decoder.frames()
+    assert header & COMPRESSED  # recusada: nenhum codec a aceita
+
+    with pytest.raises(ValueError):
+        inflate(zlib.compress(b"x" * 100)[:-4], 2**16)  # truncado
+    assert inflate(zlib.compress(b"x" * 100), 100) == b"x" * 100
+
+
+def test_compressor_hook():
+    with patch.dict(COMPRESSORS):
+        register_compressor("reverse", lambda data: data[::-1][:-1],
+                            lambda data, max_size: data[::-1][:max_size])
+        assert accept_features(["frame32", "lz4", "reverse", "zlib"]) == ["frame32", "reverse"]
+        assert accept_features(["lz4"]) == []
+
+
+def test_encode_batch_splits_frames():
+    values = list(range(50000))
+
+    for serializer in [0, 1, 2]:
+        frames = CDProto.encode_batch(serializer, "/t", values)
+        assert len(frames) > 1
+
+        decoder = FrameDecoder()
+        decoder.feed(b"".join(frames))
+        received = []
+        for header, payload in decoder.frames():
+            msg = CDProto.decode_msg(payload, header)
+            assert isinstance(msg, PublishBatch)
+            received += [int(value) for value in msg.messages]
+        assert received == values
+
+
+def test_xml_lists():
+    frame = CDProto.encode_msg("listTopics", 1, message=["/a", "/b"])
+
+    assert CDProto.decode_msg(frame[3:], 1).dict() == {"command": "listTopics", "topics": ["/a", "/b"]}
+
+
+def test_binary_roundtrip():
+    values = [None, True, False, 0, -1, 127, 128, -129, 2**31, 2**63, -(2**70),
+              1.5, "abc", "é" * 300, b"\x00\xff", [1, "a", [2]], {"a": 1, 2: [None]}]
+
+    for value in values:
+        frame = CDProto.encode_msg("publish", 3, "/t", value)
+        assert CDProto.decode_msg(frame[3:], frame[0]).message == value
+
+    assert len(CDProto.encode_msg("publish", 3, "/temp", 21)) < len(
+        CDProto.encode_msg("publish", 0, "/temp", 21)
+    )
+
+
+def test_decode_dispatches_on_header():
+    frame = CDProto.encode_msg("publish", 1, "/t", 5)
+
+    with patch("json.loads", MagicMock(side_effect=json.loads)) as json_load:
+        with patch("pickle.loads", MagicMock(side_effect=pickle.loads)) as pickle_load:
+            msg = CDProto.decode_msg(frame[3:], frame[0])
+
+            assert json_load.call_count == 0
+            assert pickle_load.call_count == 0
+
+    assert isinstance(msg, Publish)
+    assert (msg.topic, msg.message) == ("/t", "5")
+
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode_msg(frame[3:], 0)  # XML com cabeçalho de JSON
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode_msg(frame[3:], 9)
+
+
+@pytest.mark.parametrize("serializer", [0, 1, 2, 3])
+def test_flow_control_messages(serializer):
+    frame = CDProto.encode_msg("subscribe", serializer, "/t", {"credits": 8, "policy": CONFLATE})
+    msg = CDProto.decode_msg(frame[3:], frame[0])
+    assert isinstance(msg, Subscribe)
+    assert (msg.credits, msg.policy) == (8, CONFLATE)
+
+    frame = CDProto.encode_msg("credit", serializer, message=4)
+    msg = CDProto.decode_msg(frame[3:], frame[0])
+    assert isinstance(msg, Credit)
+    assert msg.credits == 4
+
+    frame = CDProto.encode_msg("subscribe", serializer, "/t", {"window": 16, "session": "s1"})
+    msg = CDProto.decode_msg(frame[3:], frame[0])
+    assert (msg.window, msg.session) == (16, "s1")
+
+    frame = CDProto.encode_msg("ack", serializer, message=42)
+    msg = CDProto.decode_msg(frame[3:], frame[0])
+    assert isinstance(msg, Ack)
+    assert msg.seq == 42
+
+    frame = CDProto.encode_msg("subscribe", serializer, "/t", {"policy": "ignore"})
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode_msg(frame[3:], frame[0])
+
+
+def test_malformed_batch():
+    for msg in ({"command": "publishBatch", "topic": "/t", "messages": 5},
+                {"command": "publishBatch", "topic": 5, "messages": [1]}):
+        with pytest.raises(CDProtoBadFormat):
+            CDProto.message(msg)
+
+
+@pytest.mark.parametrize("command", ["subscribe", "publish", "publishBatch", "unsubscribe"])
+def test_topic_must_be_str(command):
+    for topic in (5, None, ["/t"], {"a": 1}):
+        msg = {"command": command, "topic": topic, "message": 1, "messages": [1]}
+        with pytest.raises(CDProtoBadFormat):
+            CDProto.message(msg)
+
+
+def test_send_parts_gathers_without_joining():
+    frames = [CDProto.encode_msg("publish", 0, "/t", "x" * size, extended=True)
+              for size in (10, 70000, 300)]
+    assert CDProto.encode_frame(0, b"abc") == b"".join(CDProto.frame_parts(0, b"abc"))
+
+    data = b"".join(frames)
+    sock = MagicMock()
+    sock.sendmsg.side_effect = [5, 70000, len(data) - 70005]  # o kernel aceita só uma parte
+    CDProto.send_parts(sock, frames)
+
+    written = [b"".join(call.args[0]) for call in sock.sendmsg.call_args_list]
+    assert written == [data, data[5:], data[70005:]]
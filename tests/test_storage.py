@@ -0,0 +1,109 @@
+"""Test the durable topic log."""
+import os
+import resource
+import threading
+import time
+
+from src.broker import Broker
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+from src.protocol import CDProto
+from src.storage import TopicLog
+
+PORT = 5300
+
+
+def _frame(serializer, value):
+    return CDProto.encode_msg("publish", serializer, "/t", value, True)
+
+
+def _values(log, topic, offset=0):
+    return [CDProto.decode_msg(payload, serializer).message
+            for serializer, payload in log.read(topic, offset)]
+
+
+def test_append_and_read_from_offset(tmp_path):
+    log = TopicLog(str(tmp_path), segment_bytes=1000, index_interval=100)
+    for i in range(300):
+        assert log.append("/t", _frame(i % 3, i)) == i
+
+    assert log.end("/t") == 300
+    assert len(os.listdir(tmp_path / "%2Ft")) > 2 * 2  # vários segmentos e índices
+    assert [int(value) for value in _values(log, "/t")] == list(range(300))
+    assert [int(value) for value in _values(log, "/t", 123)] == list(range(123, 300))
+    assert _values(log, "/t", 300) == []
+    assert _values(log, "/other") == []
+    log.close()
+
+
+def test_reopen_uses_index_and_drops_partial_frame(tmp_path):
+    log = TopicLog(str(tmp_path), segment_bytes=10000, index_interval=100)
+    for i in range(100):
+        log.append("/t", _frame(2, i))
+    log.close()
+
+    segment = sorted(tmp_path.glob("%2Ft/*[0-9]"))[-1]
+    with open(segment, "ab") as file:
+        file.write(_frame(2, 100)[:10])  # escrita interrompida
+
+    log = TopicLog(str(tmp_path), segment_bytes=10000, index_interval=100)
+    assert log.topics() == ["/t"]
+    assert log.end("/t") == 100
+    assert CDProto.decode_msg(log.last("/t")[1], 2).message == 99
+
+    assert log.append("/t", _frame(2, 100)) == 100
+    assert _values(log, "/t", 95) == [95, 96, 97, 98, 99, 100]
+    log.close()
+
+
+def test_many_topics_within_fd_limit(tmp_path):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+    try:
+        log = TopicLog(str(tmp_path), max_open=16)
+        for i in range(2000):
+            assert log.append(f"/many/{i}", _frame(2, i)) == 0
+        for i in (0, 1999):  # tópicos já fechados voltam a ser abertos
+            assert log.append(f"/many/{i}", _frame(2, -i)) == 1
+            assert _values(log, f"/many/{i}") == [i, -i]
+        log.close()
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    log = TopicLog(str(tmp_path), max_open=16)
+    assert len(log.topics()) == 2000
+    assert CDProto.decode_msg(log.last("/many/1999")[1], 2).message == -1999
+    log.close()
+
+
+def test_broker_replays_and_restores_log(tmp_path):
+    def start():
+        broker = Broker(port=PORT, log=TopicLog(str(tmp_path)))
+        thread = threading.Thread(target=broker.run, daemon=True)
+        thread.start()
+        return broker, thread
+
+    broker, thread = start()
+    producer = PickleQueue("/log", _type=MiddlewareType.PRODUCER, port=PORT)
+    for i in range(10):
+        producer.push(i)
+    time.sleep(0.1)
+
+    consumer = JSONQueue("/log", port=PORT, offset=4)
+    assert [consumer.pull()[1] for _ in range(6)] == list(range(4, 10))
+    assert consumer.offset == 10
+
+    broker.canceled = True
+    thread.join(timeout=5)
+    broker.log.close()
+
+    broker, thread = start()
+    try:
+        assert broker.get_topic("/log") == 9
+        producer = PickleQueue("/log", _type=MiddlewareType.PRODUCER, port=PORT)
+        producer.push(10)
+        resumed = JSONQueue("/log", port=PORT, offset=consumer.offset)
+        assert resumed.pull() == ("/log", 10)
+    finally:
+        broker.canceled = True
+        thread.join(timeout=5)
+        broker.log.close()
@@ -10,7 +10,8 @@ from unittest.mock import MagicMock, patch
 import pytest
 
 from src.clients import Consumer, Producer
-from src.middleware import JSONQueue, PickleQueue, XMLQueue
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue, XMLQueue
+from src.topics import TopicTree, matches
 
 root = "/" + "".join(random.sample(string.ascii_lowercase, 6))
 leaf1 = root + "/" + "".join(random.sample(string.ascii_lowercase, 6))
@@ -69,3 +70,49 @@ def test_multiple_producers_to_consumer(consumer_JSON, consumer_Pickle, broker):
     assert root in broker.list_topics()
 
     assert producer3.produced[0] not in consumer_Pickle.received
+
+
+def test_wildcard_index():
+    tree = TopicTree()
+    for pattern in ["/w/+/celsius", "/w/#", "#", "/x/+", "/w/a/celsius"]:
+        tree.add(pattern, (pattern, None))
+
+    def matched(topic):
+        return sorted(address for address, _ in tree.match(topic))
+
+    assert matched("/w") == ["#", "/w/#"]
+    assert matched("/w/a/celsius") == ["#", "/w/#", "/w/+/celsius", "/w/a/celsius"]
+    assert matched("/w/b/celsius/raw") == ["#", "/w/#", "/w/+/celsius"]
+    assert matched("/w/b/kelvin") == ["#", "/w/#"]
+    assert matched("/x") == ["#"]
+    assert matched("/x/y/z") == ["#", "/x/+"]
+
+    tree.remove("#", "#")
+    tree.remove("/w/#", "/w/#")
+    assert matched("/w/a/kelvin") == []
+    assert matches("/w/+/celsius", "/w/a/celsius")
+    assert not matches("/w/+", "/w/a/celsius")
+    assert matches("/w/#", "/w")
+
+
+def test_wildcard_subscriptions(broker):
+    base = root + "/wildcard"
+    single = base + "/+/celsius"
+    multi = base + "/#"
+    producer = JSONQueue(base + "/a/celsius", _type=MiddlewareType.PRODUCER)
+    producer.push(20)
+    time.sleep(0.1)
+
+    consumer_single = PickleQueue(single)
+    consumer_multi = JSONQueue(multi)
+    # o último valor de cada tópico abrangido chega ao subscrever
+    assert consumer_single.pull() == (base + "/a/celsius", 20)
+    assert consumer_multi.pull() == (base + "/a/celsius", 20)
+
+    JSONQueue(base + "/b/kelvin", _type=MiddlewareType.PRODUCER).push(300)
+    producer.push(21)
+
+    assert consumer_single.pull() == (base + "/a/celsius", 21)
+    assert consumer_multi.pull() == (base + "/b/kelvin", 300)
+    assert consumer_multi.pull() == (base + "/a/celsius", 21)
+    assert single not in broker.list_topics()
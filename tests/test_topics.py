@@ -0,0 +1,110 @@
+"""Test the topic index used to route publishes."""
+import pytest
+
+from src.protocol import CDProto, CDProtoBadFormat
+from src.topics import TopicTree, matches
+
+
+def test_match_ancestors():
+    tree = TopicTree()
+    tree.add("/weather2", ("root", None))
+    tree.add("/weather2/temperature", ("temp", None))
+    tree.add("/weather2/humidity", ("hum", None))
+
+    matched = [s[0] for s in tree.match("/weather2/temperature/celsius")]
+
+    assert matched == ["root", "temp"]
+
+
+def test_match_is_not_substring():
+    tree = TopicTree()
+    tree.add("/temp", ("temp", None))
+
+    assert list(tree.match("/weather2/temperature")) == []
+    assert list(tree.match("/temperature")) == []
+    assert list(tree.match("/temp/")) == [("temp", None)]
+
+
+def test_remove_prunes_empty_branches():
+    tree = TopicTree()
+    tree.add("/a/b/c", ("s1", None))
+    tree.add("/a", ("s2", None))
+
+    tree.remove("/a/b/c", "s1")
+
+    assert "/a/b/c" not in tree
+    assert tree.topics() == ["/a"]
+    assert list(tree.match("/a/b/c")) == [("s2", None)]
+
+    tree.remove("/a", "s2")
+    assert len(tree) == 0
+    assert list(tree.match("/a")) == []
+
+
+def test_remove_address():
+    tree = TopicTree()
+    tree.add("/a", ("s1", None))
+    tree.add("/a", ("s2", None))
+    tree.add("/b", ("s1", None))
+
+    tree.remove_address("s1")
+
+    assert tree.get("/a") == [("s2", None)]
+    assert "/b" not in tree
+
+
+def test_resubscribe_replaces_format():
+    tree = TopicTree()
+    tree.add("/a", ("s1", 0))
+    tree.add("/a", ("s1", 2))
+
+    assert tree.get("/a") == [("s1", 2)]
+    tree.remove("/a", "s1")
+    assert "/a" not in tree
+
+
+def test_churn_keeps_other_subscribers():
+    tree = TopicTree()
+    tree.add("/a", ("stays", None))
+    for client in range(1000):
+        for topic in ("/a", f"/a/{client}", f"/b/{client % 10}"):
+            tree.add(topic, (client, None))
+        assert sorted(tree.topics_of(client)) == sorted(["/a", f"/a/{client}", f"/b/{client % 10}"])
+        tree.remove_address(client)
+
+    assert tree.topics() == ["/a"]
+    assert tree.get("/a") == [("stays", None)]
+    assert tree.topics_of(0) == []
+    assert tree._addresses == {"stays": {"/a"}}
+    assert list(tree._root.children[""].children) == ["a"]
+
+
+def test_multi_only_as_last_level():
+    tree = TopicTree()
+    for pattern in ("/weather2/#/celsius", "#/a", "/a/#/#"):
+        with pytest.raises(ValueError):
+            tree.add(pattern, ("s1", None))
+        with pytest.raises(ValueError):
+            matches(pattern, "/weather2/porto/celsius")
+        with pytest.raises(CDProtoBadFormat):
+            CDProto.message({"command": "subscribe", "topic": pattern})
+    assert len(tree) == 0 and tree.topics_of("s1") == []
+
+    tree.add("/weather2/#", ("s1", None))
+    assert matches("/weather2/#", "/weather2/porto/celsius")
+    assert list(tree.match("/weather2/porto/celsius")) == [("s1", None)]
+
+
+def test_trailing_slash_is_the_same_topic():
+    tree = TopicTree()
+    tree.add("/a", ("A", None))
+    tree.add("/a/", ("B", None))
+    assert sorted(tree.get("/a")) == [("A", None), ("B", None)]
+    assert tree.topics() == ["/a"] and tree.topics_of("B") == ["/a"]
+
+    tree.remove("/a", "A")
+    tree.remove("/a/", "B")
+    assert len(tree) == 0 and "/a/" not in tree
+
+    tree.add("/a", ("C", None))  # o nó antigo foi podado: este é novo
+    assert list(tree.match("/a/b")) == [("C", None)]